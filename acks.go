@@ -0,0 +1,428 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"crypto/rand"
+	"encoding/json"
+	"fmt"
+	"io"
+	"io/ioutil"
+	"net/http"
+	"sort"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// How often the acknowledgements of the pending batches are checked
+	defaultAckPollInterval = time.Second
+	// How long a batch can wait for its acknowledgement before it is sent again
+	defaultAckTimeout = 30 * time.Second
+)
+
+const (
+	envVarAckPollInterval = "SPLUNK_LOGGING_DRIVER_ACK_POLL_INTERVAL"
+	envVarAckTimeout      = "SPLUNK_LOGGING_DRIVER_ACK_TIMEOUT"
+)
+
+const (
+	// HEC returns no ack id when indexer acknowledgement is disabled for the token
+	noAckID = -1
+
+	splunkChannelHeader = "X-Splunk-Request-Channel"
+)
+
+// batchAck identifies the acknowledgement of a batch, ack ids are only unique per endpoint
+type batchAck struct {
+	endpoint *hecEndpoint
+	id       int64
+}
+
+var noAck = batchAck{id: noAckID}
+
+// hecResponse is the body of the responses of the event endpoint
+type hecResponse struct {
+	Text  string `json:"text"`
+	Code  int    `json:"code"`
+	AckID *int64 `json:"ackId"`
+}
+
+type ackRequest struct {
+	Acks []int64 `json:"acks"`
+}
+
+type ackResponse struct {
+	Acks map[string]bool `json:"acks"`
+}
+
+type pendingAck struct {
+	// position of the batch in the order it was first sent, kept when it is sent again
+	seq  uint64
+	sent time.Time
+	// nil for spooled batches, the spool keeps them
+	messages []*splunkMessage
+	// answered for spooled batches, true when acknowledged
+	done chan bool
+}
+
+/*
+ackTracker implements indexer acknowledgement for one logger. Batches accepted by
+HEC are kept here until the indexers acknowledge them, while the worker keeps
+sending the next ones. The ack ids of all the pending batches are checked with one
+request per endpoint every poll interval. A batch which is not acknowledged before the timeout
+is sent again, so delivery is at least once.
+*/
+type ackTracker struct {
+	hec          *hecClient
+	pollInterval time.Duration
+	timeout      time.Duration
+
+	mu      sync.Mutex
+	pending map[batchAck]*pendingAck
+	// batches to send again, oldest first
+	resend []*pendingAck
+	seq    uint64
+	// number of messages in the pending batches
+	pendingMessages int
+	// closed and replaced every time batches are acknowledged or given up on
+	changed chan struct{}
+	stop    chan struct{}
+	wg      sync.WaitGroup
+
+	// metrics, updated atomically
+	ackedBatches   int64
+	resentBatches  int64
+	pendingBatches int64
+}
+
+// newChannelID returns a random uuid, HEC requires a channel per client sending with acknowledgement
+func newChannelID() (string, error) {
+	var b [16]byte
+	if _, err := rand.Read(b[:]); err != nil {
+		return "", err
+	}
+	b[6] = b[6]&0x0f | 0x40
+	b[8] = b[8]&0x3f | 0x80
+	return fmt.Sprintf("%x-%x-%x-%x-%x", b[0:4], b[4:6], b[6:8], b[8:10], b[10:16]), nil
+}
+
+func newAckTracker(hec *hecClient) *ackTracker {
+	t := &ackTracker{
+		hec:          hec,
+		pollInterval: getAdvancedOptionDuration(envVarAckPollInterval, defaultAckPollInterval),
+		timeout:      getAdvancedOptionDuration(envVarAckTimeout, defaultAckTimeout),
+		pending:      make(map[batchAck]*pendingAck),
+		changed:      make(chan struct{}),
+		stop:         make(chan struct{}),
+	}
+	t.wg.Add(1)
+	go t.run()
+	return t
+}
+
+func (t *ackTracker) run() {
+	defer t.wg.Done()
+	ticker := time.NewTicker(t.pollInterval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-t.stop:
+			return
+		case <-ticker.C:
+			if err := t.poll(); err != nil {
+				logrus.WithError(err).Warn("Cannot check indexer acknowledgements")
+			}
+			t.resendExpired(time.Now())
+		}
+	}
+}
+
+// track keeps a batch accepted by HEC until it is acknowledged
+func (t *ackTracker) track(ack batchAck, messages []*splunkMessage) {
+	t.mu.Lock()
+	t.seq++
+	// the worker reuses the slice
+	kept := make([]*splunkMessage, len(messages))
+	copy(kept, messages)
+	t.addLocked(ack, &pendingAck{seq: t.seq, sent: time.Now(), messages: kept})
+	dropped := t.trimLocked()
+	t.mu.Unlock()
+	for _, messages := range dropped {
+		t.hec.dropMessages(messages)
+	}
+}
+
+// trackSpooled returns a channel which tells if the spooled batch was acknowledged
+func (t *ackTracker) trackSpooled(ack batchAck) chan bool {
+	done := make(chan bool, 1)
+	t.mu.Lock()
+	t.seq++
+	t.addLocked(ack, &pendingAck{seq: t.seq, sent: time.Now(), done: done})
+	t.mu.Unlock()
+	return done
+}
+
+func (t *ackTracker) addLocked(ack batchAck, p *pendingAck) {
+	if previous, ok := t.pending[ack]; ok {
+		// HEC reuses ack ids after a restart, the previous batch will never be acknowledged
+		t.removeLocked(ack, previous)
+		t.giveUpLocked(previous)
+	}
+	t.pending[ack] = p
+	t.pendingMessages += len(p.messages)
+	atomic.StoreInt64(&t.pendingBatches, int64(len(t.pending)+len(t.resend)))
+}
+
+func (t *ackTracker) removeLocked(ack batchAck, p *pendingAck) {
+	delete(t.pending, ack)
+	t.pendingMessages -= len(p.messages)
+	t.notifyLocked()
+}
+
+// removeResendLocked removes the batch at position i of the batches waiting to be sent again
+func (t *ackTracker) removeResendLocked(i int) *pendingAck {
+	p := t.resend[i]
+	t.resend = append(t.resend[:i], t.resend[i+1:]...)
+	t.pendingMessages -= len(p.messages)
+	t.notifyLocked()
+	return p
+}
+
+// notifyLocked wakes up the goroutines waiting for the pending batches
+func (t *ackTracker) notifyLocked() {
+	atomic.StoreInt64(&t.pendingBatches, int64(len(t.pending)+len(t.resend)))
+	close(t.changed)
+	t.changed = make(chan struct{})
+}
+
+// giveUpLocked stops waiting for the acknowledgement of a batch, spooled batches
+// are replayed by the spool, the others are queued to be sent again
+func (t *ackTracker) giveUpLocked(p *pendingAck) {
+	if p.done != nil {
+		p.done <- false
+		return
+	}
+	t.resend = append(t.resend, p)
+	t.pendingMessages += len(p.messages)
+	sort.Slice(t.resend, func(i, j int) bool { return t.resend[i].seq < t.resend[j].seq })
+	t.notifyLocked()
+}
+
+// trimLocked keeps the pending messages under bufferMaximum, the oldest batches are dropped first
+func (t *ackTracker) trimLocked() [][]*splunkMessage {
+	var dropped [][]*splunkMessage
+	for t.pendingMessages > t.hec.bufferMaximum {
+		if len(t.resend) > 0 {
+			dropped = append(dropped, t.removeResendLocked(0).messages)
+			continue
+		}
+		var oldestAck batchAck
+		var oldest *pendingAck
+		for ack, p := range t.pending {
+			if p.messages != nil && (oldest == nil || p.seq < oldest.seq) {
+				oldestAck, oldest = ack, p
+			}
+		}
+		if oldest == nil {
+			break
+		}
+		t.removeLocked(oldestAck, oldest)
+		dropped = append(dropped, oldest.messages)
+	}
+	return dropped
+}
+
+// poll asks every endpoint which of its pending batches are acknowledged
+func (t *ackTracker) poll() error {
+	t.mu.Lock()
+	ids := make(map[*hecEndpoint][]int64)
+	for ack := range t.pending {
+		ids[ack.endpoint] = append(ids[ack.endpoint], ack.id)
+	}
+	t.mu.Unlock()
+	var firstErr error
+	for ep, epIDs := range ids {
+		if err := t.pollEndpoint(ep, epIDs); err != nil && firstErr == nil {
+			firstErr = err
+		}
+	}
+	return firstErr
+}
+
+func (t *ackTracker) pollEndpoint(ep *hecEndpoint, ids []int64) error {
+	sort.Slice(ids, func(i, j int) bool { return ids[i] < ids[j] })
+	body, err := json.Marshal(&ackRequest{Acks: ids})
+	if err != nil {
+		return err
+	}
+	req, err := http.NewRequest("POST", ep.ackURL, bytes.NewReader(body))
+	if err != nil {
+		return err
+	}
+	req.Header.Set("Content-Type", "application/json")
+	req.Header.Set("Authorization", t.hec.auth)
+	req.Header.Set(splunkChannelHeader, t.hec.channel)
+	res, err := ep.client.Do(req)
+	if err != nil {
+		return err
+	}
+	defer res.Body.Close()
+	if res.StatusCode != http.StatusOK {
+		body, _ := ioutil.ReadAll(res.Body)
+		return fmt.Errorf("%s: failed to check acknowledgements - %s - %s", driverName, res.Status, body)
+	}
+	var response ackResponse
+	err = json.NewDecoder(res.Body).Decode(&response)
+	io.Copy(ioutil.Discard, res.Body)
+	if err != nil {
+		return err
+	}
+
+	t.mu.Lock()
+	defer t.mu.Unlock()
+	for idStr, acked := range response.Acks {
+		if !acked {
+			continue
+		}
+		ackID, err := strconv.ParseInt(idStr, 10, 64)
+		if err != nil {
+			continue
+		}
+		ack := batchAck{endpoint: ep, id: ackID}
+		if p, ok := t.pending[ack]; ok {
+			t.removeLocked(ack, p)
+			atomic.AddInt64(&t.ackedBatches, 1)
+			t.hec.memory.release(messagesSize(p.messages))
+			if p.done != nil {
+				p.done <- true
+			}
+		}
+	}
+	return nil
+}
+
+// resendExpired sends the batches which were not acknowledged in time again, oldest first
+func (t *ackTracker) resendExpired(now time.Time) {
+	t.mu.Lock()
+	for ack, p := range t.pending {
+		if now.Sub(p.sent) >= t.timeout {
+			t.removeLocked(ack, p)
+			if p.done == nil {
+				logrus.WithField("messages", len(p.messages)).Warn("Batch was not acknowledged in time, sending it again")
+			}
+			t.giveUpLocked(p)
+		}
+	}
+	for len(t.resend) > 0 {
+		p := t.resend[0]
+		t.mu.Unlock()
+		ack, err := t.hec.sendMessages(p.messages)
+		t.mu.Lock()
+		if err != nil {
+			// HEC is not accepting requests, try again on the next tick
+			logrus.Error(err)
+			break
+		}
+		atomic.AddInt64(&t.resentBatches, 1)
+		// track can drop the oldest batches while the lock is released
+		i := 0
+		for i < len(t.resend) && t.resend[i] != p {
+			i++
+		}
+		if i == len(t.resend) {
+			continue
+		}
+		t.removeResendLocked(i)
+		if ack.id == noAckID {
+			// HEC took the batch without an ack id, there is nothing to wait for
+			t.hec.memory.release(messagesSize(p.messages))
+			if p.done != nil {
+				p.done <- true
+			}
+			continue
+		}
+		p.sent = time.Now()
+		t.addLocked(ack, p)
+	}
+	t.mu.Unlock()
+}
+
+// wait blocks until the batches pending now are acknowledged or the deadline passes
+func (t *ackTracker) wait(deadline time.Time) error {
+	t.mu.Lock()
+	upTo := t.seq
+	t.mu.Unlock()
+	timer := time.NewTimer(time.Until(deadline))
+	defer timer.Stop()
+	for {
+		t.mu.Lock()
+		waiting := 0
+		for _, p := range t.pending {
+			if p.seq <= upTo {
+				waiting++
+			}
+		}
+		for _, p := range t.resend {
+			if p.seq <= upTo {
+				waiting++
+			}
+		}
+		changed := t.changed
+		t.mu.Unlock()
+		if waiting == 0 {
+			return nil
+		}
+		select {
+		case <-changed:
+		case <-timer.C:
+			return fmt.Errorf("%s: %d batches were not acknowledged in time", driverName, waiting)
+		}
+	}
+}
+
+// close waits for the pending batches up to the ack timeout, the batches which are
+// still not acknowledged are dropped, to the spool when it is enabled
+func (t *ackTracker) close() {
+	if t == nil {
+		return
+	}
+	if err := t.wait(time.Now().Add(t.timeout)); err != nil {
+		logrus.Error(err)
+	}
+	close(t.stop)
+	t.wg.Wait()
+
+	t.mu.Lock()
+	for ack, p := range t.pending {
+		t.removeLocked(ack, p)
+		t.giveUpLocked(p)
+	}
+	var dropped [][]*splunkMessage
+	for len(t.resend) > 0 {
+		dropped = append(dropped, t.removeResendLocked(0).messages)
+	}
+	t.mu.Unlock()
+	for _, messages := range dropped {
+		t.hec.dropMessages(messages)
+	}
+}
@@ -0,0 +1,358 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"encoding/json"
+	"fmt"
+	"io/ioutil"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+// ackCollectorMock is a HEC with indexer acknowledgement enabled for the token
+type ackCollectorMock struct {
+	*httptest.Server
+	t *testing.T
+
+	lock     sync.Mutex
+	channels map[string]bool
+	nextID   int64
+	// batches received by ack id
+	batches map[int64]int
+	// acknowledge the batches with these ids only when set
+	holdAcks map[int64]bool
+	// answer without an ack id, as for a token without indexer acknowledgement
+	noAckIDs bool
+}
+
+func newAckCollectorMock(t *testing.T) *ackCollectorMock {
+	hec := &ackCollectorMock{
+		t:        t,
+		channels: make(map[string]bool),
+		batches:  make(map[int64]int),
+		holdAcks: make(map[int64]bool),
+	}
+	hec.Server = httptest.NewServer(hec)
+	return hec
+}
+
+func (hec *ackCollectorMock) ServeHTTP(w http.ResponseWriter, r *http.Request) {
+	hec.lock.Lock()
+	defer hec.lock.Unlock()
+	defer r.Body.Close()
+
+	channel := r.Header.Get(splunkChannelHeader)
+	if channel == "" {
+		w.WriteHeader(http.StatusBadRequest)
+		w.Write([]byte(`{"text":"Data channel is missing","code":10}`))
+		return
+	}
+	hec.channels[channel] = true
+
+	switch r.URL.Path {
+	case "/services/collector/event/1.0":
+		body, _ := ioutil.ReadAll(r.Body)
+		events := 0
+		for i := 0; i < len(body); i++ {
+			if body[i] == '}' && (i == len(body)-1 || body[i+1] == '{') {
+				events++
+			}
+		}
+		ackID := hec.nextID
+		hec.nextID++
+		hec.batches[ackID] = events
+		if hec.noAckIDs {
+			fmt.Fprint(w, `{"text":"Success","code":0}`)
+			break
+		}
+		fmt.Fprintf(w, `{"text":"Success","code":0,"ackId":%d}`, ackID)
+	case "/services/collector/ack":
+		var request ackRequest
+		if err := json.NewDecoder(r.Body).Decode(&request); err != nil {
+			hec.t.Error(err)
+		}
+		response := ackResponse{Acks: make(map[string]bool)}
+		for _, ackID := range request.Acks {
+			_, received := hec.batches[ackID]
+			response.Acks[strconv.FormatInt(ackID, 10)] = received && !hec.holdAcks[ackID]
+		}
+		json.NewEncoder(w).Encode(&response)
+	default:
+		hec.t.Errorf("Unexpected path %v", r.URL)
+		w.WriteHeader(http.StatusNotFound)
+	}
+}
+
+func (hec *ackCollectorMock) received() (batches int, events int) {
+	hec.lock.Lock()
+	defer hec.lock.Unlock()
+	for _, n := range hec.batches {
+		events += n
+	}
+	return len(hec.batches), events
+}
+
+func newAckTestLogger(t *testing.T, url string) logger.Logger {
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:        url,
+			splunkTokenKey:      "4642492F-D8BD-47F1-A005-0C08AE4657DF",
+			splunkIndexerAckKey: "true",
+		},
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return loggerDriver
+}
+
+func setAckTestOptions(t *testing.T, pollInterval string, timeout string) {
+	for name, value := range map[string]string{
+		envVarPostMessagesFrequency: "10h",
+		envVarPostMessagesBatchSize: "10",
+		envVarAckPollInterval:       pollInterval,
+		envVarAckTimeout:            timeout,
+	} {
+		if err := os.Setenv(name, value); err != nil {
+			t.Fatal(err)
+		}
+	}
+}
+
+// Verify that batches are released once acknowledged and that a flush waits for the acknowledgements
+func TestIndexerAck(t *testing.T) {
+	setAckTestOptions(t, "10ms", "1h")
+	defer setAckTestOptions(t, "", "")
+
+	hec := newAckCollectorMock(t)
+	defer hec.Close()
+	loggerDriver := newAckTestLogger(t, hec.URL)
+	acks := loggerDriver.(*splunkLoggerInline).hec.acks
+
+	for i := 0; i < 35; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+		t.Fatal(err)
+	}
+	if batches, events := hec.received(); batches != 4 || events != 35 {
+		t.Fatalf("Unexpected %d batches with %d events", batches, events)
+	}
+	acks.mu.Lock()
+	pending := len(acks.pending) + len(acks.resend)
+	acks.mu.Unlock()
+	if pending != 0 {
+		t.Fatalf("Expected all the batches to be acknowledged after the flush, %d are pending", pending)
+	}
+	if acked := atomic.LoadInt64(&acks.ackedBatches); acked != 4 {
+		t.Fatalf("Unexpected number of acknowledged batches %d", acked)
+	}
+	hec.lock.Lock()
+	channels := len(hec.channels)
+	hec.lock.Unlock()
+	if channels != 1 {
+		t.Fatalf("Expected one channel per logger, got %d", channels)
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that a batch which is not acknowledged in time is sent again
+func TestIndexerAckTimeout(t *testing.T) {
+	setAckTestOptions(t, "10ms", "100ms")
+	defer setAckTestOptions(t, "", "")
+
+	hec := newAckCollectorMock(t)
+	defer hec.Close()
+	hec.holdAcks[0] = true
+	loggerDriver := newAckTestLogger(t, hec.URL)
+	acks := loggerDriver.(*splunkLoggerInline).hec.acks
+
+	for i := 0; i < 10; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+		t.Fatal(err)
+	}
+	if batches, events := hec.received(); batches != 2 || events != 20 {
+		t.Fatalf("Expected the batch to be sent twice, got %d batches with %d events", batches, events)
+	}
+	if resent, acked := atomic.LoadInt64(&acks.resentBatches), atomic.LoadInt64(&acks.ackedBatches); resent != 1 || acked != 1 {
+		t.Fatalf("Unexpected counters, resent %d, acknowledged %d", resent, acked)
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that batches still waiting for their acknowledgement are dropped when the logger is closed
+func TestIndexerAckClose(t *testing.T) {
+	setAckTestOptions(t, "10ms", "200ms")
+	defer setAckTestOptions(t, "", "")
+	if err := os.Setenv(envVarConcurrentPosts, "4"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarConcurrentPosts, "")
+
+	hec := newAckCollectorMock(t)
+	defer hec.Close()
+	for ackID := int64(0); ackID < 100; ackID++ {
+		hec.holdAcks[ackID] = true
+	}
+	loggerDriver := newAckTestLogger(t, hec.URL)
+	l := loggerDriver.(*splunkLoggerInline)
+
+	for i := 0; i < 25; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if dropped := atomic.LoadInt64(&l.hec.droppedMessages); dropped != 25 {
+		t.Fatalf("Expected the unacknowledged messages to be dropped, got %d", dropped)
+	}
+	if batches, _ := hec.received(); batches < 3 {
+		t.Fatalf("Expected at least 3 batches, got %d", batches)
+	}
+}
+
+// Verify that the batches dropped by track while an expired batch is sent again
+// are not sent again nor tracked
+func TestIndexerAckResendTrim(t *testing.T) {
+	setAckTestOptions(t, "1h", "1h")
+	defer setAckTestOptions(t, "", "")
+	if err := os.Setenv(envVarBufferMaximum, "4"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarBufferMaximum, "")
+
+	hec := newAckCollectorMock(t)
+	defer hec.Close()
+	loggerDriver := newAckTestLogger(t, hec.URL)
+	l := loggerDriver.(*splunkLoggerInline)
+	acks := l.hec.acks
+	newMessages := func(n int) []*splunkMessage {
+		messages := make([]*splunkMessage, n)
+		for i := range messages {
+			messages[i] = &splunkMessage{Event: fmt.Sprintf("%d", i), Time: "0"}
+		}
+		return messages
+	}
+
+	acks.mu.Lock()
+	for i := 0; i < 2; i++ {
+		acks.seq++
+		acks.giveUpLocked(&pendingAck{seq: acks.seq, sent: time.Now(), messages: newMessages(2)})
+	}
+	acks.mu.Unlock()
+
+	// the first batch is sent again while HEC holds the request
+	hec.lock.Lock()
+	resent := make(chan struct{})
+	go func() {
+		acks.resendExpired(time.Now())
+		close(resent)
+	}()
+	time.Sleep(50 * time.Millisecond)
+	hec.batches[100] = 4
+	ack := batchAck{endpoint: l.hec.endpoints[0], id: 100}
+	acks.track(ack, newMessages(4))
+	hec.lock.Unlock()
+	<-resent
+
+	acks.mu.Lock()
+	resend, pending := len(acks.resend), len(acks.pending)
+	_, tracked := acks.pending[ack]
+	acks.mu.Unlock()
+	if resend != 0 || pending != 1 || !tracked {
+		t.Fatalf("Expected only the new batch to be tracked, %d pending, %d to send again", pending, resend)
+	}
+	if batches, _ := hec.received(); batches != 2 {
+		t.Fatalf("Expected the batch in flight to be sent once, got %d batches", batches)
+	}
+	if dropped := atomic.LoadInt64(&l.hec.droppedMessages); dropped != 4 {
+		t.Fatalf("Expected the oldest batches to be dropped, got %d messages", dropped)
+	}
+
+	if err := acks.poll(); err != nil {
+		t.Fatal(err)
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that a batch sent again without an ack id in the answer is done with
+// and its messages are released from the memory budget
+func TestIndexerAckResendNoAckID(t *testing.T) {
+	defer useMemoryBudget(4096)()
+	setAckTestOptions(t, "1h", "1h")
+	defer setAckTestOptions(t, "", "")
+
+	hec := newAckCollectorMock(t)
+	defer hec.Close()
+	loggerDriver := newAckTestLogger(t, hec.URL)
+	acks := loggerDriver.(*splunkLoggerInline).hec.acks
+
+	messages := []*splunkMessage{{payload: []byte(`{"event":"0","time":"0"}`)}, {payload: []byte(`{"event":"1","time":"0"}`)}}
+	memory.force(messagesSize(messages))
+	acks.mu.Lock()
+	acks.seq++
+	acks.giveUpLocked(&pendingAck{seq: acks.seq, sent: time.Now(), messages: messages})
+	acks.mu.Unlock()
+
+	hec.lock.Lock()
+	hec.noAckIDs = true
+	hec.lock.Unlock()
+	acks.resendExpired(time.Now())
+
+	if err := acks.wait(time.Now().Add(time.Second)); err != nil {
+		t.Fatal(err)
+	}
+	if batches, _ := hec.received(); batches != 1 {
+		t.Fatalf("Expected the batch to be sent again once, got %d batches", batches)
+	}
+	if used := atomic.LoadInt64(&memory.used); used != 0 {
+		t.Fatalf("Expected the messages to be released, %d bytes used", used)
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+}
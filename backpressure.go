@@ -0,0 +1,285 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"os"
+	"strconv"
+	"sync"
+	"sync/atomic"
+
+	"github.com/Sirupsen/logrus"
+)
+
+// What the logger does with a new message when the stream channel is full
+const (
+	// wait for the worker, docker stops reading the output of the container
+	backpressureBlock = "block"
+	// drop the new message
+	backpressureDropNewest = "drop-newest"
+	// drop the oldest message in the channel to make room for the new one
+	backpressureDropOldest = "drop-oldest"
+	// keep one of every splunk-backpressure-sample messages, drop the rest
+	backpressureSample = "sample"
+	// write the message to the spool, it is sent when the spool is replayed
+	backpressureSpill = "spill"
+)
+
+const (
+	defaultBackpressurePolicy     = backpressureBlock
+	defaultBackpressureSampleRate = 10
+)
+
+const (
+	envVarBackpressurePolicy = "SPLUNK_LOGGING_DRIVER_BACKPRESSURE"
+)
+
+/*
+backpressure applies the policy of a container when its stream channel is full.
+The counters are exact and are reported with the container id when the logger is closed.
+Spilled messages are written to the spool in batches of the size of the batches sent
+to HEC, so replaying them does not take one request per message. A batch which is not
+full yet is written once the stream has room again or the logger is closed.
+*/
+type backpressure struct {
+	policy      string
+	sampleRate  int64
+	containerID string
+
+	// updated atomically
+	full int32
+	// messages which found the stream full
+	overflowed int64
+	dropped    int64
+	spilled    int64
+
+	spillLock     sync.Mutex
+	spillMessages []*splunkMessage
+	spillBytes    int
+}
+
+func newBackpressure(config map[string]string, containerID string, spool *spool) (*backpressure, error) {
+	b := &backpressure{
+		policy:      defaultBackpressurePolicy,
+		sampleRate:  defaultBackpressureSampleRate,
+		containerID: containerID,
+	}
+	if policy := os.Getenv(envVarBackpressurePolicy); policy != "" {
+		b.policy = policy
+	}
+	if policy, ok := config[splunkBackpressureKey]; ok {
+		b.policy = policy
+	}
+	switch b.policy {
+	case backpressureBlock:
+	case backpressureDropNewest:
+	case backpressureDropOldest:
+	case backpressureSample:
+	case backpressureSpill:
+		if spool == nil {
+			return nil, fmt.Errorf("%s: %s=%s requires %s", driverName, splunkBackpressureKey, backpressureSpill, envVarSpoolDir)
+		}
+	default:
+		return nil, fmt.Errorf("%s: unknown %s %s, supported policies are block, drop-newest, drop-oldest, sample and spill",
+			driverName, splunkBackpressureKey, b.policy)
+	}
+	if sampleRateStr, ok := config[splunkBackpressureSampleKey]; ok {
+		sampleRate, err := strconv.ParseInt(sampleRateStr, 10, 32)
+		if err != nil {
+			return nil, err
+		}
+		if sampleRate < 1 {
+			return nil, fmt.Errorf("%s: %s should be at least 1", driverName, splunkBackpressureSampleKey)
+		}
+		b.sampleRate = sampleRate
+	}
+	return b, nil
+}
+
+// queue puts the message into the stream, applying the policy if the stream is full
+func (b *backpressure) queue(l *splunkLogger, message *splunkMessage) error {
+	select {
+	case l.stream <- message:
+		if atomic.LoadInt32(&b.full) != 0 && atomic.CompareAndSwapInt32(&b.full, 1, 0) {
+			b.logCounters("Stream channel is no longer full")
+			return b.flushSpill(l)
+		}
+		return nil
+	default:
+	}
+
+	if atomic.CompareAndSwapInt32(&b.full, 0, 1) {
+		logrus.WithField("id", b.containerID).WithField("policy", b.policy).Warn("Stream channel is full")
+	}
+	overflowed := atomic.AddInt64(&b.overflowed, 1)
+
+	switch b.policy {
+	case backpressureDropNewest:
+		atomic.AddInt64(&b.dropped, 1)
+		l.budget().release(len(message.payload))
+	case backpressureDropOldest:
+		for {
+			select {
+			case l.stream <- message:
+				return nil
+			default:
+			}
+			select {
+			case oldest := <-l.stream:
+				if oldest.flush != nil {
+					oldest.flush.reply(fmt.Errorf("%s: flush request dropped, the stream channel is full", driverName))
+				} else {
+					atomic.AddInt64(&b.dropped, 1)
+					l.budget().release(len(oldest.payload))
+				}
+			default:
+			}
+		}
+	case backpressureSample:
+		if (overflowed-1)%b.sampleRate == 0 {
+			l.stream <- message
+		} else {
+			atomic.AddInt64(&b.dropped, 1)
+			l.budget().release(len(message.payload))
+		}
+	case backpressureSpill:
+		l.budget().release(len(message.payload))
+		atomic.AddInt64(&b.spilled, 1)
+		return b.spill(l, message)
+	default:
+		l.stream <- message
+	}
+	return nil
+}
+
+// messageLimit is a limit of the container other than the stream channel
+type messageLimit interface {
+	// wait blocks until the message fits, it returns false when stop is closed first
+	wait(size int, stop <-chan struct{}) bool
+	// force lets the message go over the limit
+	force(size int)
+}
+
+// limitCounters count the messages over a limit and what the policy did with them, updated atomically
+type limitCounters struct {
+	limited int64
+	delayed int64
+	dropped int64
+	spilled int64
+}
+
+/*
+overLimit applies the policy of the container to a message over one of its other
+limits, the rate limits or the memory budget. It returns true when the message can
+be queued. block waits until the message fits, drop-newest and drop-oldest drop it,
+sample keeps one message in splunk-backpressure-sample and spill writes it to the
+spool.
+*/
+func (b *backpressure) overLimit(l *splunkLogger, message *splunkMessage, limit messageLimit, c *limitCounters, warning string) (bool, error) {
+	size := len(message.payload)
+	limited := atomic.AddInt64(&c.limited, 1)
+	if limited == 1 {
+		logrus.WithField("id", b.containerID).WithField("policy", b.policy).Warn(warning)
+	}
+	switch b.policy {
+	case backpressureDropNewest, backpressureDropOldest:
+		atomic.AddInt64(&c.dropped, 1)
+		return false, nil
+	case backpressureSample:
+		if (limited-1)%b.sampleRate == 0 {
+			limit.force(size)
+			return true, nil
+		}
+		atomic.AddInt64(&c.dropped, 1)
+		return false, nil
+	case backpressureSpill:
+		atomic.AddInt64(&c.spilled, 1)
+		return false, b.spill(l, message)
+	default:
+		atomic.AddInt64(&c.delayed, 1)
+		// Log holds the lock of the logger, Close stops the wait before it takes the lock
+		if !limit.wait(size, l.stop) {
+			return false, fmt.Errorf("%s: driver is closed", driverName)
+		}
+		return true, nil
+	}
+}
+
+// spill adds the message to the batch of spilled messages, the batch is written to
+// the spool once it gets to the batch size or the batch bytes of the logger
+func (b *backpressure) spill(l *splunkLogger, message *splunkMessage) error {
+	b.spillLock.Lock()
+	defer b.spillLock.Unlock()
+	b.spillMessages = append(b.spillMessages, message)
+	b.spillBytes += len(message.payload)
+	if len(b.spillMessages) < l.hec.postMessagesBatchSize &&
+		(l.hec.postMessagesBatchBytes <= 0 || b.spillBytes < l.hec.postMessagesBatchBytes) {
+		return nil
+	}
+	return b.writeSpillLocked(l)
+}
+
+// flushSpill writes the spilled messages which do not make a full batch
+func (b *backpressure) flushSpill(l *splunkLogger) error {
+	b.spillLock.Lock()
+	defer b.spillLock.Unlock()
+	return b.writeSpillLocked(l)
+}
+
+func (b *backpressure) writeSpillLocked(l *splunkLogger) error {
+	if len(b.spillMessages) == 0 {
+		return nil
+	}
+	messages := b.spillMessages
+	b.spillMessages = nil
+	b.spillBytes = 0
+	if err := l.hec.spoolMessages(messages); err != nil {
+		l.hec.logDroppedMessages(messages)
+		return err
+	}
+	return nil
+}
+
+// report logs the counters when the logger is closed, if the limit was ever reached
+func (c *limitCounters) report(containerID string, msg string) {
+	if atomic.LoadInt64(&c.limited) == 0 {
+		return
+	}
+	logrus.WithField("id", containerID).
+		WithField("limited", atomic.LoadInt64(&c.limited)).
+		WithField("delayed", atomic.LoadInt64(&c.delayed)).
+		WithField("dropped", atomic.LoadInt64(&c.dropped)).
+		WithField("spilled", atomic.LoadInt64(&c.spilled)).
+		Info(msg)
+}
+
+// report logs the counters when the logger is closed, if the policy was ever applied
+func (b *backpressure) report() {
+	if atomic.LoadInt64(&b.overflowed) > 0 {
+		b.logCounters("Logger closed")
+	}
+}
+
+func (b *backpressure) logCounters(msg string) {
+	logrus.WithField("id", b.containerID).
+		WithField("policy", b.policy).
+		WithField("overflowed", atomic.LoadInt64(&b.overflowed)).
+		WithField("dropped", atomic.LoadInt64(&b.dropped)).
+		WithField("spilled", atomic.LoadInt64(&b.spilled)).
+		Info(msg)
+}
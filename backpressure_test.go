@@ -0,0 +1,138 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"io/ioutil"
+	"os"
+	"strings"
+	"sync"
+	"testing"
+)
+
+func TestBackpressurePolicies(t *testing.T) {
+	if _, err := newBackpressure(map[string]string{splunkBackpressureKey: "unknown"}, "containerid", nil); err == nil {
+		t.Fatal("Expected error for unknown policy")
+	}
+	if _, err := newBackpressure(map[string]string{splunkBackpressureKey: backpressureSpill}, "containerid", nil); err == nil {
+		t.Fatal("Expected error for spill policy without spool")
+	}
+	if _, err := newBackpressure(map[string]string{splunkBackpressureSampleKey: "0"}, "containerid", nil); err == nil {
+		t.Fatal("Expected error for sample rate less than 1")
+	}
+	b, err := newBackpressure(map[string]string{}, "containerid", nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if b.policy != backpressureBlock {
+		t.Fatalf("Unexpected default policy %s", b.policy)
+	}
+}
+
+// Verify that dropping policies never block and count every dropped message
+func TestBackpressureDrop(t *testing.T) {
+	for _, policy := range []string{backpressureDropNewest, backpressureDropOldest} {
+		b, err := newBackpressure(map[string]string{splunkBackpressureKey: policy}, "containerid", nil)
+		if err != nil {
+			t.Fatal(err)
+		}
+		l := &splunkLogger{
+			stream:       make(chan *splunkMessage, 10),
+			backpressure: b,
+		}
+		for i := 0; i < 25; i++ {
+			if err := l.queueMessageAsync(&splunkMessage{payload: []byte(fmt.Sprintf("%d", i))}); err != nil {
+				t.Fatal(err)
+			}
+		}
+		if b.overflowed != 15 || b.dropped != 15 {
+			t.Fatalf("%s: unexpected counters, overflowed %d, dropped %d", policy, b.overflowed, b.dropped)
+		}
+		first := 0
+		if policy == backpressureDropOldest {
+			first = 15
+		}
+		for i := first; i < first+10; i++ {
+			message := <-l.stream
+			if string(message.payload) != fmt.Sprintf("%d", i) {
+				t.Fatalf("%s: unexpected message %s, expected %d", policy, message.payload, i)
+			}
+		}
+	}
+}
+
+// Verify that spilled messages are written to the spool in batches, and that the
+// last batch is written once the stream has room again
+func TestBackpressureSpill(t *testing.T) {
+	dir, err := ioutil.TempDir("", "spool")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+	os.Setenv(envVarSpoolDir, dir)
+	os.Setenv(envVarSpoolReplayConcurrency, "1")
+	defer os.Setenv(envVarSpoolDir, "")
+	defer os.Setenv(envVarSpoolReplayConcurrency, "")
+
+	s, err := openSpool("containerid")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer s.close()
+	b, err := newBackpressure(map[string]string{splunkBackpressureKey: backpressureSpill}, "containerid", s)
+	if err != nil {
+		t.Fatal(err)
+	}
+	l := &splunkLogger{
+		hec:          &hecClient{spool: s, postMessagesBatchSize: 5},
+		stream:       make(chan *splunkMessage, 10),
+		backpressure: b,
+	}
+	for i := 0; i < 27; i++ {
+		if err := l.queueMessageAsync(&splunkMessage{payload: []byte(fmt.Sprintf("%d,", i))}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if b.spilled != 17 || s.spooledBatches != 3 {
+		t.Fatalf("Expected 17 messages in 3 batches, %d messages spilled in %d batches", b.spilled, s.spooledBatches)
+	}
+	<-l.stream
+	if err := l.queueMessageAsync(&splunkMessage{payload: []byte("27,")}); err != nil {
+		t.Fatal(err)
+	}
+	if s.spooledBatches != 4 {
+		t.Fatalf("Expected the last batch to be written when the stream has room, got %d batches", s.spooledBatches)
+	}
+
+	var lock sync.Mutex
+	var replayed []string
+	s.replay(func(body []byte, compressed bool) error {
+		lock.Lock()
+		defer lock.Unlock()
+		replayed = append(replayed, string(body))
+		return nil
+	})
+	waitForReplay(t, s)
+	var expected []string
+	for i := 10; i < 27; i++ {
+		expected = append(expected, fmt.Sprintf("%d,", i))
+	}
+	if got := strings.Join(replayed, ""); len(replayed) != 4 || got != strings.Join(expected, "") {
+		t.Fatalf("Unexpected batches %v", replayed)
+	}
+}
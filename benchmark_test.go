@@ -0,0 +1,283 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"encoding/binary"
+	"fmt"
+	"io"
+	"io/ioutil"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/api/types/plugins/logdriver"
+	"github.com/docker/docker/daemon/logger"
+	protoio "github.com/gogo/protobuf/io"
+)
+
+/*
+Benchmarks of the path from the FIFO to HEC. Run them with
+
+	go test -run XXX -bench . -benchmem
+
+and compare with benchmark_baseline.txt using benchstat.
+*/
+
+const (
+	benchmarkStreamEntries = 1000
+	benchmarkBatchSize     = 1000
+)
+
+var benchmarkLine = []byte(`{"time":"2018-03-01T10:00:00.000Z","level":"info","logger":"http","msg":"request completed","method":"GET","path":"/api/v1/items/42","status":200,"duration_ms":12.5}`)
+
+// newBenchmarkSink starts a HEC endpoint which discards everything, so the benchmarks
+// measure the driver and not HTTPEventCollectorMock decoding the events
+func newBenchmarkSink() *httptest.Server {
+	return httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		if r.Body != nil {
+			io.Copy(ioutil.Discard, r.Body)
+			r.Body.Close()
+		}
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+}
+
+// reportEventRate reports events/s next to ns/op, B/op and allocs/op
+func reportEventRate(b *testing.B, events int, elapsed time.Duration) {
+	if elapsed <= 0 {
+		return
+	}
+	// testing.B.ReportMetric is not available with the Go version of the build image
+	if r, ok := interface{}(b).(interface {
+		ReportMetric(n float64, unit string)
+	}); ok {
+		r.ReportMetric(float64(events)/elapsed.Seconds(), "events/s")
+	}
+}
+
+type discardLogger struct{}
+
+func (discardLogger) Log(msg *logger.Message) error { return nil }
+func (discardLogger) Name() string                  { return "discard" }
+func (discardLogger) Close() error                  { return nil }
+
+// framedStream encodes the entries the way docker writes them to the FIFO
+func framedStream(b *testing.B, entries []*logdriver.LogEntry) []byte {
+	var stream bytes.Buffer
+	enc := protoio.NewUint32DelimitedWriter(&stream, binary.BigEndian)
+	for _, entry := range entries {
+		if err := enc.WriteMsg(entry); err != nil {
+			b.Fatal(err)
+		}
+	}
+	return stream.Bytes()
+}
+
+// One op decodes a stream of benchmarkStreamEntries entries and hands them to the loggers
+func BenchmarkConsumeLog(b *testing.B) {
+	entries := make([]*logdriver.LogEntry, benchmarkStreamEntries)
+	for i := range entries {
+		entries[i] = &logdriver.LogEntry{Source: "stdout", TimeNano: time.Now().UnixNano(), Line: benchmarkLine}
+	}
+	stream := framedStream(b, entries)
+
+	b.SetBytes(int64(len(benchmarkLine) * benchmarkStreamEntries))
+	b.ReportAllocs()
+	b.ResetTimer()
+	start := time.Now()
+	for i := 0; i < b.N; i++ {
+		lf := &logPair{
+			jsonl:   discardLogger{},
+			splunkl: discardLogger{},
+			stream:  ioutil.NopCloser(bytes.NewReader(stream)),
+			info:    logger.Info{ContainerID: "containeriid"},
+			read:    &fifoCounters{},
+		}
+		lf.partials = newPartialReassembler(lf.log)
+		messageProcessor{}.consumeLog(lf)
+	}
+	reportEventRate(b, b.N*benchmarkStreamEntries, time.Since(start))
+}
+
+// One op is one Log() call, the time includes sending all the events to the sink
+func BenchmarkLog(b *testing.B) {
+	sink := newBenchmarkSink()
+	defer sink.Close()
+
+	for _, format := range []string{splunkFormatInline, splunkFormatJSON, splunkFormatRaw} {
+		b.Run(format, func(b *testing.B) {
+			info := logger.Info{
+				Config: map[string]string{
+					splunkURLKey:    sink.URL,
+					splunkTokenKey:  "4642492F-D8BD-47F1-A005-0C08AE4657DF",
+					splunkFormatKey: format,
+				},
+				ContainerID:        "containeriid",
+				ContainerName:      "/container_name",
+				ContainerImageID:   "contaimageid",
+				ContainerImageName: "container_image_name",
+			}
+			loggerDriver, err := New(info)
+			if err != nil {
+				b.Fatal(err)
+			}
+
+			b.SetBytes(int64(len(benchmarkLine)))
+			b.ReportAllocs()
+			b.ResetTimer()
+			start := time.Now()
+			timestamp := time.Now()
+			for i := 0; i < b.N; i++ {
+				if err := loggerDriver.Log(&logger.Message{Line: benchmarkLine, Source: "stdout", Timestamp: timestamp}); err != nil {
+					b.Fatal(err)
+				}
+			}
+			if err := loggerDriver.Close(); err != nil {
+				b.Fatal(err)
+			}
+			reportEventRate(b, b.N, time.Since(start))
+		})
+	}
+}
+
+// One op checks one line for splunk-format=json and embeds it
+func BenchmarkAppendCompactJSON(b *testing.B) {
+	for _, test := range []struct {
+		name string
+		line []byte
+	}{
+		{"json", benchmarkLine},
+		{"text", []byte("2018-03-01T10:00:00.000Z INFO http request completed GET /api/v1/items/42 200 12.5ms")},
+	} {
+		b.Run(test.name, func(b *testing.B) {
+			dst := make([]byte, 0, 4096)
+			b.SetBytes(int64(len(test.line)))
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				if _, ok := appendCompactJSON(dst[:0], test.line); !ok {
+					dst = appendJSONString(dst[:0], test.line)
+				}
+			}
+		})
+	}
+}
+
+// One op checks one line against filter rules with the given number of literal patterns
+func BenchmarkLineFilter(b *testing.B) {
+	for _, patterns := range []int{1, 16, 256} {
+		b.Run(fmt.Sprintf("%dpatterns", patterns), func(b *testing.B) {
+			drop := make([]string, patterns)
+			for i := range drop {
+				drop[i] = fmt.Sprintf("GET /health/%d ", i)
+			}
+			f, err := newLineFilter(map[string]string{splunkFilterDropKey: strings.Join(drop, ",")})
+			if err != nil {
+				b.Fatal(err)
+			}
+			b.SetBytes(int64(len(benchmarkLine)))
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				if !f.send(benchmarkLine) {
+					b.Fatal("Unexpected dropped line")
+				}
+			}
+		})
+	}
+}
+
+// One op joins 16KB partial entries into one message of the given size
+func BenchmarkPartialReassembly(b *testing.B) {
+	partialMsgBufferMaximum = defaultPartialMsgBufferMaximum
+	chunk := bytes.Repeat([]byte("a"), 16*1024)
+
+	for _, size := range []int{64 * 1024, 256 * 1024, 1024 * 1024} {
+		b.Run(fmt.Sprintf("%dKB", size/1024), func(b *testing.B) {
+			var entries []*logdriver.LogEntry
+			for n := 0; n < size; n += len(chunk) {
+				entries = append(entries, &logdriver.LogEntry{Source: "stdout", Line: chunk, Partial: n+len(chunk) < size})
+			}
+			emitted := 0
+			r := newPartialReassembler(func(line []byte, source string, partial bool, timestamp time.Time) {
+				emitted++
+			})
+
+			b.SetBytes(int64(size))
+			b.ReportAllocs()
+			b.ResetTimer()
+			start := time.Now()
+			for i := 0; i < b.N; i++ {
+				for _, entry := range entries {
+					r.add(entry)
+				}
+			}
+			reportEventRate(b, b.N, time.Since(start))
+			if emitted != b.N {
+				b.Fatalf("Unexpected number of messages %d, expected %d", emitted, b.N)
+			}
+		})
+	}
+}
+
+// One op encodes and posts a batch of benchmarkBatchSize events
+func BenchmarkTryPostMessages(b *testing.B) {
+	sink := newBenchmarkSink()
+	defer sink.Close()
+
+	nullMessage := &splunkMessage{Host: "hostname", Source: "source", SourceType: "sourcetype"}
+	env, err := newMessageEnvelope(nullMessage, &splunkMessageEvent{Tag: "containeriid"}, nil)
+	if err != nil {
+		b.Fatal(err)
+	}
+	messages := make([]*splunkMessage, benchmarkBatchSize)
+	for i := range messages {
+		messages[i] = &splunkMessage{payload: env.encode(benchmarkLine, true, "stdout", time.Now())}
+	}
+
+	for _, compress := range []bool{false, true} {
+		name := "plain"
+		if compress {
+			name = "gzip"
+		}
+		b.Run(name, func(b *testing.B) {
+			hec := &hecClient{
+				endpoints: []*hecEndpoint{{
+					client: &http.Client{Transport: &http.Transport{}},
+					url:    sink.URL + "/services/collector/event/1.0",
+				}},
+				auth:                 "Splunk 4642492F-D8BD-47F1-A005-0C08AE4657DF",
+				gzipCompression:      compress,
+				gzipCompressionLevel: gzip.DefaultCompression,
+			}
+
+			b.SetBytes(int64(messagesSize(messages)))
+			b.ReportAllocs()
+			b.ResetTimer()
+			start := time.Now()
+			for i := 0; i < b.N; i++ {
+				if err := hec.tryPostMessages(messages); err != nil {
+					b.Fatal(err)
+				}
+			}
+			reportEventRate(b, b.N*benchmarkBatchSize, time.Since(start))
+		})
+	}
+}
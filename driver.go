@@ -20,7 +20,6 @@ package main
 
 import (
 	"context"
-	"encoding/binary"
 	"fmt"
 	"io"
 	"os"
@@ -29,10 +28,8 @@ import (
 	"syscall"
 
 	"github.com/Sirupsen/logrus"
-	"github.com/docker/docker/api/types/plugins/logdriver"
 	"github.com/docker/docker/daemon/logger"
 	"github.com/docker/docker/daemon/logger/jsonfilelog"
-	protoio "github.com/gogo/protobuf/io"
 	"github.com/pkg/errors"
 	"github.com/tonistiigi/fifo"
 )
@@ -45,15 +42,29 @@ type driver struct {
 }
 
 type logPair struct {
-	jsonl   logger.Logger
-	splunkl logger.Logger
-	stream  io.ReadCloser
-	info    logger.Info
+	jsonl logger.Logger
+	// writes to jsonl, nil when the json-file log is disabled for the container
+	jsonq    *logQueue
+	splunkl  logger.Logger
+	stream   io.ReadCloser
+	info     logger.Info
+	read     *fifoCounters
+	partials *partialReassembler
+	// joins lines into events before they are sent to splunkl, nil without multiline options
+	multiline *multilineAggregator
+	// decides which messages are sent to splunkl, nil without filter rules
+	filter *lineFilter
 }
 
 func (lf *logPair) Close() {
 	lf.stream.Close()
+	// send what is left of partial messages before the loggers are closed
+	lf.partials.flushAll()
+	lf.multiline.flushAll()
 	lf.splunkl.Close()
+	if lf.jsonq != nil {
+		lf.jsonq.Close()
+	}
 	lf.jsonl.Close()
 }
 
@@ -87,14 +98,52 @@ func (d *driver) StartLogging(file string, logCtx logger.Info) error {
 		return errors.Wrap(err, "error creating jsonfile logger")
 	}
 
+	// closes what is already open when the logger cannot start
+	var jsonq *logQueue
+	var splunkl logger.Logger
+	closeLoggers := func() {
+		if splunkl != nil {
+			splunkl.Close()
+		}
+		if jsonq != nil {
+			jsonq.Close()
+		}
+		jsonl.Close()
+	}
+
 	err = ValidateLogOpt(logCtx.Config)
 	if err != nil {
+		closeLoggers()
+		return errors.Wrapf(err, "error options logger splunk: %q", file)
+	}
+
+	multiline, err := newMultilineAggregator(logCtx.Config)
+	if err != nil {
+		closeLoggers()
+		return errors.Wrapf(err, "error options logger splunk: %q", file)
+	}
+	filter, err := newLineFilter(logCtx.Config)
+	if err != nil {
+		closeLoggers()
+		return errors.Wrapf(err, "error options logger splunk: %q", file)
+	}
+
+	// the json-file log is written from its own goroutine
+	if enabled, err := jsonLogsEnabled(logCtx.Config); err != nil {
+		closeLoggers()
 		return errors.Wrapf(err, "error options logger splunk: %q", file)
+	} else if enabled {
+		jsonq, err = newLogQueue(jsonl, logCtx.Config, logCtx.ContainerID, newLogIndex(logCtx.LogPath))
+		if err != nil {
+			closeLoggers()
+			return errors.Wrapf(err, "error options logger splunk: %q", file)
+		}
 	}
 
 	//create a splunk logger for the file
-	splunkl, err := New(logCtx)
+	splunkl, err = New(logCtx)
 	if err != nil {
+		closeLoggers()
 		return errors.Wrap(err, "error creating splunk logger")
 	}
 
@@ -102,11 +151,16 @@ func (d *driver) StartLogging(file string, logCtx logger.Info) error {
 	// open the log file in the background with read only access
 	f, err := fifo.OpenFifo(context.Background(), file, syscall.O_RDONLY, 0700)
 	if err != nil {
+		closeLoggers()
 		return errors.Wrapf(err, "error opening logger fifo: %q", file)
 	}
 
 	d.mu.Lock()
-	lf := &logPair{jsonl, splunkl, f, logCtx}
+	lf := &logPair{jsonl, jsonq, splunkl, f, logCtx, &fifoCounters{}, nil, multiline, filter}
+	lf.partials = newPartialReassembler(lf.log)
+	if multiline != nil {
+		multiline.emit = lf.send
+	}
 	// add the json logger, splunk logger, log file, and logCtx to the logging driver
 	d.logs[file] = lf
 	d.idx[logCtx.ContainerID] = lf
@@ -142,44 +196,20 @@ func (d *driver) ReadLogs(info logger.Info, config logger.ReadConfig) (io.ReadCl
 	}
 
 	r, w := io.Pipe()
+	// without follow, the messages are read from the file with the index of the log queue
+	if lf.jsonq != nil && lf.jsonq.index != nil && !config.Follow {
+		go func() {
+			w.CloseWithError(lf.jsonq.index.read(config, w))
+		}()
+		return r, nil
+	}
+
 	lr, ok := lf.jsonl.(logger.LogReader)
 	if !ok {
 		return nil, fmt.Errorf("logger does not support reading")
 	}
-
 	go func() {
-		watcher := lr.ReadLogs(config)
-
-		enc := protoio.NewUint32DelimitedWriter(w, binary.BigEndian)
-		defer enc.Close()
-		defer watcher.Close()
-
-		var buf logdriver.LogEntry
-		for {
-			select {
-			case msg, ok := <-watcher.Msg:
-				if !ok {
-					w.Close()
-					return
-				}
-
-				buf.Line = msg.Line
-				buf.Partial = msg.Partial
-				buf.TimeNano = msg.Timestamp.UnixNano()
-				buf.Source = msg.Source
-
-				if err := enc.WriteMsg(&buf); err != nil {
-					w.CloseWithError(err)
-					return
-				}
-			case err := <-watcher.Err:
-				w.CloseWithError(err)
-				return
-			}
-
-			buf.Reset()
-		}
+		w.CloseWithError(followLogs(lr.ReadLogs(config), w))
 	}()
-
 	return r, nil
 }
@@ -0,0 +1,74 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"io/ioutil"
+	"os"
+	"path/filepath"
+	"runtime"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+// Verify that the loggers already created are closed when a container cannot start logging
+func TestStartLoggingCleanup(t *testing.T) {
+	if err := os.Setenv(envVarSplunkTelemetry, "false"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarSplunkTelemetry, "")
+	dir, err := ioutil.TempDir("", "start-logging")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+
+	hec := NewHTTPEventCollectorMock(t)
+	go hec.Serve()
+	defer hec.Close()
+
+	d := newDriver()
+	goroutines := runtime.NumGoroutine()
+	for _, config := range []map[string]string{
+		// the options are checked once the json-file logger is created
+		{splunkFilterSampleKey: "health", splunkFilterSampleRateKey: "0"},
+		// the fifo is opened once both loggers are started
+		{splunkJSONLogsKey: "true"},
+	} {
+		config[splunkURLKey] = hec.URL()
+		config[splunkTokenKey] = hec.token
+		info := logger.Info{
+			Config:      config,
+			ContainerID: "containeriid",
+			LogPath:     filepath.Join(dir, "containeriid-json.log"),
+		}
+		if err := d.StartLogging(filepath.Join(dir, "missing-fifo"), info); err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+		for i := 0; i < 100 && runtime.NumGoroutine() > goroutines; i++ {
+			time.Sleep(10 * time.Millisecond)
+		}
+		if n := runtime.NumGoroutine(); n > goroutines {
+			t.Fatalf("%v: expected the loggers to be closed, %d goroutines left over %d", config, n, goroutines)
+		}
+	}
+	if len(d.logs) != 0 || len(d.idx) != 0 {
+		t.Fatal("Expected no logger to be registered")
+	}
+}
@@ -0,0 +1,442 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"context"
+	"errors"
+	"fmt"
+	"io/ioutil"
+	"net/http"
+	"net/url"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// Consecutive failed requests after which an endpoint is taken out of rotation
+	defaultBreakerFailures = 3
+	// How often an endpoint out of rotation is probed with a health check
+	defaultHealthCheckInterval = 5 * time.Second
+	// How long a health check waits for the answer of HEC
+	defaultHealthCheckTimeout = 10 * time.Second
+	// How long the result of splunk-verify-connection is reused for other containers
+	defaultHealthCheckCacheTTL = 10 * time.Second
+	// With splunk-verify-connection=async, how long the endpoints have to become healthy
+	defaultVerifyConnectionDeadline = time.Minute
+)
+
+const (
+	// splunk-verify-connection value which verifies the endpoints in the background
+	verifyConnectionAsyncValue = "async"
+)
+
+const (
+	envVarBreakerFailures     = "SPLUNK_LOGGING_DRIVER_BREAKER_FAILURES"
+	envVarHealthCheckInterval = "SPLUNK_LOGGING_DRIVER_HEALTH_CHECK_INTERVAL"
+	envVarHealthCheckTimeout  = "SPLUNK_LOGGING_DRIVER_HEALTH_CHECK_TIMEOUT"
+	envVarHealthCheckCacheTTL = "SPLUNK_LOGGING_DRIVER_HEALTH_CHECK_CACHE_TTL"
+)
+
+var (
+	healthCheckTimeout = getAdvancedOptionDuration(envVarHealthCheckTimeout, defaultHealthCheckTimeout)
+	// results of splunk-verify-connection, shared by all the containers
+	healthChecks = newHealthCheckCache(getAdvancedOptionDuration(envVarHealthCheckCacheTTL, defaultHealthCheckCacheTTL))
+)
+
+const (
+	loadBalanceRoundRobin       = "round-robin"
+	loadBalanceLeastOutstanding = "least-outstanding"
+)
+
+// hecEndpoint is one of the HEC endpoints listed in splunk-url
+type hecEndpoint struct {
+	// where the batches are posted, the event endpoint or the raw endpoint
+	url            string
+	eventURL       string
+	healthCheckURL string
+	ackURL         string
+
+	client *http.Client
+	// connection pool shared with other loggers sending to the same endpoint,
+	// it also keeps the health of the endpoint, nil for standalone clients
+	shared *sharedTransport
+}
+
+func newHECEndpoint(splunkURL *url.URL, shared *sharedTransport) *hecEndpoint {
+	return &hecEndpoint{
+		url:            splunkURL.String(),
+		eventURL:       splunkURL.String(),
+		healthCheckURL: composeHealthCheckURL(splunkURL),
+		ackURL:         composeAckURL(splunkURL),
+		client:         shared.client,
+		shared:         shared,
+	}
+}
+
+// acquireEndpoints gets the shared transport of every endpoint, on error the
+// transports acquired so far are released
+func acquireEndpoints(splunkURLs []*url.URL, config map[string]string, insecureSkipVerify bool) ([]*hecEndpoint, error) {
+	endpoints := make([]*hecEndpoint, 0, len(splunkURLs))
+	for _, splunkURL := range splunkURLs {
+		key, err := newTransportKey(splunkURL.Scheme, splunkURL.Host, config, insecureSkipVerify)
+		if err == nil {
+			var shared *sharedTransport
+			shared, err = transports.acquire(key)
+			if err == nil {
+				endpoints = append(endpoints, newHECEndpoint(splunkURL, shared))
+				continue
+			}
+		}
+		releaseEndpoints(endpoints)
+		return nil, err
+	}
+	return endpoints, nil
+}
+
+func releaseEndpoints(endpoints []*hecEndpoint) {
+	for _, ep := range endpoints {
+		if ep.shared != nil {
+			transports.release(ep.shared)
+		}
+	}
+}
+
+func parseLoadBalance(config map[string]string) (string, error) {
+	loadBalance, ok := config[splunkLoadBalanceKey]
+	if !ok {
+		return loadBalanceRoundRobin, nil
+	}
+	switch loadBalance {
+	case loadBalanceRoundRobin:
+	case loadBalanceLeastOutstanding:
+	default:
+		return "", fmt.Errorf("%s: unknown value '%s' for %s, supported values are %s and %s",
+			driverName, loadBalance, splunkLoadBalanceKey, loadBalanceRoundRobin, loadBalanceLeastOutstanding)
+	}
+	return loadBalance, nil
+}
+
+// available returns false while the circuit breaker of the endpoint is open
+func (ep *hecEndpoint) available() bool {
+	return ep.shared == nil || ep.shared.available()
+}
+
+// outstanding returns the number of requests in flight to the endpoint from all the loggers
+func (ep *hecEndpoint) outstanding() int64 {
+	if ep.shared == nil {
+		return 0
+	}
+	return atomic.LoadInt64(&ep.shared.outstanding)
+}
+
+/*
+pickEndpoint returns the endpoint for the next request. Endpoints with an open
+circuit breaker are skipped. With round-robin the endpoints take turns, with
+least-outstanding the endpoint with the fewest requests in flight from all the
+loggers is picked, the turn breaking ties. When every endpoint is out of rotation
+they are still tried in turn, the same way a single endpoint is always tried.
+*/
+func (hec *hecClient) pickEndpoint() *hecEndpoint {
+	n := uint32(len(hec.endpoints))
+	if n == 1 {
+		return hec.endpoints[0]
+	}
+	start := atomic.AddUint32(&hec.nextEndpoint, 1)
+	var picked *hecEndpoint
+	for i := uint32(0); i < n; i++ {
+		ep := hec.endpoints[(start+i)%n]
+		if !ep.available() {
+			continue
+		}
+		if hec.loadBalance != loadBalanceLeastOutstanding {
+			return ep
+		}
+		if picked == nil || ep.outstanding() < picked.outstanding() {
+			picked = ep
+		}
+	}
+	if picked == nil {
+		picked = hec.endpoints[start%n]
+	}
+	return picked
+}
+
+// recordHealth feeds the circuit breaker of the endpoint with the result of a request.
+// A single endpoint has nowhere to fail over, so its breaker is never used.
+func (hec *hecClient) recordHealth(ep *hecEndpoint, healthy bool) {
+	if len(hec.endpoints) < 2 || ep.shared == nil {
+		return
+	}
+	if healthy {
+		ep.shared.succeeded()
+	} else {
+		ep.shared.failed()
+	}
+}
+
+// isServerFailure tells if a response means the endpoint cannot take requests now.
+// Other errors, like an invalid token, would be the same on every endpoint.
+func isServerFailure(statusCode int) bool {
+	return statusCode >= http.StatusInternalServerError || statusCode == http.StatusTooManyRequests
+}
+
+func (hec *hecClient) verifySplunkConnection() error {
+	var failed []string
+	for _, ep := range hec.endpoints {
+		err := healthChecks.check(ep)
+		if err == nil {
+			continue
+		}
+		if len(hec.endpoints) == 1 {
+			return err
+		}
+		logrus.WithField("url", ep.url).WithError(err).Warn("HEC endpoint is not healthy, taking it out of rotation")
+		if ep.shared != nil {
+			ep.shared.trip()
+		}
+		failed = append(failed, err.Error())
+	}
+	if len(failed) == len(hec.endpoints) {
+		return errors.New(strings.Join(failed, "; "))
+	}
+	return nil
+}
+
+/*
+verifyAsync verifies the endpoints with splunk-verify-connection=async, while the
+logger already takes messages. The check is repeated every health check interval
+until it succeeds. When the endpoints are still not healthy after the deadline,
+the logger drops the messages of the container until a check succeeds, as the
+container would not have started with splunk-verify-connection=true. The failure
+and the recovery are logged once, the dropped messages are counted and reported
+when the logger is closed.
+*/
+func (l *splunkLogger) verifyAsync(deadline time.Duration) {
+	interval := getAdvancedOptionDuration(envVarHealthCheckInterval, defaultHealthCheckInterval)
+	timer := time.NewTimer(deadline)
+	defer timer.Stop()
+	retry := time.NewTimer(interval)
+	defer retry.Stop()
+	for {
+		err := l.hec.verifySplunkConnection()
+		if err == nil {
+			if atomic.CompareAndSwapInt32(&l.verifyFailed, 1, 0) {
+				logrus.WithField("id", l.backpressure.containerID).
+					WithField("rejected", atomic.LoadInt64(&l.rejected.dropped)).
+					Info("HEC endpoints are healthy, the messages of the container are taken again")
+			}
+			return
+		}
+		select {
+		case <-l.stop:
+			return
+		case <-timer.C:
+			// the timer does not fire again, the checks go on until one succeeds
+			logrus.WithField("id", l.backpressure.containerID).WithError(err).
+				Errorf("HEC endpoints are still not healthy after %v, the messages of the container are rejected", deadline)
+			atomic.StoreInt32(&l.verifyFailed, 1)
+		case <-retry.C:
+			retry.Reset(interval)
+		}
+	}
+}
+
+// checkHealth asks the health endpoint of HEC if it accepts requests, within healthCheckTimeout
+func checkHealth(client *http.Client, healthCheckURL string) error {
+	req, err := http.NewRequest(http.MethodGet, healthCheckURL, nil)
+	if err != nil {
+		return err
+	}
+	ctx, cancel := context.WithTimeout(context.Background(), healthCheckTimeout)
+	defer cancel()
+	req = req.WithContext(ctx)
+	res, err := client.Do(req)
+	if err != nil {
+		return err
+	}
+	if res.Body != nil {
+		defer res.Body.Close()
+	}
+	if res.StatusCode != http.StatusOK {
+		var body []byte
+		body, err = ioutil.ReadAll(res.Body)
+		if err != nil {
+			return err
+		}
+		return fmt.Errorf("%s: failed to verify connection - %s - %s", driverName, res.Status, body)
+	}
+	return nil
+}
+
+type healthCheckCall struct {
+	// closed once err and checked are set
+	done    chan struct{}
+	err     error
+	checked time.Time
+}
+
+/*
+healthCheckCache keeps the result of the last health check of every endpoint for
+ttl, so the containers started together, like after a restart of the daemon, do
+not all check the same endpoint. The containers which verify an endpoint while it
+is checked wait for that check instead of starting their own. Endpoints are told
+apart by their transport key, which includes the TLS settings.
+*/
+type healthCheckCache struct {
+	ttl time.Duration
+
+	mu    sync.Mutex
+	calls map[transportKey]*healthCheckCall
+
+	// updated atomically
+	checked int64
+	cached  int64
+	shared  int64
+}
+
+func newHealthCheckCache(ttl time.Duration) *healthCheckCache {
+	return &healthCheckCache{ttl: ttl, calls: make(map[transportKey]*healthCheckCall)}
+}
+
+// check returns the health of the endpoint, checked at most ttl ago
+func (c *healthCheckCache) check(ep *hecEndpoint) error {
+	if ep.shared == nil {
+		atomic.AddInt64(&c.checked, 1)
+		return checkHealth(ep.client, ep.healthCheckURL)
+	}
+	key := ep.shared.key
+	c.mu.Lock()
+	if call, ok := c.calls[key]; ok {
+		select {
+		case <-call.done:
+			if time.Since(call.checked) < c.ttl {
+				c.mu.Unlock()
+				atomic.AddInt64(&c.cached, 1)
+				return call.err
+			}
+		default:
+			c.mu.Unlock()
+			atomic.AddInt64(&c.shared, 1)
+			<-call.done
+			return call.err
+		}
+	}
+	for other, call := range c.calls {
+		select {
+		case <-call.done:
+			if time.Since(call.checked) >= c.ttl {
+				delete(c.calls, other)
+			}
+		default:
+		}
+	}
+	call := &healthCheckCall{done: make(chan struct{})}
+	c.calls[key] = call
+	c.mu.Unlock()
+
+	atomic.AddInt64(&c.checked, 1)
+	call.err = checkHealth(ep.client, ep.healthCheckURL)
+	call.checked = time.Now()
+	close(call.done)
+	return call.err
+}
+
+/*
+The circuit breaker of an endpoint lives in its shared transport, so every
+container sending to the endpoint sees the same state. It opens after
+breakerFailures consecutive failed requests. While it is open the endpoint is
+probed every healthCheckInterval and the breaker closes on the first healthy
+answer, or on the first request which succeeds when all endpoints are out of
+rotation.
+*/
+func (shared *sharedTransport) available() bool {
+	shared.health.Lock()
+	defer shared.health.Unlock()
+	return !shared.health.open
+}
+
+func (shared *sharedTransport) succeeded() {
+	shared.health.Lock()
+	defer shared.health.Unlock()
+	shared.health.failures = 0
+	if shared.health.open {
+		shared.health.open = false
+		logrus.WithField("host", shared.key.host).Info("HEC endpoint is back in rotation")
+	}
+}
+
+func (shared *sharedTransport) failed() {
+	shared.health.Lock()
+	defer shared.health.Unlock()
+	shared.health.failures++
+	if !shared.health.open && shared.health.failures >= shared.health.threshold {
+		shared.tripLocked()
+	}
+}
+
+// trip takes the endpoint out of rotation right away
+func (shared *sharedTransport) trip() {
+	shared.health.Lock()
+	defer shared.health.Unlock()
+	if !shared.health.open {
+		shared.tripLocked()
+	}
+}
+
+func (shared *sharedTransport) tripLocked() {
+	shared.health.open = true
+	atomic.AddInt64(&shared.breakerTrips, 1)
+	logrus.WithField("host", shared.key.host).
+		WithField("failures", shared.health.failures).
+		Warn("HEC endpoint is out of rotation")
+	if !shared.health.probing {
+		shared.health.probing = true
+		go shared.probe()
+	}
+}
+
+// probe checks the health of the endpoint until the breaker closes or the transport is released
+func (shared *sharedTransport) probe() {
+	healthCheckURL := shared.key.scheme + "://" + shared.key.host + "/services/collector/health"
+	ticker := time.NewTicker(shared.health.interval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-shared.done:
+			return
+		case <-ticker.C:
+		}
+		err := checkHealth(shared.client, healthCheckURL)
+		if err == nil {
+			shared.succeeded()
+		} else {
+			logrus.WithField("host", shared.key.host).WithError(err).Debug("HEC endpoint is still not healthy")
+		}
+		shared.health.Lock()
+		if !shared.health.open {
+			shared.health.probing = false
+			shared.health.Unlock()
+			return
+		}
+		shared.health.Unlock()
+	}
+}
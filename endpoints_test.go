@@ -0,0 +1,332 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+func newEndpointsTestLogger(t *testing.T, config map[string]string) logger.Logger {
+	config[splunkTokenKey] = "4642492F-D8BD-47F1-A005-0C08AE4657DF"
+	info := logger.Info{
+		Config:             config,
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return loggerDriver
+}
+
+func setEndpointsTestOptions(t *testing.T, breakerFailures string, healthCheckInterval string) {
+	for name, value := range map[string]string{
+		envVarPostMessagesFrequency: "10h",
+		envVarPostMessagesBatchSize: "1",
+		envVarBreakerFailures:       breakerFailures,
+		envVarHealthCheckInterval:   healthCheckInterval,
+	} {
+		if err := os.Setenv(name, value); err != nil {
+			t.Fatal(err)
+		}
+	}
+}
+
+func TestParseURLList(t *testing.T) {
+	urls, err := parseURL(logger.Info{Config: map[string]string{splunkURLKey: "https://splunk1:8088, https://splunk2:8088/"}})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(urls) != 2 ||
+		urls[0].String() != "https://splunk1:8088/services/collector/event/1.0" ||
+		urls[1].String() != "https://splunk2:8088/services/collector/event/1.0" {
+		t.Fatalf("Unexpected endpoints %v", urls)
+	}
+
+	if _, err := parseURL(logger.Info{Config: map[string]string{splunkURLKey: "https://splunk1:8088,splunk2"}}); err == nil {
+		t.Fatal("Expected error for an invalid endpoint in the list")
+	}
+
+	if _, err := parseLoadBalance(map[string]string{splunkLoadBalanceKey: "random"}); err == nil {
+		t.Fatal("Expected error for an unknown load balancing")
+	}
+}
+
+// Verify that the batches are spread over the endpoints
+func TestLoadBalance(t *testing.T) {
+	setEndpointsTestOptions(t, "", "")
+	defer setEndpointsTestOptions(t, "", "")
+
+	for _, loadBalance := range []string{loadBalanceRoundRobin, loadBalanceLeastOutstanding} {
+		hec1 := NewHTTPEventCollectorMock(t)
+		go hec1.Serve()
+		hec2 := NewHTTPEventCollectorMock(t)
+		go hec2.Serve()
+
+		loggerDriver := newEndpointsTestLogger(t, map[string]string{
+			splunkURLKey:         hec1.URL() + "," + hec2.URL(),
+			splunkLoadBalanceKey: loadBalance,
+		})
+		for i := 0; i < 10; i++ {
+			if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+				t.Fatal(err)
+			}
+		}
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+			t.Fatal(err)
+		}
+		if received1, received2 := receivedMessages(hec1), receivedMessages(hec2); received1 != 5 || received2 != 5 {
+			t.Fatalf("%s: expected 5 messages on each endpoint, got %d and %d", loadBalance, received1, received2)
+		}
+
+		if err := loggerDriver.Close(); err != nil {
+			t.Fatal(err)
+		}
+		hec1.Close()
+		hec2.Close()
+	}
+}
+
+// Verify that a failing endpoint is taken out of rotation and is back once healthy
+func TestEndpointCircuitBreaker(t *testing.T) {
+	setEndpointsTestOptions(t, "2", "20ms")
+	defer setEndpointsTestOptions(t, "", "")
+
+	healthy := NewHTTPEventCollectorMock(t)
+	go healthy.Serve()
+	defer healthy.Close()
+	failing := NewHTTPEventCollectorMock(t)
+	failing.simulateServerError = true
+	go failing.Serve()
+	defer failing.Close()
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey: healthy.URL() + "," + failing.URL(),
+	})
+	shared := loggerDriver.(*splunkLoggerInline).hec.endpoints[1].shared
+
+	for i := 0; i < 10; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	// the failed batches are kept and sent again on the next flush
+	var err error
+	for i := 0; i < 5; i++ {
+		if err = loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err == nil {
+			break
+		}
+	}
+	if err != nil {
+		t.Fatal(err)
+	}
+	if received := receivedMessages(healthy); received != 10 {
+		t.Fatalf("Expected all the messages on the healthy endpoint, got %d", received)
+	}
+	if shared.available() {
+		t.Fatal("Expected the failing endpoint to be out of rotation")
+	}
+	if trips := atomic.LoadInt64(&shared.breakerTrips); trips != 1 {
+		t.Fatalf("Unexpected number of trips %d", trips)
+	}
+
+	failing.lock.Lock()
+	failing.simulateServerError = false
+	failing.lock.Unlock()
+	for i := 0; !shared.available(); i++ {
+		if i == 500 {
+			t.Fatal("Expected the endpoint to be back in rotation after a healthy probe")
+		}
+		time.Sleep(10 * time.Millisecond)
+	}
+
+	for i := 0; i < 10; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+		t.Fatal(err)
+	}
+	if received := receivedMessages(failing); received != 5 {
+		t.Fatalf("Expected the recovered endpoint to get half of the messages, got %d", received)
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// newHealthServer answers the health checks with status after delay and counts them
+func newHealthServer(status *int64, delay time.Duration, checks *int64) *httptest.Server {
+	return httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		if r.URL.Path == "/services/collector/health" {
+			atomic.AddInt64(checks, 1)
+			time.Sleep(delay)
+			w.WriteHeader(int(atomic.LoadInt64(status)))
+		}
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+}
+
+// Verify that the containers started together share one health check and that
+// the result is reused for the next containers
+func TestVerifyConnectionCache(t *testing.T) {
+	status := int64(http.StatusOK)
+	var checks int64
+	hec := newHealthServer(&status, 100*time.Millisecond, &checks)
+	defer hec.Close()
+
+	var wg sync.WaitGroup
+	loggers := make(chan logger.Logger, 20)
+	for i := 0; i < 20; i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			loggers <- newEndpointsTestLogger(t, map[string]string{
+				splunkURLKey:              hec.URL,
+				splunkVerifyConnectionKey: "true",
+			})
+		}()
+	}
+	wg.Wait()
+	close(loggers)
+	loggers2 := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:              hec.URL,
+		splunkVerifyConnectionKey: "true",
+	})
+	if checks := atomic.LoadInt64(&checks); checks != 1 {
+		t.Fatalf("Expected one health check for all the containers, got %d", checks)
+	}
+	for l := range loggers {
+		l.Close()
+	}
+	loggers2.Close()
+}
+
+// Verify that a hung health check fails the container after the timeout
+func TestVerifyConnectionTimeout(t *testing.T) {
+	healthCheckTimeout = 50 * time.Millisecond
+	defer func() {
+		healthCheckTimeout = defaultHealthCheckTimeout
+	}()
+	status := int64(http.StatusOK)
+	var checks int64
+	hec := newHealthServer(&status, 300*time.Millisecond, &checks)
+	defer hec.Close()
+
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:              hec.URL,
+			splunkTokenKey:            "4642492F-D8BD-47F1-A005-0C08AE4657DF",
+			splunkVerifyConnectionKey: "true",
+		},
+		ContainerID: "containeriid",
+	}
+	start := time.Now()
+	if _, err := New(info); err == nil {
+		t.Fatal("Expected the health check to time out")
+	}
+	if elapsed := time.Since(start); elapsed > 500*time.Millisecond {
+		t.Fatalf("Expected the health check to give up after the timeout, took %v", elapsed)
+	}
+}
+
+// Verify that with async verification the container starts right away, its messages
+// are only rejected once the endpoint stayed unhealthy past the deadline and are
+// taken again once the endpoint recovers
+func TestVerifyConnectionAsync(t *testing.T) {
+	if err := os.Setenv(envVarHealthCheckInterval, "20ms"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarHealthCheckInterval, "")
+	// the recovery is seen by the next check
+	defer func(cache *healthCheckCache) { healthChecks = cache }(healthChecks)
+	healthChecks = newHealthCheckCache(0)
+	status := int64(http.StatusServiceUnavailable)
+	var checks int64
+	hec := newHealthServer(&status, 0, &checks)
+	defer hec.Close()
+
+	recovered := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:              hec.URL,
+		splunkVerifyConnectionKey: verifyConnectionAsyncValue,
+		splunkVerifyDeadlineKey:   "10s",
+	})
+	failed := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:              hec.URL,
+		splunkVerifyConnectionKey: verifyConnectionAsyncValue,
+		splunkVerifyDeadlineKey:   "100ms",
+	})
+	message := func() *logger.Message {
+		return &logger.Message{Line: []byte("line"), Source: "stdout", Timestamp: time.Now()}
+	}
+	if err := failed.Log(message()); err != nil {
+		t.Fatalf("Expected the messages to be taken before the deadline, got %v", err)
+	}
+
+	rejected := &failed.(*splunkLoggerInline).rejected
+	for i := 0; i < 500 && atomic.LoadInt64(&rejected.dropped) == 0; i++ {
+		time.Sleep(10 * time.Millisecond)
+		if err := failed.Log(message()); err != nil {
+			t.Fatalf("Expected the rejected messages to be counted, got %v", err)
+		}
+	}
+	if atomic.LoadInt64(&rejected.dropped) == 0 {
+		t.Fatal("Expected the messages to be rejected after the deadline")
+	}
+
+	atomic.StoreInt64(&status, http.StatusOK)
+	time.Sleep(200 * time.Millisecond)
+	for _, l := range []logger.Logger{recovered, failed} {
+		if err := l.Log(message()); err != nil {
+			t.Fatalf("Expected the messages to be taken once the endpoint is healthy, got %v", err)
+		}
+	}
+	if atomic.LoadInt32(&failed.(*splunkLoggerInline).verifyFailed) != 0 {
+		t.Fatal("Expected the messages to be taken again once the endpoint is healthy")
+	}
+	dropped := atomic.LoadInt64(&rejected.dropped)
+	if err := failed.Log(message()); err != nil || atomic.LoadInt64(&rejected.dropped) != dropped {
+		t.Fatalf("Expected the message to be taken, got %v", err)
+	}
+	recovered.Close()
+	failed.Close()
+
+	for _, config := range []map[string]string{
+		{splunkVerifyDeadlineKey: "1m"},
+		{splunkVerifyConnectionKey: verifyConnectionAsyncValue, splunkVerifyDeadlineKey: "0s"},
+	} {
+		config[splunkURLKey] = hec.URL
+		config[splunkTokenKey] = "4642492F-D8BD-47F1-A005-0C08AE4657DF"
+		if _, err := New(logger.Info{Config: config, ContainerID: "containeriid"}); err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+	}
+}
@@ -0,0 +1,225 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"encoding/json"
+	"strconv"
+	"time"
+	"unicode/utf8"
+)
+
+/*
+messageEnvelope holds the parts of the encoded message which never change for a logger:
+host, source, sourcetype, index, tag and attrs are rendered once in New(), and for every
+event only the line, the event source and the time are encoded.
+
+The output is the same as json.Marshal of the equivalent splunkMessage, except for the
+raw endpoint of HEC, which takes the prefixed lines as they are, one per line.
+*/
+type messageEnvelope struct {
+	// rendered up to the value of the line (or of the raw event)
+	prefix []byte
+	// rendered after the event source up to the value of the time
+	eventSuffix []byte
+	// rendered after the value of the time
+	suffix []byte
+	// raw format has no event object, only the prefixed line
+	raw       bool
+	rawPrefix []byte
+	// lines for the raw endpoint, the metadata is sent once per request
+	lines bool
+}
+
+func newMessageEnvelope(nullMessage *splunkMessage, nullEvent *splunkMessageEvent, rawPrefix []byte) (*messageEnvelope, error) {
+	env := &messageEnvelope{}
+	if nullEvent == nil {
+		env.raw = true
+		env.rawPrefix = rawPrefix
+		env.prefix = []byte(`{"event":`)
+		env.eventSuffix = []byte(`,"time":"`)
+	} else {
+		env.prefix = []byte(`{"event":{"line":`)
+		var eventSuffix bytes.Buffer
+		if nullEvent.Tag != "" {
+			if err := appendJSONField(&eventSuffix, "tag", nullEvent.Tag); err != nil {
+				return nil, err
+			}
+		}
+		if len(nullEvent.Attrs) > 0 {
+			if err := appendJSONField(&eventSuffix, "attrs", nullEvent.Attrs); err != nil {
+				return nil, err
+			}
+		}
+		eventSuffix.WriteString(`},"time":"`)
+		env.eventSuffix = eventSuffix.Bytes()
+	}
+
+	var suffix bytes.Buffer
+	suffix.WriteByte('"')
+	if err := appendJSONField(&suffix, "host", nullMessage.Host); err != nil {
+		return nil, err
+	}
+	for _, field := range []struct {
+		name  string
+		value string
+	}{
+		{"source", nullMessage.Source},
+		{"sourcetype", nullMessage.SourceType},
+		{"index", nullMessage.Index},
+		{"entity", nullMessage.Entity},
+	} {
+		// omitempty
+		if field.value == "" {
+			continue
+		}
+		if err := appendJSONField(&suffix, field.name, field.value); err != nil {
+			return nil, err
+		}
+	}
+	suffix.WriteByte('}')
+	env.suffix = suffix.Bytes()
+	return env, nil
+}
+
+func newRawLinesEnvelope(rawPrefix []byte) *messageEnvelope {
+	return &messageEnvelope{raw: true, rawPrefix: rawPrefix, lines: true}
+}
+
+func appendJSONField(buf *bytes.Buffer, name string, value interface{}) error {
+	encoded, err := json.Marshal(value)
+	if err != nil {
+		return err
+	}
+	buf.WriteString(`,"`)
+	buf.WriteString(name)
+	buf.WriteString(`":`)
+	buf.Write(encoded)
+	return nil
+}
+
+// encode renders the whole message for the line. When rawJSON is set and the line
+// is a valid JSON value, it is embedded as is instead of as a string.
+func (env *messageEnvelope) encode(line []byte, rawJSON bool, source string, timestamp time.Time) []byte {
+	payload, _ := env.encodeLine(line, rawJSON, source, timestamp)
+	return payload
+}
+
+// encodeLine is encode which also tells if the line was embedded as JSON
+func (env *messageEnvelope) encodeLine(line []byte, rawJSON bool, source string, timestamp time.Time) ([]byte, bool) {
+	if env.lines {
+		payload := make([]byte, 0, len(env.rawPrefix)+len(line)+1)
+		payload = append(payload, env.rawPrefix...)
+		payload = append(payload, line...)
+		return append(payload, '\n'), false
+	}
+	isJSON := false
+	size := len(env.prefix) + len(env.rawPrefix) + len(line) + len(source) + len(env.eventSuffix) + len(env.suffix) + 32
+	payload := make([]byte, 0, size+size/8)
+	payload = append(payload, env.prefix...)
+	if env.raw {
+		payload = append(payload, '"')
+		payload = appendJSONStringContent(payload, env.rawPrefix)
+		payload = appendJSONStringContent(payload, line)
+		payload = append(payload, '"')
+	} else {
+		if rawJSON {
+			payload, isJSON = appendCompactJSON(payload, line)
+		}
+		if !isJSON {
+			payload = appendJSONString(payload, line)
+		}
+		payload = append(payload, `,"source":`...)
+		payload = appendJSONString(payload, []byte(source))
+	}
+	payload = append(payload, env.eventSuffix...)
+	payload = appendMessageTime(payload, timestamp)
+	payload = append(payload, env.suffix...)
+	return payload, isJSON
+}
+
+// appendMessageTime formats time as seconds since epoch, the same as fmt.Sprintf("%f")
+func appendMessageTime(dst []byte, timestamp time.Time) []byte {
+	return strconv.AppendFloat(dst, float64(timestamp.UnixNano())/float64(time.Second), 'f', 6, 64)
+}
+
+// appendJSONString appends s as a quoted JSON string
+func appendJSONString(dst []byte, s []byte) []byte {
+	dst = append(dst, '"')
+	dst = appendJSONStringContent(dst, s)
+	return append(dst, '"')
+}
+
+const hex = "0123456789abcdef"
+
+// safeASCII is true for ASCII characters which can be written to a JSON string as is.
+// Control characters, quote, backslash and the HTML characters need escaping.
+var safeASCII = func() (safe [utf8.RuneSelf]bool) {
+	for c := 0x20; c < utf8.RuneSelf; c++ {
+		safe[c] = c != '"' && c != '\\' && c != '<' && c != '>' && c != '&'
+	}
+	return safe
+}()
+
+// appendJSONStringContent escapes s the same way encoding/json does with HTML escaping,
+// runs of safe ASCII characters are copied at once
+func appendJSONStringContent(dst []byte, s []byte) []byte {
+	start := 0
+	for i := 0; i < len(s); {
+		if c := s[i]; c < utf8.RuneSelf {
+			if safeASCII[c] {
+				i++
+				continue
+			}
+			dst = append(dst, s[start:i]...)
+			switch c {
+			case '"', '\\':
+				dst = append(dst, '\\', c)
+			case '\n':
+				dst = append(dst, '\\', 'n')
+			case '\r':
+				dst = append(dst, '\\', 'r')
+			case '\t':
+				dst = append(dst, '\\', 't')
+			default:
+				dst = append(dst, '\\', 'u', '0', '0', hex[c>>4], hex[c&0xF])
+			}
+			i++
+			start = i
+			continue
+		}
+		r, size := utf8.DecodeRune(s[i:])
+		if r == utf8.RuneError && size == 1 {
+			dst = append(dst, s[start:i]...)
+			dst = append(dst, `\ufffd`...)
+			i += size
+			start = i
+			continue
+		}
+		// U+2028 and U+2029 are valid JSON but break JavaScript parsers
+		if r == '\u2028' || r == '\u2029' {
+			dst = append(dst, s[start:i]...)
+			dst = append(dst, '\\', 'u', '2', '0', '2', hex[r&0xF])
+			i += size
+			start = i
+			continue
+		}
+		i += size
+	}
+	return append(dst, s[start:]...)
+}
@@ -0,0 +1,99 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"encoding/json"
+	"fmt"
+	"testing"
+	"time"
+)
+
+var envelopeTestLines = []string{
+	"",
+	"plain ascii line",
+	"quote \" backslash \\ slash /",
+	"html <script>alert('&')</script>",
+	"control \n\r\t\x00\x1f\x7f\b\f",
+	"unicode é 日本 😀",
+	"separators    ",
+	"invalid utf8 \xff\xfe \xe2\x80",
+	`{"a":"b"}`,
+	` { "a" : [1, 2, {"x":"<y>&"}], "b": " " } `,
+	`123`,
+	`"string"`,
+	`{"a":`,
+}
+
+// Encoded messages should be the same as json.Marshal of splunkMessage
+func TestMessageEnvelope(t *testing.T) {
+	nullMessage := &splunkMessage{
+		Host:       "host<1>",
+		Source:     "mysource",
+		SourceType: "mysourcetype",
+	}
+	nullEvent := &splunkMessageEvent{
+		Tag:   "image/container",
+		Attrs: map[string]string{"b": "2", "a": "1 & 1"},
+	}
+	rawPrefix := []byte("image/container a=1 ")
+	timestamp := time.Unix(1528830000, 123456789)
+
+	inline, err := newMessageEnvelope(nullMessage, nullEvent, nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	raw, err := newMessageEnvelope(nullMessage, nil, rawPrefix)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	for _, line := range envelopeTestLines {
+		for _, detectJSON := range []bool{false, true} {
+			message := *nullMessage
+			message.Time = fmt.Sprintf("%f", float64(timestamp.UnixNano())/float64(time.Second))
+			event := *nullEvent
+			event.Source = "stdout"
+			var rawJSONMessage json.RawMessage
+			if detectJSON && json.Unmarshal([]byte(line), &rawJSONMessage) == nil {
+				event.Line = &rawJSONMessage
+			} else {
+				event.Line = line
+			}
+			message.Event = &event
+
+			expected, err := json.Marshal(&message)
+			if err != nil {
+				t.Fatal(err)
+			}
+			if payload := inline.encode([]byte(line), detectJSON, "stdout", timestamp); string(payload) != string(expected) {
+				t.Fatalf("Unexpected message\n%s\nexpected\n%s", payload, expected)
+			}
+		}
+
+		message := *nullMessage
+		message.Time = fmt.Sprintf("%f", float64(timestamp.UnixNano())/float64(time.Second))
+		message.Event = string(rawPrefix) + line
+		expected, err := json.Marshal(&message)
+		if err != nil {
+			t.Fatal(err)
+		}
+		if payload := raw.encode([]byte(line), false, "", timestamp); string(payload) != string(expected) {
+			t.Fatalf("Unexpected raw message\n%s\nexpected\n%s", payload, expected)
+		}
+	}
+}
@@ -0,0 +1,164 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"container/heap"
+	"fmt"
+	"strconv"
+	"sync"
+	"sync/atomic"
+)
+
+const (
+	// Requests in flight to one HEC endpoint from all the loggers, 0 means no limit
+	defaultEndpointConcurrency = 0
+	defaultWeight              = 1
+)
+
+const (
+	envVarEndpointConcurrency = "SPLUNK_LOGGING_DRIVER_ENDPOINT_CONCURRENCY"
+)
+
+func parseWeight(config map[string]string) (float64, error) {
+	weightStr, ok := config[splunkWeightKey]
+	if !ok {
+		return defaultWeight, nil
+	}
+	weight, err := strconv.ParseFloat(weightStr, 64)
+	if err != nil {
+		return 0, err
+	}
+	if weight <= 0 {
+		return 0, fmt.Errorf("%s: %s should be positive", driverName, splunkWeightKey)
+	}
+	return weight, nil
+}
+
+/*
+fairQueue shares the requests to one HEC endpoint between the loggers sending to
+it. Up to slots requests are in flight, further batches wait and are sent in
+weighted fair order: every batch gets the finish tag start + bytes / weight, where
+start is the later of the virtual time and the finish tag of the previous batch of
+the logger, and the waiting batch with the smallest tag goes first. The virtual time
+is the tag of the last batch sent (self-clocked fair queueing), so a logger which
+was idle does not get credit for the time it did not send, and a noisy logger cannot
+delay the batches of the others by more than one of its own.
+*/
+type fairQueue struct {
+	slots int
+
+	mu       sync.Mutex
+	inFlight int
+	vtime    float64
+	// finish tag of the last batch of each logger
+	finish  map[*hecClient]float64
+	waiting fairWaiters
+	seq     uint64
+
+	// batches which had to wait, updated atomically
+	waits int64
+}
+
+type fairWaiter struct {
+	finish float64
+	// breaks ties in arrival order
+	seq   uint64
+	ready chan struct{}
+}
+
+func newFairQueue(slots int) *fairQueue {
+	return &fairQueue{slots: slots, finish: make(map[*hecClient]float64)}
+}
+
+// acquire waits for a slot to send a batch of bytes for the logger
+func (q *fairQueue) acquire(hec *hecClient, bytes int) {
+	if q.slots <= 0 {
+		return
+	}
+	weight := hec.weight
+	if weight <= 0 {
+		weight = defaultWeight
+	}
+	q.mu.Lock()
+	start := q.vtime
+	if last := q.finish[hec]; last > start {
+		start = last
+	}
+	finish := start + float64(bytes)/weight
+	q.finish[hec] = finish
+	if q.inFlight < q.slots && len(q.waiting) == 0 {
+		q.inFlight++
+		q.vtime = finish
+		q.mu.Unlock()
+		return
+	}
+	w := &fairWaiter{finish: finish, seq: q.seq, ready: make(chan struct{})}
+	q.seq++
+	heap.Push(&q.waiting, w)
+	q.mu.Unlock()
+	atomic.AddInt64(&q.waits, 1)
+	<-w.ready
+}
+
+// release frees the slot of a batch and hands it to the next waiting batch
+func (q *fairQueue) release() {
+	if q.slots <= 0 {
+		return
+	}
+	q.mu.Lock()
+	defer q.mu.Unlock()
+	if len(q.waiting) == 0 {
+		q.inFlight--
+		// forget the loggers which are not ahead of the virtual time
+		for hec, finish := range q.finish {
+			if finish <= q.vtime {
+				delete(q.finish, hec)
+			}
+		}
+		return
+	}
+	w := heap.Pop(&q.waiting).(*fairWaiter)
+	q.vtime = w.finish
+	close(w.ready)
+}
+
+// depth returns the number of batches waiting for a slot
+func (q *fairQueue) depth() int {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+	return len(q.waiting)
+}
+
+// fairWaiters is a heap of the waiting batches ordered by finish tag
+type fairWaiters []*fairWaiter
+
+func (h fairWaiters) Len() int { return len(h) }
+func (h fairWaiters) Less(i, j int) bool {
+	if h[i].finish != h[j].finish {
+		return h[i].finish < h[j].finish
+	}
+	return h[i].seq < h[j].seq
+}
+func (h fairWaiters) Swap(i, j int)       { h[i], h[j] = h[j], h[i] }
+func (h *fairWaiters) Push(x interface{}) { *h = append(*h, x.(*fairWaiter)) }
+func (h *fairWaiters) Pop() interface{} {
+	old := *h
+	w := old[len(old)-1]
+	*h = old[:len(old)-1]
+	return w
+}
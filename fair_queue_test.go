@@ -0,0 +1,99 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"testing"
+	"time"
+)
+
+// queueFairBatch waits until the batch is queued behind the busy slot
+func queueFairBatch(t *testing.T, q *fairQueue, hec *hecClient, name string, order chan<- string) {
+	depth := q.depth()
+	go func() {
+		q.acquire(hec, 100)
+		order <- name
+	}()
+	deadline := time.Now().Add(10 * time.Second)
+	for q.depth() == depth {
+		if time.Now().After(deadline) {
+			t.Fatal("Batch was not queued")
+		}
+		time.Sleep(time.Millisecond)
+	}
+}
+
+// Verify that a quiet logger does not wait behind the queued batches of a noisy one,
+// and that the weights share the endpoint
+func TestFairQueue(t *testing.T) {
+	noisy := &hecClient{weight: 1}
+	quiet := &hecClient{weight: 1}
+	heavy := &hecClient{weight: 3}
+
+	q := newFairQueue(1)
+	q.acquire(noisy, 100)
+	order := make(chan string, 16)
+	for i := 0; i < 4; i++ {
+		queueFairBatch(t, q, noisy, "noisy", order)
+	}
+	queueFairBatch(t, q, quiet, "quiet", order)
+
+	var sent []string
+	for i := 0; i < 5; i++ {
+		q.release()
+		sent = append(sent, <-order)
+	}
+	q.release()
+	if sent[0] != "noisy" || sent[1] != "quiet" {
+		t.Fatalf("Expected the quiet logger to go second, got %v", sent)
+	}
+
+	q.acquire(noisy, 100)
+	for i := 0; i < 3; i++ {
+		queueFairBatch(t, q, noisy, "noisy", order)
+		queueFairBatch(t, q, heavy, "heavy", order)
+		queueFairBatch(t, q, heavy, "heavy", order)
+	}
+	sent = sent[:0]
+	for i := 0; i < 9; i++ {
+		q.release()
+		sent = append(sent, <-order)
+	}
+	q.release()
+	heavyFirst := 0
+	for _, name := range sent[:4] {
+		if name == "heavy" {
+			heavyFirst++
+		}
+	}
+	if heavyFirst < 3 {
+		t.Fatalf("Expected the logger with weight 3 to get most of the first batches, got %v", sent)
+	}
+	if q.inFlight != 0 || len(q.finish) != 0 || q.waits != 14 {
+		t.Fatalf("Unexpected state after all the batches, %d in flight, %d loggers, %d waits", q.inFlight, len(q.finish), q.waits)
+	}
+}
+
+func TestFairQueueUnlimited(t *testing.T) {
+	q := newFairQueue(0)
+	for i := 0; i < 100; i++ {
+		q.acquire(&hecClient{}, 100)
+	}
+	if q.depth() != 0 || q.waits != 0 {
+		t.Fatal("Expected no queueing without a limit")
+	}
+}
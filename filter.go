@@ -0,0 +1,264 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"regexp"
+	"strconv"
+	"strings"
+	"sync/atomic"
+)
+
+const (
+	filterKeep   = "keep"
+	filterDrop   = "drop"
+	filterSample = "sample"
+)
+
+const (
+	// With sample rules, one line in this many is sent
+	defaultFilterSampleRate = 10
+)
+
+// filterActions are in the order rules apply, a line matching a keep rule is always sent
+var filterActions = [...]struct {
+	action     string
+	literalKey string
+	regexKey   string
+}{
+	{filterKeep, splunkFilterKeepKey, splunkFilterKeepRegexKey},
+	{filterDrop, splunkFilterDropKey, splunkFilterDropRegexKey},
+	{filterSample, splunkFilterSampleKey, splunkFilterSampleRegexKey},
+}
+
+type filterRule struct {
+	action  string
+	pattern string
+	// position of the action in filterActions
+	rank int
+	// nil for a literal pattern
+	regexp *regexp.Regexp
+
+	// updated atomically
+	matched      int64
+	dropped      int64
+	droppedBytes int64
+}
+
+/*
+lineFilter decides which messages of a container are sent to Splunk, before they
+are encoded. A message matching a keep rule is sent, otherwise a message matching a
+drop rule is dropped, otherwise one message in splunk-filter-sample-rate matching a
+sample rule is sent. The literal patterns of all the rules are matched in one pass
+over the message, the regular expressions only when no literal decided the message
+already. Sampling counts the messages of each rule, so a message repeated many
+times is sampled like different messages.
+*/
+type lineFilter struct {
+	// ordered by rank
+	rules      []*filterRule
+	literals   *literalMatcher
+	regexps    []int
+	sampleRate uint64
+}
+
+// newLineFilter reads the filter rules of the container, it returns nil without rules
+func newLineFilter(config map[string]string) (*lineFilter, error) {
+	f := &lineFilter{sampleRate: defaultFilterSampleRate}
+	var literals []string
+	var literalRules []int
+	for rank, a := range filterActions {
+		if patterns, ok := config[a.literalKey]; ok {
+			for _, pattern := range strings.Split(patterns, ",") {
+				if pattern == "" {
+					continue
+				}
+				literals = append(literals, pattern)
+				literalRules = append(literalRules, len(f.rules))
+				f.rules = append(f.rules, &filterRule{action: a.action, pattern: pattern, rank: rank})
+			}
+		}
+		if pattern, ok := config[a.regexKey]; ok {
+			re, err := regexp.Compile(pattern)
+			if err != nil {
+				return nil, fmt.Errorf("%s: %s: %v", driverName, a.regexKey, err)
+			}
+			f.regexps = append(f.regexps, len(f.rules))
+			f.rules = append(f.rules, &filterRule{action: a.action, pattern: pattern, rank: rank, regexp: re})
+		}
+	}
+
+	if rateStr, ok := config[splunkFilterSampleRateKey]; ok {
+		rate, err := strconv.ParseInt(rateStr, 10, 32)
+		if err != nil {
+			return nil, err
+		}
+		if rate < 1 {
+			return nil, fmt.Errorf("%s: %s should be at least 1", driverName, splunkFilterSampleRateKey)
+		}
+		f.sampleRate = uint64(rate)
+	}
+	if len(f.rules) == 0 {
+		if _, ok := config[splunkFilterSampleRateKey]; ok {
+			return nil, fmt.Errorf("%s: %s requires %s or %s", driverName, splunkFilterSampleRateKey, splunkFilterSampleKey, splunkFilterSampleRegexKey)
+		}
+		return nil, nil
+	}
+	if len(literals) > 0 {
+		f.literals = newLiteralMatcher(literals, literalRules)
+		// a keep rule decides the message, the rest of it does not need to be scanned
+		for i, rule := range f.rules {
+			if rule.action != filterKeep {
+				break
+			}
+			f.literals.stop = int32(i + 1)
+		}
+	}
+	return f, nil
+}
+
+// match returns the rule which decides the message, nil when no rule matches
+func (f *lineFilter) match(line []byte) *filterRule {
+	best := -1
+	if f.literals != nil {
+		best = f.literals.match(line)
+	}
+	for _, i := range f.regexps {
+		if best >= 0 && f.rules[i].rank >= f.rules[best].rank {
+			break
+		}
+		if f.rules[i].regexp.Match(line) {
+			best = i
+			break
+		}
+	}
+	if best < 0 {
+		return nil
+	}
+	return f.rules[best]
+}
+
+// send tells if the message goes to Splunk and counts it on the rule which decided
+func (f *lineFilter) send(line []byte) bool {
+	rule := f.match(line)
+	if rule == nil {
+		return true
+	}
+	matched := atomic.AddInt64(&rule.matched, 1)
+	switch rule.action {
+	case filterKeep:
+		return true
+	case filterSample:
+		if uint64(matched)%f.sampleRate == 0 {
+			return true
+		}
+	}
+	atomic.AddInt64(&rule.dropped, 1)
+	atomic.AddInt64(&rule.droppedBytes, int64(len(line)))
+	return false
+}
+
+/*
+literalMatcher finds the patterns in a message in one pass, with the Aho-Corasick
+automaton of the patterns. The automaton is a table with the next state for every
+byte, so matching costs one lookup per byte whatever the number of patterns.
+*/
+type literalMatcher struct {
+	// next[state<<8|b] is the state after byte b
+	next []int32
+	// best[state] is the smallest rule of the patterns ending at state, -1 for none
+	best []int32
+	// the match stops at the first rule below stop
+	stop int32
+}
+
+// newLiteralMatcher builds the automaton of the patterns, rules[i] is the rule of patterns[i]
+func newLiteralMatcher(patterns []string, rules []int) *literalMatcher {
+	m := &literalMatcher{}
+	m.addState()
+	for i, pattern := range patterns {
+		state := int32(0)
+		for j := 0; j < len(pattern); j++ {
+			i := int(state)<<8 | int(pattern[j])
+			if m.next[i] < 0 {
+				next := m.addState()
+				m.next[i] = next
+			}
+			state = m.next[i]
+		}
+		m.best[state] = betterRule(m.best[state], int32(rules[i]))
+	}
+
+	// breadth first, a state inherits the patterns of its longest proper suffix
+	// and the missing transitions of the suffix
+	fail := make([]int32, len(m.best))
+	var queue []int32
+	for b := 0; b < 256; b++ {
+		if next := m.next[b]; next < 0 {
+			m.next[b] = 0
+		} else {
+			queue = append(queue, next)
+		}
+	}
+	for len(queue) > 0 {
+		state := queue[0]
+		queue = queue[1:]
+		m.best[state] = betterRule(m.best[state], m.best[fail[state]])
+		for b := 0; b < 256; b++ {
+			suffixNext := m.next[int(fail[state])<<8|b]
+			if next := m.next[int(state)<<8|b]; next < 0 {
+				m.next[int(state)<<8|b] = suffixNext
+			} else {
+				fail[next] = suffixNext
+				queue = append(queue, next)
+			}
+		}
+	}
+	return m
+}
+
+func (m *literalMatcher) addState() int32 {
+	for b := 0; b < 256; b++ {
+		m.next = append(m.next, -1)
+	}
+	m.best = append(m.best, -1)
+	return int32(len(m.best) - 1)
+}
+
+func betterRule(a int32, b int32) int32 {
+	if a < 0 || (b >= 0 && b < a) {
+		return b
+	}
+	return a
+}
+
+// match returns the smallest rule of the patterns found in the line, -1 for none
+func (m *literalMatcher) match(line []byte) int {
+	best := int32(-1)
+	state := int32(0)
+	for _, c := range line {
+		state = m.next[int(state)<<8|int(c)]
+		if rule := m.best[state]; rule >= 0 && (best < 0 || rule < best) {
+			best = rule
+			if best < m.stop {
+				break
+			}
+		}
+	}
+	return int(best)
+}
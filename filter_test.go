@@ -0,0 +1,149 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"math/rand"
+	"strings"
+	"testing"
+)
+
+// Verify that the automaton finds overlapping patterns and patterns inside other
+// patterns, like strings.Contains on every pattern
+func TestLiteralMatcher(t *testing.T) {
+	patterns := []string{"he", "she", "his", "hers", "a", "aab", "abab", "b"}
+	rules := []int{3, 2, 5, 1, 7, 0, 4, 6}
+	m := newLiteralMatcher(patterns, rules)
+
+	naive := func(line string) int {
+		best := -1
+		for i, pattern := range patterns {
+			if strings.Contains(line, pattern) && (best < 0 || rules[i] < best) {
+				best = rules[i]
+			}
+		}
+		return best
+	}
+	for _, line := range []string{"", "ushers", "this", "xyz", "aaab", "ababa", "bbb", "sheh"} {
+		if got, expected := m.match([]byte(line)), naive(line); got != expected {
+			t.Fatalf("%q: expected rule %d, got %d", line, expected, got)
+		}
+	}
+
+	random := rand.New(rand.NewSource(1))
+	for i := 0; i < 10000; i++ {
+		line := make([]byte, random.Intn(12))
+		for j := range line {
+			line[j] = "abehirsu"[random.Intn(8)]
+		}
+		if got, expected := m.match(line), naive(string(line)); got != expected {
+			t.Fatalf("%q: expected rule %d, got %d", line, expected, got)
+		}
+	}
+}
+
+// Verify that keep rules win over drop rules, which win over sample rules,
+// whether the patterns are literals or regular expressions
+func TestLineFilter(t *testing.T) {
+	f, err := newLineFilter(map[string]string{
+		splunkFilterKeepKey:        "ERROR",
+		splunkFilterDropKey:        "GET /health,DEBUG",
+		splunkFilterDropRegexKey:   `^\s*$|^TRACE`,
+		splunkFilterSampleRegexKey: `status=2\d\d`,
+		splunkFilterSampleRateKey:  "1000000",
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, test := range []struct {
+		line string
+		sent bool
+	}{
+		{"GET /health 200", false},
+		{"DEBUG ERROR in GET /health", true},
+		{"DEBUG cache miss", false},
+		{"TRACE enter", false},
+		{"   ", false},
+		{"GET /items status=200", false},
+		{"GET /items status=500", true},
+		{"INFO started", true},
+	} {
+		if sent := f.send([]byte(test.line)); sent != test.sent {
+			t.Fatalf("%q: expected sent %v", test.line, test.sent)
+		}
+	}
+
+	for i, expected := range []struct {
+		matched int64
+		dropped int64
+		bytes   int64
+	}{
+		{1, 0, 0},  // ERROR
+		{1, 1, 15}, // GET /health
+		{1, 1, 16}, // DEBUG
+		{2, 2, 14}, // ^\s*$|^TRACE
+		{1, 1, 21}, // status=2\d\d
+	} {
+		rule := f.rules[i]
+		if rule.matched != expected.matched || rule.dropped != expected.dropped || rule.droppedBytes != expected.bytes {
+			t.Fatalf("%s %q: unexpected counters, matched %d, dropped %d, %d bytes", rule.action, rule.pattern, rule.matched, rule.dropped, rule.droppedBytes)
+		}
+	}
+}
+
+// Verify that sampling keeps one line in the rate, for different and for identical lines
+func TestLineFilterSample(t *testing.T) {
+	for _, identical := range []bool{false, true} {
+		f, err := newLineFilter(map[string]string{
+			splunkFilterSampleKey:     "health",
+			splunkFilterSampleRateKey: "10",
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+		sent := 0
+		for i := 0; i < 10000; i++ {
+			line := []byte(fmt.Sprintf("2018-03-01T10:00:%05d health ok", i))
+			if identical {
+				line = []byte("health ok")
+			}
+			if f.send(line) {
+				sent++
+			}
+		}
+		if sent != 1000 {
+			t.Fatalf("identical %v: expected 1000 lines in 10000, got %d", identical, sent)
+		}
+	}
+}
+
+func TestLineFilterOptions(t *testing.T) {
+	if f, err := newLineFilter(map[string]string{splunkFilterDropKey: ""}); err != nil || f != nil {
+		t.Fatal("Expected no filter without rules")
+	}
+	for _, config := range []map[string]string{
+		{splunkFilterDropRegexKey: "("},
+		{splunkFilterSampleRateKey: "10"},
+		{splunkFilterSampleKey: "a", splunkFilterSampleRateKey: "0"},
+		{splunkFilterSampleKey: "a", splunkFilterSampleRateKey: "often"},
+	} {
+		if _, err := newLineFilter(config); err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+	}
+}
@@ -0,0 +1,162 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"errors"
+	"fmt"
+	"strings"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// How long a flush waits for HEC to accept the data
+	defaultFlushTimeout = 30 * time.Second
+)
+
+const (
+	envVarFlushTimeout = "SPLUNK_LOGGING_DRIVER_FLUSH_TIMEOUT"
+)
+
+var flushTimeout = getAdvancedOptionDuration(envVarFlushTimeout, defaultFlushTimeout)
+
+/*
+flushRequest is queued in the stream channel of a logger like a message, so the
+worker gets it after all the messages which were queued before. The worker answers
+once these messages are accepted by HEC or could not be sent.
+*/
+type flushRequest struct {
+	done chan error
+}
+
+func newFlushRequest() *flushRequest {
+	return &flushRequest{done: make(chan error, 1)}
+}
+
+// reply is called once per request, it never blocks
+func (f *flushRequest) reply(err error) {
+	f.done <- err
+}
+
+// flushWaiter is a flush request the pipelined worker is working on
+type flushWaiter struct {
+	request *flushRequest
+	// the messages queued before the request are in the batches with a lower seq
+	seq uint64
+}
+
+type flusher interface {
+	flush(deadline time.Time) error
+}
+
+/*
+Flush sends what the loggers of a container hold to HEC right away: the partial
+messages, the messages in the stream channel and the messages waiting for the next
+batch. It returns once HEC has accepted them, with splunk-indexer-ack once the
+indexers have acknowledged them, or when the timeout expires. An empty containerID
+flushes all the containers.
+*/
+func (d *driver) Flush(containerID string, timeout time.Duration) error {
+	d.mu.Lock()
+	var pairs []*logPair
+	if containerID == "" {
+		for _, lf := range d.logs {
+			pairs = append(pairs, lf)
+		}
+	} else if lf, ok := d.idx[containerID]; ok {
+		pairs = append(pairs, lf)
+	}
+	d.mu.Unlock()
+	if containerID != "" && len(pairs) == 0 {
+		return fmt.Errorf("logger does not exist for %s", containerID)
+	}
+
+	logrus.WithField("id", containerID).WithField("containers", len(pairs)).WithField("timeout", timeout).Debug("Flush")
+	deadline := time.Now().Add(timeout)
+	results := make(chan error, len(pairs))
+	for _, lf := range pairs {
+		go func(lf *logPair) {
+			results <- lf.flush(deadline)
+		}(lf)
+	}
+	var failed []string
+	for range pairs {
+		if err := <-results; err != nil {
+			failed = append(failed, err.Error())
+		}
+	}
+	if len(failed) > 0 {
+		return errors.New(strings.Join(failed, "; "))
+	}
+	return nil
+}
+
+// flush sends the partial messages and multiline events to the loggers, then waits for the splunk logger
+func (lf *logPair) flush(deadline time.Time) error {
+	lf.partials.flushAll()
+	lf.multiline.flushAll()
+	f, ok := lf.splunkl.(flusher)
+	if !ok {
+		return nil
+	}
+	if err := f.flush(deadline); err != nil {
+		return fmt.Errorf("%s: %v", lf.info.ContainerID, err)
+	}
+	return nil
+}
+
+func (l *splunkLogger) flush(deadline time.Time) error {
+	request := newFlushRequest()
+	timer := time.NewTimer(time.Until(deadline))
+	defer timer.Stop()
+
+	l.lock.RLock()
+	if l.closedCond != nil {
+		l.lock.RUnlock()
+		// Close sends everything
+		return nil
+	}
+	// the request is never dropped by the backpressure policy
+	select {
+	case l.stream <- &splunkMessage{flush: request}:
+		l.lock.RUnlock()
+	case <-timer.C:
+		l.lock.RUnlock()
+		return fmt.Errorf("%s: flush timed out, the stream channel is full", driverName)
+	}
+
+	select {
+	case err := <-request.done:
+		if err != nil || l.hec.acks == nil {
+			return err
+		}
+		// HEC has accepted the batches, wait for the indexers
+		return l.hec.acks.wait(deadline)
+	case <-timer.C:
+		return fmt.Errorf("%s: flush timed out waiting for HEC", driverName)
+	}
+}
+
+// flushResult is the answer to a flush request once the worker has tried to post everything
+func flushResult(remaining []*splunkMessage) error {
+	if len(remaining) > 0 {
+		return fmt.Errorf("%s: %d messages could not be sent, they are kept for the next try", driverName, len(remaining))
+	}
+	return nil
+}
@@ -0,0 +1,216 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"os"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/api/types/plugins/logdriver"
+	"github.com/docker/docker/daemon/logger"
+)
+
+func newFlushTestLogger(t *testing.T, hec *HTTPEventCollectorMock) logger.Logger {
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:   hec.URL(),
+			splunkTokenKey: hec.token,
+		},
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return loggerDriver
+}
+
+func receivedMessages(hec *HTTPEventCollectorMock) int {
+	hec.lock.Lock()
+	defer hec.lock.Unlock()
+	return len(hec.messages)
+}
+
+// Verify that a flush sends the queued messages without waiting for the batch timer
+func TestFlush(t *testing.T) {
+	if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+		t.Fatal(err)
+	}
+
+	for _, concurrentPosts := range []string{"1", "4"} {
+		if err := os.Setenv(envVarConcurrentPosts, concurrentPosts); err != nil {
+			t.Fatal(err)
+		}
+		if err := os.Setenv(envVarPostMessagesBatchSize, "3"); err != nil {
+			t.Fatal(err)
+		}
+
+		hec := NewHTTPEventCollectorMock(t)
+		go hec.Serve()
+		loggerDriver := newFlushTestLogger(t, hec)
+
+		for i := 0; i < 10; i++ {
+			if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+				t.Fatal(err)
+			}
+		}
+
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+			t.Fatal(err)
+		}
+		if received := receivedMessages(hec); received != 10 {
+			t.Fatalf("%s concurrent posts: expected 10 messages after the flush, got %d", concurrentPosts, received)
+		}
+
+		// nothing to send
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+			t.Fatal(err)
+		}
+
+		if err := loggerDriver.Close(); err != nil {
+			t.Fatal(err)
+		}
+		if received := receivedMessages(hec); received != 10 {
+			t.Fatalf("%s concurrent posts: expected 10 messages after close, got %d", concurrentPosts, received)
+		}
+		// a closed logger has nothing left to flush
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+			t.Fatal(err)
+		}
+
+		if err := hec.Close(); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	if err := os.Setenv(envVarPostMessagesFrequency, ""); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.Setenv(envVarConcurrentPosts, ""); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.Setenv(envVarPostMessagesBatchSize, ""); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that a flush reports the messages HEC did not accept
+func TestFlushServerDown(t *testing.T) {
+	if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+		t.Fatal(err)
+	}
+
+	for _, concurrentPosts := range []string{"1", "4"} {
+		if err := os.Setenv(envVarConcurrentPosts, concurrentPosts); err != nil {
+			t.Fatal(err)
+		}
+
+		hec := NewHTTPEventCollectorMock(t)
+		hec.simulateServerError = true
+		go hec.Serve()
+		loggerDriver := newFlushTestLogger(t, hec)
+
+		if err := loggerDriver.Log(&logger.Message{Line: []byte("message"), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err == nil {
+			t.Fatalf("%s concurrent posts: expected the flush to fail", concurrentPosts)
+		}
+
+		hec.lock.Lock()
+		hec.simulateServerError = false
+		hec.lock.Unlock()
+		if err := loggerDriver.(flusher).flush(time.Now().Add(10 * time.Second)); err != nil {
+			t.Fatal(err)
+		}
+		if received := receivedMessages(hec); received != 1 {
+			t.Fatalf("%s concurrent posts: expected 1 message after the retry, got %d", concurrentPosts, received)
+		}
+
+		if err := loggerDriver.Close(); err != nil {
+			t.Fatal(err)
+		}
+		if err := hec.Close(); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	if err := os.Setenv(envVarPostMessagesFrequency, ""); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.Setenv(envVarConcurrentPosts, ""); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that the driver flushes the partial messages of a container too
+func TestDriverFlush(t *testing.T) {
+	if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+		t.Fatal(err)
+	}
+
+	hec := NewHTTPEventCollectorMock(t)
+	go hec.Serve()
+	loggerDriver := newFlushTestLogger(t, hec)
+
+	d := newDriver()
+	lf := &logPair{
+		jsonl:   discardLogger{},
+		splunkl: loggerDriver,
+		info:    logger.Info{ContainerID: "containeriid"},
+		read:    &fifoCounters{},
+	}
+	lf.partials = newPartialReassembler(lf.log)
+	d.logs["/run/docker/logging/containeriid"] = lf
+	d.idx["containeriid"] = lf
+
+	lf.partials.add(&logdriver.LogEntry{Source: "stdout", TimeNano: time.Now().UnixNano(), Line: []byte("partial"), Partial: true})
+
+	if err := d.Flush("unknown", time.Second); err == nil {
+		t.Fatal("Expected error for unknown container")
+	}
+	if err := d.Flush("containeriid", 10*time.Second); err != nil {
+		t.Fatal(err)
+	}
+	if received := receivedMessages(hec); received != 1 {
+		t.Fatalf("Expected the partial message after the flush, got %d messages", received)
+	}
+
+	lf.partials.add(&logdriver.LogEntry{Source: "stderr", TimeNano: time.Now().UnixNano(), Line: []byte("partial"), Partial: true})
+	if err := d.Flush("", 10*time.Second); err != nil {
+		t.Fatal(err)
+	}
+	if received := receivedMessages(hec); received != 2 {
+		t.Fatalf("Expected 2 messages after flushing all the containers, got %d", received)
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if err := hec.Close(); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarPostMessagesFrequency, ""); err != nil {
+		t.Fatal(err)
+	}
+}
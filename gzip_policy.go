@@ -0,0 +1,276 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"compress/gzip"
+	"fmt"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// splunk-gzip-level value which lets the logger pick the level
+	gzipLevelAuto = "auto"
+	// Level the adaptive policy starts with, within the bounds
+	defaultGzipAutoLevel = 6
+	// With splunk-gzip-level=auto batches are sent uncompressed below this ratio
+	defaultGzipMinRatio = 1.5
+	// Uncompressed batches between two compressed ones, once the ratio is poor
+	gzipProbeBatches = 16
+	// Batches observed at a level before the level is changed again
+	gzipAdjustBatches = 4
+	// Weight of the last batch in the moving averages
+	gzipSmoothing = 0.25
+	// Part of the time of a batch spent compressing above which the level goes down,
+	// and below which it goes up
+	gzipCPUBoundShare     = 0.5
+	gzipNetworkBoundShare = 0.1
+	// A level has to compress this much better than the level below to be kept
+	gzipMinLevelGain = 1.02
+)
+
+// number of levels from DefaultCompression to BestCompression, like gzipWriterPools
+const gzipLevels = gzip.BestCompression - gzip.DefaultCompression + 1
+
+/*
+gzipPolicy decides how each batch of a logger is compressed. Batches smaller than
+splunk-gzip-min-bytes are always sent uncompressed. With splunk-gzip-level=auto the
+level moves between splunk-gzip-min-level and splunk-gzip-max-level: it goes down
+while compressing takes longer than posting the batch, the logger is bound by CPU,
+and goes up while posting takes most of the time, the logger is bound by the
+network. When the ratio falls below splunk-gzip-min-ratio the batches are sent
+uncompressed, only one in gzipProbeBatches is compressed to follow the ratio.
+*/
+type gzipPolicy struct {
+	adaptive bool
+	minLevel int
+	maxLevel int
+	minBytes int
+	minRatio float64
+
+	mu sync.Mutex
+	// current level, the configured one without adaptive
+	level int
+	// average ratio of the batches compressed at each level, 0 when never used
+	ratios [gzipLevels]float64
+	// average part of the time of a batch spent compressing, at the current level
+	cpuShare float64
+	samples  int
+	// set while the ratio is below minRatio
+	poorRatio bool
+	skipped   int
+
+	// reported, updated atomically
+	currentLevel int64
+	batches      [gzipLevels]int64
+	skippedSmall int64
+	skippedRatio int64
+	levelChanges int64
+}
+
+// newGzipPolicy reads the gzip log-opts, it returns nil when compression is disabled
+func newGzipPolicy(config map[string]string) (*gzipPolicy, error) {
+	compression := false
+	if compressionStr, ok := config[splunkGzipCompressionKey]; ok {
+		var err error
+		if compression, err = strconv.ParseBool(compressionStr); err != nil {
+			return nil, err
+		}
+	}
+
+	p := &gzipPolicy{
+		level:    gzip.DefaultCompression,
+		minLevel: gzip.BestSpeed,
+		maxLevel: gzip.BestCompression,
+		minRatio: defaultGzipMinRatio,
+	}
+	if levelStr, ok := config[splunkGzipCompressionLevelKey]; ok {
+		if levelStr == gzipLevelAuto {
+			p.adaptive = true
+		} else {
+			level, err := parseGzipLevel(levelStr, splunkGzipCompressionLevelKey, gzip.DefaultCompression)
+			if err != nil {
+				return nil, err
+			}
+			p.level = level
+		}
+	}
+
+	var err error
+	for _, key := range []string{splunkGzipMinLevelKey, splunkGzipMaxLevelKey, splunkGzipMinRatioKey} {
+		if _, ok := config[key]; ok && !p.adaptive {
+			return nil, fmt.Errorf("%s: %s requires %s=%s", driverName, key, splunkGzipCompressionLevelKey, gzipLevelAuto)
+		}
+	}
+	if levelStr, ok := config[splunkGzipMinLevelKey]; ok {
+		if p.minLevel, err = parseGzipLevel(levelStr, splunkGzipMinLevelKey, gzip.BestSpeed); err != nil {
+			return nil, err
+		}
+	}
+	if levelStr, ok := config[splunkGzipMaxLevelKey]; ok {
+		if p.maxLevel, err = parseGzipLevel(levelStr, splunkGzipMaxLevelKey, gzip.BestSpeed); err != nil {
+			return nil, err
+		}
+	}
+	if p.minLevel > p.maxLevel {
+		return nil, fmt.Errorf("%s: %s should not be greater than %s", driverName, splunkGzipMinLevelKey, splunkGzipMaxLevelKey)
+	}
+	if ratioStr, ok := config[splunkGzipMinRatioKey]; ok {
+		if p.minRatio, err = strconv.ParseFloat(ratioStr, 64); err != nil {
+			return nil, err
+		}
+	}
+	if bytesStr, ok := config[splunkGzipMinBytesKey]; ok {
+		minBytes, err := strconv.ParseInt(bytesStr, 10, 32)
+		if err != nil {
+			return nil, err
+		}
+		if minBytes < 0 {
+			return nil, fmt.Errorf("%s: %s should not be negative", driverName, splunkGzipMinBytesKey)
+		}
+		p.minBytes = int(minBytes)
+	}
+
+	if !compression {
+		return nil, nil
+	}
+	if p.adaptive {
+		p.level = defaultGzipAutoLevel
+		if p.level < p.minLevel {
+			p.level = p.minLevel
+		}
+		if p.level > p.maxLevel {
+			p.level = p.maxLevel
+		}
+	}
+	p.currentLevel = int64(p.level)
+	return p, nil
+}
+
+func parseGzipLevel(levelStr string, key string, lowest int) (int, error) {
+	level, err := strconv.ParseInt(levelStr, 10, 32)
+	if err != nil {
+		return 0, err
+	}
+	if int(level) < lowest || level > gzip.BestCompression {
+		return 0, fmt.Errorf("not supported level '%s' for %s (supported values between %d and %d)",
+			levelStr, key, lowest, gzip.BestCompression)
+	}
+	return int(level), nil
+}
+
+// choose tells if a batch of rawBytes is compressed and at which level
+func (p *gzipPolicy) choose(rawBytes int) (bool, int) {
+	if rawBytes < p.minBytes {
+		atomic.AddInt64(&p.skippedSmall, 1)
+		return false, 0
+	}
+	var level int
+	if !p.adaptive {
+		level = p.level
+	} else {
+		p.mu.Lock()
+		if p.poorRatio {
+			p.skipped++
+			if p.skipped%gzipProbeBatches != 0 {
+				p.mu.Unlock()
+				atomic.AddInt64(&p.skippedRatio, 1)
+				return false, 0
+			}
+		}
+		level = p.level
+		p.mu.Unlock()
+	}
+	atomic.AddInt64(&p.batches[level-gzip.DefaultCompression], 1)
+	return true, level
+}
+
+/*
+observe records a compressed batch which HEC accepted. encode is the time spent
+encoding and compressing the batch and post the time HEC took to take it.
+*/
+func (p *gzipPolicy) observe(level int, rawBytes int, bodyBytes int, encode time.Duration, post time.Duration) {
+	if bodyBytes <= 0 {
+		return
+	}
+	p.mu.Lock()
+	defer p.mu.Unlock()
+	i := level - gzip.DefaultCompression
+	p.ratios[i] = movingAverage(p.ratios[i], float64(rawBytes)/float64(bodyBytes))
+	if !p.adaptive || level != p.level {
+		// with adaptive, the batch was encoded before the last change
+		return
+	}
+	if poorRatio := p.ratios[i] < p.minRatio; poorRatio != p.poorRatio {
+		p.poorRatio = poorRatio
+		p.skipped = 0
+		logrus.WithField("ratio", p.ratios[i]).
+			WithField("compress", !poorRatio).
+			Debug("Compression ratio crossed splunk-gzip-min-ratio")
+	}
+	if p.poorRatio || encode+post <= 0 {
+		return
+	}
+
+	p.cpuShare = movingAverage(p.cpuShare, float64(encode)/float64(encode+post))
+	p.samples++
+	if p.samples < gzipAdjustBatches {
+		return
+	}
+	switch {
+	case p.cpuShare > gzipCPUBoundShare && p.level > p.minLevel:
+		p.setLevel(p.level - 1)
+	case p.cpuShare < gzipNetworkBoundShare:
+		// a level which does not compress better than the one below is not worth its CPU
+		if p.level > p.minLevel && p.ratios[i-1] > 0 && p.ratios[i] < p.ratios[i-1]*gzipMinLevelGain {
+			p.setLevel(p.level - 1)
+		} else if p.level < p.maxLevel && (p.ratios[i+1] == 0 || p.ratios[i+1] >= p.ratios[i]*gzipMinLevelGain) {
+			p.setLevel(p.level + 1)
+		}
+	}
+}
+
+func (p *gzipPolicy) setLevel(level int) {
+	logrus.WithField("from", p.level).
+		WithField("to", level).
+		WithField("cpuShare", p.cpuShare).
+		Debug("Changing gzip compression level")
+	p.level = level
+	p.cpuShare = 0
+	p.samples = 0
+	atomic.StoreInt64(&p.currentLevel, int64(level))
+	atomic.AddInt64(&p.levelChanges, 1)
+}
+
+// levelRatio returns the average ratio of the batches compressed at level, 0 when unknown
+func (p *gzipPolicy) levelRatio(level int) float64 {
+	p.mu.Lock()
+	defer p.mu.Unlock()
+	return p.ratios[level-gzip.DefaultCompression]
+}
+
+func movingAverage(average float64, value float64) float64 {
+	if average == 0 {
+		return value
+	}
+	return average + gzipSmoothing*(value-average)
+}
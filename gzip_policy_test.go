@@ -0,0 +1,174 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"compress/gzip"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"strings"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+func TestGzipPolicyOptions(t *testing.T) {
+	if p, err := newGzipPolicy(map[string]string{splunkGzipCompressionLevelKey: gzipLevelAuto}); err != nil || p != nil {
+		t.Fatal("Expected no policy without splunk-gzip")
+	}
+
+	p, err := newGzipPolicy(map[string]string{splunkGzipCompressionKey: "true", splunkGzipCompressionLevelKey: "9"})
+	if err != nil || p.adaptive || p.level != gzip.BestCompression {
+		t.Fatalf("Unexpected fixed policy %v %v", p, err)
+	}
+
+	p, err = newGzipPolicy(map[string]string{
+		splunkGzipCompressionKey:      "true",
+		splunkGzipCompressionLevelKey: gzipLevelAuto,
+		splunkGzipMaxLevelKey:         "4",
+	})
+	if err != nil || !p.adaptive || p.level != 4 || p.minLevel != gzip.BestSpeed {
+		t.Fatalf("Unexpected adaptive policy %v %v", p, err)
+	}
+
+	for _, config := range []map[string]string{
+		{splunkGzipCompressionLevelKey: "10"},
+		{splunkGzipCompressionLevelKey: "fast"},
+		{splunkGzipMinLevelKey: "2"},
+		{splunkGzipCompressionLevelKey: gzipLevelAuto, splunkGzipMinLevelKey: "0"},
+		{splunkGzipCompressionLevelKey: gzipLevelAuto, splunkGzipMinLevelKey: "5", splunkGzipMaxLevelKey: "3"},
+		{splunkGzipCompressionLevelKey: gzipLevelAuto, splunkGzipMinRatioKey: "high"},
+		{splunkGzipMinBytesKey: "-1"},
+	} {
+		config[splunkGzipCompressionKey] = "true"
+		if _, err := newGzipPolicy(config); err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+	}
+}
+
+func newAdaptiveTestPolicy(t *testing.T) *gzipPolicy {
+	p, err := newGzipPolicy(map[string]string{
+		splunkGzipCompressionKey:      "true",
+		splunkGzipCompressionLevelKey: gzipLevelAuto,
+		splunkGzipMinLevelKey:         "2",
+		splunkGzipMaxLevelKey:         "9",
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	return p
+}
+
+// Verify that the level follows where the time of the batches goes, within the bounds
+func TestGzipPolicyAdapt(t *testing.T) {
+	p := newAdaptiveTestPolicy(t)
+	for i := 0; i < 100; i++ {
+		_, level := p.choose(1000)
+		// compressing takes longer than posting
+		p.observe(level, 1000, 100, 10*time.Millisecond, time.Millisecond)
+	}
+	if _, level := p.choose(1000); level != 2 {
+		t.Fatalf("Expected the lowest level when bound by CPU, got %d", level)
+	}
+
+	for i := 0; i < 100; i++ {
+		_, level := p.choose(1000)
+		// posting takes longer than compressing, and higher levels compress better
+		p.observe(level, 1000, 200-10*level, time.Millisecond, 100*time.Millisecond)
+	}
+	if _, level := p.choose(1000); level != gzip.BestCompression {
+		t.Fatalf("Expected the highest level when bound by the network, got %d", level)
+	}
+
+	p = newAdaptiveTestPolicy(t)
+	for i := 0; i < 100; i++ {
+		_, level := p.choose(1000)
+		// higher levels do not compress better
+		p.observe(level, 1000, 100, time.Millisecond, 100*time.Millisecond)
+	}
+	if _, level := p.choose(1000); level != defaultGzipAutoLevel {
+		t.Fatalf("Expected the level to stop once it does not compress better, got %d", level)
+	}
+}
+
+// Verify that batches which do not compress are sent uncompressed, with a probe from time to time
+func TestGzipPolicySkip(t *testing.T) {
+	p := newAdaptiveTestPolicy(t)
+	_, level := p.choose(1000)
+	p.observe(level, 1000, 990, time.Millisecond, time.Millisecond)
+
+	compressed := 0
+	for i := 0; i < 10*gzipProbeBatches; i++ {
+		if compress, level := p.choose(1000); compress {
+			compressed++
+			p.observe(level, 1000, 990, time.Millisecond, time.Millisecond)
+		}
+	}
+	if compressed != 10 || p.skippedRatio != int64(10*gzipProbeBatches-10) {
+		t.Fatalf("Expected one batch in %d to be compressed, got %d", gzipProbeBatches, compressed)
+	}
+
+	// the data compresses again
+	for i := 0; i < gzipProbeBatches; i++ {
+		if compress, level := p.choose(1000); compress {
+			p.observe(level, 1000, 100, time.Millisecond, time.Millisecond)
+		}
+	}
+	if compress, _ := p.choose(1000); !compress {
+		t.Fatal("Expected the batches to be compressed again")
+	}
+}
+
+// Verify that batches under splunk-gzip-min-bytes are posted uncompressed
+func TestGzipMinBytes(t *testing.T) {
+	var lock sync.Mutex
+	var encodings []string
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		lock.Lock()
+		encodings = append(encodings, r.Header.Get("Content-Encoding"))
+		lock.Unlock()
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	if err := os.Setenv(envVarPostMessagesBatchSize, "1"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarPostMessagesBatchSize, "")
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:             hec.URL,
+		splunkGzipCompressionKey: "true",
+		splunkGzipMinBytesKey:    "1000",
+	})
+	for _, line := range []string{"short", strings.Repeat("long ", 1000)} {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(line), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+
+	if len(encodings) != 2 || encodings[0] != "" || encodings[1] != "gzip" {
+		t.Fatalf("Unexpected encodings %q", encodings)
+	}
+}
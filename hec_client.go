@@ -18,153 +18,367 @@ package main
 
 import (
 	"bytes"
-	"compress/gzip"
 	"encoding/json"
 	"fmt"
 	"io"
 	"io/ioutil"
 	"net/http"
+	"sync/atomic"
 	"time"
 
 	"github.com/Sirupsen/logrus"
 )
 
 type hecClient struct {
-	client    *http.Client
-	transport *http.Transport
+	// the endpoints of splunk-url, batches are spread over them
+	endpoints   []*hecEndpoint
+	loadBalance string
+	// turn of the next endpoint, updated atomically
+	nextEndpoint uint32
 
-	url            string
-	healthCheckURL string
-	auth           string
+	auth string
+	// channel of the requests, set with indexer acknowledgement and the raw endpoint
+	channel string
+	// the batches are lines for the raw endpoint instead of JSON events
+	rawEndpoint bool
 
 	// http compression
 	gzipCompression      bool
 	gzipCompressionLevel int
+	// decides the compression of every batch, nil for the fixed level above
+	gzip *gzipPolicy
+	// share of the endpoints when they are busy, see fairQueue
+	weight float64
+	// budget the buffered messages are reserved from, nil when they are not accounted
+	memory *memoryBudget
 
 	// Advanced options
-	postMessagesFrequency time.Duration
-	postMessagesBatchSize int
-	bufferMaximum         int
+	postMessagesFrequency  time.Duration
+	postMessagesBatchSize  int
+	postMessagesBatchBytes int
+	bufferMaximum          int
+	bufferBytesMaximum     int
+	concurrentPosts        int
+	orderedRetries         bool
+
+	// batches we could not send are kept here, nil when spooling is disabled
+	spool *spool
+	// batches waiting for their acknowledgement, nil when acknowledgement is disabled
+	acks *ackTracker
+
+	// size of the requests we have sent, updated atomically
+	requestsSent        int64
+	requestBytesSent    int64
+	requestRawBytesSent int64
+	lastRequestBytes    int64
+	largestBatchBytes   int64
+
+	// metrics, updated atomically
+	postLatency      latencyHistogram
+	postStatusCodes  [600]int64
+	postErrors       int64
+	postFailures     int64
+	droppedMessages  int64
+	bufferedMessages int64
+}
+
+// messagesSize returns the number of encoded bytes of the messages
+func messagesSize(messages []*splunkMessage) int {
+	size := 0
+	for _, message := range messages {
+		size += len(message.payload)
+	}
+	return size
+}
+
+// nextBatch returns the upper bound of the batch starting at i. The batch is cut on
+// whichever limit is reached first, message count or bytes, but always has at least
+// one message.
+func (hec *hecClient) nextBatch(messages []*splunkMessage, i int) int {
+	upperBound := i + hec.postMessagesBatchSize
+	if upperBound > len(messages) {
+		upperBound = len(messages)
+	}
+	if hec.postMessagesBatchBytes <= 0 {
+		return upperBound
+	}
+	size := 0
+	for j := i; j < upperBound; j++ {
+		size += len(messages[j].payload)
+		if size > hec.postMessagesBatchBytes && j > i {
+			return j
+		}
+	}
+	return upperBound
+}
+
+// isBufferFull returns true when the messages waiting to be sent reached
+// the maximum number of messages or the maximum of bytes
+func (hec *hecClient) isBufferFull(messages []*splunkMessage) bool {
+	if len(messages) >= hec.bufferMaximum {
+		return true
+	}
+	return hec.bufferBytesMaximum > 0 && messagesSize(messages) >= hec.bufferBytesMaximum
 }
 
 func (hec *hecClient) postMessages(messages []*splunkMessage, lastChance bool) []*splunkMessage {
 	logrus.Debugf("Received %d messages.", len(messages))
 	messagesLen := len(messages)
-	for i := 0; i < messagesLen; i += hec.postMessagesBatchSize {
-		upperBound := i + hec.postMessagesBatchSize
-		if upperBound > messagesLen {
-			upperBound = messagesLen
-		}
+	for i := 0; i < messagesLen; {
+		upperBound := hec.nextBatch(messages, i)
 		if err := hec.tryPostMessages(messages[i:upperBound]); err != nil {
 			logrus.Error(err)
-			if messagesLen-i >= hec.bufferMaximum || lastChance {
-				// If this is last chance - print them all to the daemon log
+			if hec.isBufferFull(messages[i:]) || lastChance {
+				// If this is last chance - spool or print them all to the daemon log
 				if lastChance {
-					upperBound = messagesLen
-				}
-				// Not all sent, but buffer has got to its maximum, let's log all messages
-				// we could not send and return buffer minus one batch size
-				for j := i; j < upperBound; j++ {
-					if jsonEvent, err := json.Marshal(messages[j]); err != nil {
-						logrus.Error(err)
-					} else {
-						logrus.Error(fmt.Errorf("Failed to send a message '%s'", string(jsonEvent)))
+					for ; i < messagesLen; i = upperBound {
+						upperBound = hec.nextBatch(messages, i)
+						hec.dropMessages(messages[i:upperBound])
 					}
+					return messages[messagesLen:]
 				}
+				// Not all sent, but buffer has got to its maximum, let's spool or log
+				// the batch we could not send and return buffer minus one batch size
+				hec.dropMessages(messages[i:upperBound])
 				return messages[upperBound:messagesLen]
 			}
 			// Not all sent, returning buffer from where we have not sent messages
 			logrus.Debugf("%d messages failed to sent", messagesLen)
 			return messages[i:messagesLen]
 		}
+		hec.replaySpool()
+		i = upperBound
 	}
 	// All sent, return empty buffer
 	logrus.Debugf("%d messages were sent successfully", messagesLen)
 	return messages[:0]
 }
 
+// dropMessages gives up on sending a batch for now. The batch is written
+// to the spool when it is enabled, otherwise every message goes to the daemon log.
+func (hec *hecClient) dropMessages(messages []*splunkMessage) {
+	hec.memory.release(messagesSize(messages))
+	if hec.spool == nil || len(messages) == 0 {
+		hec.logDroppedMessages(messages)
+		return
+	}
+	if err := hec.spoolMessages(messages); err != nil {
+		logrus.WithError(err).Error("Cannot spool messages")
+		hec.logDroppedMessages(messages)
+		return
+	}
+	logrus.WithField("messages", len(messages)).Warn("Spooled messages")
+}
+
+// spoolMessages writes the messages to the spool as one batch, compressed like a batch sent to HEC
+func (hec *hecClient) spoolMessages(messages []*splunkMessage) error {
+	compress, level := hec.compression(messages)
+	encoder, err := hec.encodeMessages(messages, compress, level)
+	if err != nil {
+		return err
+	}
+	err = hec.spool.write(encoder.body.Bytes(), compress)
+	putBatchEncoder(encoder)
+	return err
+}
+
+// replaySpool starts sending spooled batches, it is called after HEC accepted a batch
+func (hec *hecClient) replaySpool() {
+	if hec.spool != nil {
+		hec.spool.replay(hec.postSpooledBatch)
+	}
+}
+
+// postSpooledBatch sends a batch of the spool, with indexer acknowledgement
+// the batch stays in the spool until it is acknowledged
+func (hec *hecClient) postSpooledBatch(body []byte, compressed bool) error {
+	ack, err := hec.postBody(func() (io.ReadCloser, error) {
+		return ioutil.NopCloser(bytes.NewReader(body)), nil
+	}, len(body), compressed)
+	if err != nil || hec.acks == nil || ack.id == noAckID {
+		return err
+	}
+	if acked := <-hec.acks.trackSpooled(ack); !acked {
+		return fmt.Errorf("%s: spooled batch was not acknowledged", driverName)
+	}
+	return nil
+}
+
+// logDroppedMessages writes messages we gave up on to the daemon log
+func (hec *hecClient) logDroppedMessages(messages []*splunkMessage) {
+	atomic.AddInt64(&hec.droppedMessages, int64(len(messages)))
+	for _, message := range messages {
+		if message.payload != nil {
+			logrus.Error(fmt.Errorf("Failed to send a message '%s'", string(message.payload)))
+		} else if jsonEvent, err := json.Marshal(message); err != nil {
+			logrus.Error(err)
+		} else {
+			logrus.Error(fmt.Errorf("Failed to send a message '%s'", string(jsonEvent)))
+		}
+	}
+}
+
 func (hec *hecClient) tryPostMessages(messages []*splunkMessage) error {
+	ack, err := hec.sendMessages(messages)
+	if err != nil {
+		return err
+	}
+	// with indexer acknowledgement the batch is held until it is acknowledged
+	if hec.acks != nil && ack.id != noAckID {
+		hec.acks.track(ack, messages)
+	} else {
+		hec.memory.release(messagesSize(messages))
+	}
+	return nil
+}
+
+// sendMessages posts a batch and returns its ack id
+func (hec *hecClient) sendMessages(messages []*splunkMessage) (batchAck, error) {
 	if len(messages) == 0 {
 		logrus.Debug("No message to post")
-		return nil
-	}
-	var buffer bytes.Buffer
-	var writer io.Writer
-	var gzipWriter *gzip.Writer
-	var err error
-	// If gzip compression is enabled - create gzip writer with specified compression
-	// level. If gzip compression is disabled, use standard buffer as a writer
-	if hec.gzipCompression {
-		gzipWriter, err = gzip.NewWriterLevel(&buffer, hec.gzipCompressionLevel)
-		if err != nil {
-			return err
+		return noAck, nil
+	}
+	compress, level := hec.compression(messages)
+	start := time.Now()
+	encoder, err := hec.encodeMessages(messages, compress, level)
+	if err != nil {
+		return noAck, err
+	}
+	encodeTime := time.Since(start)
+	body := encoder.requestBody()
+	rawBytes, bodyBytes := encoder.rawBytes, body.Len()
+	hec.recordRequestSize(rawBytes, bodyBytes)
+	// The encoded batch is read in place, the buffer goes back to the pool
+	// once the transport has released the body
+	defer func() {
+		if body.wait() {
+			putBatchEncoder(encoder)
+		} else {
+			dropBatchEncoder(encoder)
 		}
-		writer = gzipWriter
-	} else {
-		writer = &buffer
+	}()
+	start = time.Now()
+	ack, err := hec.postBody(body.reader, bodyBytes, compress)
+	if err == nil && compress && hec.gzip != nil {
+		hec.gzip.observe(level, rawBytes, bodyBytes, encodeTime, time.Since(start))
+	}
+	return ack, err
+}
+
+// compression tells if the batch is compressed and at which level
+func (hec *hecClient) compression(messages []*splunkMessage) (bool, int) {
+	if hec.gzip == nil {
+		return hec.gzipCompression, hec.gzipCompressionLevel
+	}
+	return hec.gzip.choose(messagesSize(messages))
+}
+
+// encodeMessages encodes the batch into a pooled encoder
+func (hec *hecClient) encodeMessages(messages []*splunkMessage, compress bool, level int) (*batchEncoder, error) {
+	encoder, err := getBatchEncoder(compress, level)
+	if err != nil {
+		return nil, err
 	}
 	for _, message := range messages {
-		jsonEvent, err := json.Marshal(message)
-		if err != nil {
-			return err
-		}
-		if _, err := writer.Write(jsonEvent); err != nil {
-			return err
+		if err := encoder.encode(message); err != nil {
+			putBatchEncoder(encoder)
+			return nil, err
 		}
 	}
 	// If gzip compression is enabled, tell it, that we are done
-	if hec.gzipCompression {
-		err = gzipWriter.Close()
-		if err != nil {
-			return err
-		}
+	if err := encoder.close(); err != nil {
+		putBatchEncoder(encoder)
+		return nil, err
 	}
-	req, err := http.NewRequest("POST", hec.url, bytes.NewBuffer(buffer.Bytes()))
+	return encoder, nil
+}
+
+// postBody sends an encoded batch to one of the endpoints, every body returned by
+// getBody is closed. getBody is also the GetBody of the request, so the transport
+// can retry the request when a kept-alive connection was closed by HEC.
+// It returns the ack id of the batch when indexer acknowledgement is enabled.
+func (hec *hecClient) postBody(getBody func() (io.ReadCloser, error), length int, compressed bool) (batchAck, error) {
+	ep := hec.pickEndpoint()
+	body, err := getBody()
 	if err != nil {
-		return err
+		return noAck, err
+	}
+	req, err := http.NewRequest("POST", ep.url, body)
+	if err != nil {
+		body.Close()
+		return noAck, err
+	}
+	req.GetBody = getBody
+	req.ContentLength = int64(length)
+	if ep.shared != nil {
+		req = ep.shared.trace(req)
+		ep.shared.fair.acquire(hec, length)
+		defer ep.shared.fair.release()
+		atomic.AddInt64(&ep.shared.outstanding, 1)
+		defer atomic.AddInt64(&ep.shared.outstanding, -1)
+	}
+	if hec.rawEndpoint {
+		req.Header.Set("Content-Type", "text/plain")
+	} else {
+		req.Header.Set("Content-Type", "application/json")
 	}
-	req.Header.Set("Content-Type", "application/json")
 	req.Header.Set("Authorization", hec.auth)
+	if hec.channel != "" {
+		req.Header.Set(splunkChannelHeader, hec.channel)
+	}
 	// Tell if we are sending gzip compressed body
-	if hec.gzipCompression {
+	if compressed {
 		req.Header.Set("Content-Encoding", "gzip")
 	}
-	res, err := hec.client.Do(req)
+	start := time.Now()
+	res, err := ep.client.Do(req)
 	if err != nil {
-		return err
+		atomic.AddInt64(&hec.postErrors, 1)
+		atomic.AddInt64(&hec.postFailures, 1)
+		hec.recordHealth(ep, false)
+		return noAck, err
 	}
 	defer res.Body.Close()
+	if res.StatusCode > 0 && res.StatusCode < len(hec.postStatusCodes) {
+		atomic.AddInt64(&hec.postStatusCodes[res.StatusCode], 1)
+	}
+	hec.recordHealth(ep, !isServerFailure(res.StatusCode))
 	if res.StatusCode != http.StatusOK {
+		atomic.AddInt64(&hec.postFailures, 1)
 		var body []byte
 		body, err = ioutil.ReadAll(res.Body)
+		hec.postLatency.observe(time.Since(start))
 		if err != nil {
-			return err
+			return noAck, err
+		}
+		return noAck, fmt.Errorf("%s: failed to send event - %s - %s", driverName, res.Status, body)
+	}
+	ack := batchAck{endpoint: ep, id: noAckID}
+	if hec.acks != nil {
+		var response hecResponse
+		if err := json.NewDecoder(res.Body).Decode(&response); err != nil {
+			logrus.WithError(err).Warn("Cannot read the ack id of the batch")
+		} else if response.AckID != nil {
+			ack.id = *response.AckID
 		}
-		return fmt.Errorf("%s: failed to send event - %s - %s", driverName, res.Status, body)
 	}
 	io.Copy(ioutil.Discard, res.Body)
-	return nil
+	hec.postLatency.observe(time.Since(start))
+	return ack, nil
 }
 
-func (hec *hecClient) verifySplunkConnection(l *splunkLogger) error {
-	req, err := http.NewRequest(http.MethodGet, hec.healthCheckURL, nil)
-	if err != nil {
-		return err
-	}
-	res, err := hec.client.Do(req)
-	if err != nil {
-		return err
-	}
-	if res.Body != nil {
-		defer res.Body.Close()
-	}
-	if res.StatusCode != http.StatusOK {
-		var body []byte
-		body, err = ioutil.ReadAll(res.Body)
-		if err != nil {
-			return err
+// recordRequestSize keeps track of the size of the requests, so the effect
+// of the batching limits is visible
+func (hec *hecClient) recordRequestSize(rawBytes int, bodyBytes int) {
+	logrus.Debugf("Posting %d bytes (%d bytes before compression)", bodyBytes, rawBytes)
+	atomic.AddInt64(&hec.requestsSent, 1)
+	atomic.AddInt64(&hec.requestBytesSent, int64(bodyBytes))
+	atomic.AddInt64(&hec.requestRawBytesSent, int64(rawBytes))
+	atomic.StoreInt64(&hec.lastRequestBytes, int64(bodyBytes))
+	for {
+		largest := atomic.LoadInt64(&hec.largestBatchBytes)
+		if int64(rawBytes) <= largest || atomic.CompareAndSwapInt64(&hec.largestBatchBytes, largest, int64(rawBytes)) {
+			break
 		}
-		return fmt.Errorf("%s: failed to verify connection - %s - %s", driverName, res.Status, body)
 	}
-	return nil
 }
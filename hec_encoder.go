@@ -0,0 +1,210 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"encoding/json"
+	"io"
+	"io/ioutil"
+	"sync"
+	"sync/atomic"
+	"time"
+)
+
+const (
+	// Buffers which grew over this size are not returned to the pool,
+	// so one huge batch does not pin its memory for the lifetime of the plugin
+	maxPooledEncoderBuffer = 4 * 1024 * 1024
+	// How long we wait for the transport to release a request body
+	// before we give up on reusing its buffer
+	requestBodyReleaseTimeout = 5 * time.Second
+)
+
+var (
+	encoderPool = sync.Pool{
+		New: func() interface{} {
+			e := &batchEncoder{}
+			e.json = json.NewEncoder(&e.scratch)
+			return e
+		},
+	}
+	// one pool of gzip writers for every compression level from DefaultCompression to BestCompression
+	gzipWriterPools [gzip.BestCompression - gzip.DefaultCompression + 1]sync.Pool
+	// bytes held by batches which are being encoded or sent, and the highest value seen
+	encoderBytesInFlight int64
+	encoderBytesPeak     int64
+)
+
+/*
+batchEncoder writes a batch of messages into a pooled buffer which is used directly
+as the request body. When compression is enabled the events are streamed through a
+pooled gzip writer, so the uncompressed batch is never held in memory.
+*/
+type batchEncoder struct {
+	body    bytes.Buffer
+	scratch bytes.Buffer
+	json    *json.Encoder
+	gzip    *gzip.Writer
+	level   int
+	writer  io.Writer
+	// bytes written before compression
+	rawBytes int
+	// bytes accounted in encoderBytesInFlight
+	accounted int64
+}
+
+func getBatchEncoder(compress bool, level int) (*batchEncoder, error) {
+	e := encoderPool.Get().(*batchEncoder)
+	e.writer = &e.body
+	if compress {
+		pool := &gzipWriterPools[level-gzip.DefaultCompression]
+		if gzipWriter, ok := pool.Get().(*gzip.Writer); ok {
+			gzipWriter.Reset(&e.body)
+			e.gzip = gzipWriter
+		} else {
+			gzipWriter, err := gzip.NewWriterLevel(&e.body, level)
+			if err != nil {
+				encoderPool.Put(e)
+				return nil, err
+			}
+			e.gzip = gzipWriter
+		}
+		e.level = level
+		e.writer = e.gzip
+	}
+	return e, nil
+}
+
+// encode appends one message to the body
+func (e *batchEncoder) encode(message *splunkMessage) error {
+	if message.payload != nil {
+		e.rawBytes += len(message.payload)
+		_, err := e.writer.Write(message.payload)
+		return err
+	}
+	e.scratch.Reset()
+	if err := e.json.Encode(message); err != nil {
+		return err
+	}
+	// json.Encoder terminates every value with a new line, HEC does not need it
+	event := e.scratch.Bytes()
+	event = event[:len(event)-1]
+	e.rawBytes += len(event)
+	_, err := e.writer.Write(event)
+	return err
+}
+
+// close flushes the compressed stream and accounts the size of the body
+func (e *batchEncoder) close() error {
+	if e.gzip != nil {
+		if err := e.gzip.Close(); err != nil {
+			return err
+		}
+	}
+	e.accounted = int64(e.body.Cap())
+	inFlight := atomic.AddInt64(&encoderBytesInFlight, e.accounted)
+	for {
+		peak := atomic.LoadInt64(&encoderBytesPeak)
+		if inFlight <= peak || atomic.CompareAndSwapInt64(&encoderBytesPeak, peak, inFlight) {
+			break
+		}
+	}
+	return nil
+}
+
+// requestBody returns the body of an http.Request which reads the encoded batch in place.
+func (e *batchEncoder) requestBody() *encodedBody {
+	return &encodedBody{data: e.body.Bytes()}
+}
+
+func putBatchEncoder(e *batchEncoder) {
+	dropBatchEncoder(e)
+	e.rawBytes = 0
+	if e.gzip != nil {
+		e.gzip.Reset(ioutil.Discard)
+		gzipWriterPools[e.level-gzip.DefaultCompression].Put(e.gzip)
+		e.gzip = nil
+	}
+	e.writer = nil
+	if e.body.Cap() > maxPooledEncoderBuffer || e.scratch.Cap() > maxPooledEncoderBuffer {
+		return
+	}
+	e.body.Reset()
+	e.scratch.Reset()
+	encoderPool.Put(e)
+}
+
+// dropBatchEncoder stops accounting the batch without returning it to the pool,
+// it is used when the transport may still be reading the buffer
+func dropBatchEncoder(e *batchEncoder) {
+	atomic.AddInt64(&encoderBytesInFlight, -e.accounted)
+	e.accounted = 0
+}
+
+// encodedBody lets us know when the transport has finished reading the batch,
+// only then the buffer can be reused for another batch. The transport reads the
+// batch again with GetBody when it retries a request on a new connection.
+type encodedBody struct {
+	data []byte
+
+	mu      sync.Mutex
+	readers []*encodedBodyReader
+}
+
+type encodedBodyReader struct {
+	*bytes.Reader
+	once     sync.Once
+	released chan struct{}
+}
+
+func (r *encodedBodyReader) Close() error {
+	r.once.Do(func() { close(r.released) })
+	return nil
+}
+
+// reader returns a new reader of the batch, it is used for the body of the request and its GetBody
+func (b *encodedBody) reader() (io.ReadCloser, error) {
+	r := &encodedBodyReader{Reader: bytes.NewReader(b.data), released: make(chan struct{})}
+	b.mu.Lock()
+	b.readers = append(b.readers, r)
+	b.mu.Unlock()
+	return r, nil
+}
+
+func (b *encodedBody) Len() int {
+	return len(b.data)
+}
+
+// wait returns true if the transport has released every reader of the body,
+// it is called once the request is done so no reader is added anymore
+func (b *encodedBody) wait() bool {
+	timer := time.NewTimer(requestBodyReleaseTimeout)
+	defer timer.Stop()
+	b.mu.Lock()
+	readers := b.readers
+	b.mu.Unlock()
+	for _, r := range readers {
+		select {
+		case <-r.released:
+		case <-timer.C:
+			return false
+		}
+	}
+	return true
+}
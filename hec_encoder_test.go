@@ -0,0 +1,175 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"compress/gzip"
+	"encoding/json"
+	"fmt"
+	"io/ioutil"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+func encodeTestBatch(t *testing.T, compress bool, messages []*splunkMessage) []byte {
+	encoder, err := getBatchEncoder(compress, gzip.BestSpeed)
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, message := range messages {
+		if err := encoder.encode(message); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := encoder.close(); err != nil {
+		t.Fatal(err)
+	}
+	reader, err := encoder.requestBody().reader()
+	if err != nil {
+		t.Fatal(err)
+	}
+	body, err := ioutil.ReadAll(reader)
+	if err != nil {
+		t.Fatal(err)
+	}
+	putBatchEncoder(encoder)
+
+	if compress {
+		reader, err := gzip.NewReader(bytes.NewReader(body))
+		if err != nil {
+			t.Fatal(err)
+		}
+		body, err = ioutil.ReadAll(reader)
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+	return body
+}
+
+// Encoded batch should be the same as concatenated json.Marshal output,
+// also when encoders and gzip writers are reused
+func TestBatchEncoder(t *testing.T) {
+	var messages []*splunkMessage
+	var expected bytes.Buffer
+	for i := 0; i < 100; i++ {
+		message := &splunkMessage{
+			Event:      &splunkMessageEvent{Line: fmt.Sprintf("line <%d> & more", i), Source: "stdout"},
+			Time:       "1.000000",
+			Host:       "host",
+			SourceType: "sourcetype",
+		}
+		messages = append(messages, message)
+		jsonEvent, err := json.Marshal(message)
+		if err != nil {
+			t.Fatal(err)
+		}
+		expected.Write(jsonEvent)
+	}
+
+	for i := 0; i < 3; i++ {
+		for _, compress := range []bool{false, true} {
+			body := encodeTestBatch(t, compress, messages)
+			if !bytes.Equal(body, expected.Bytes()) {
+				t.Fatalf("Unexpected body (gzip %v): %s", compress, body)
+			}
+		}
+	}
+
+	if atomic.LoadInt64(&encoderBytesInFlight) != 0 {
+		t.Fatalf("All batches are released, but %d bytes are still accounted", encoderBytesInFlight)
+	}
+
+	if atomic.LoadInt64(&encoderBytesPeak) == 0 {
+		t.Fatal("Peak memory of encoded batches should be measured")
+	}
+}
+
+// retryTransport reads the body of every request and sends it again with
+// GetBody, like net/http does after a failure on a kept-alive connection
+type retryTransport struct {
+	retries int64
+}
+
+func (rt *retryTransport) RoundTrip(req *http.Request) (*http.Response, error) {
+	first, err := ioutil.ReadAll(req.Body)
+	req.Body.Close()
+	if err != nil {
+		return nil, err
+	}
+	if req.GetBody == nil {
+		return nil, fmt.Errorf("Request cannot be retried")
+	}
+	body, err := req.GetBody()
+	if err != nil {
+		return nil, err
+	}
+	second, err := ioutil.ReadAll(body)
+	body.Close()
+	if err != nil {
+		return nil, err
+	}
+	if !bytes.Equal(first, second) {
+		return nil, fmt.Errorf("Unexpected body when the request is sent again")
+	}
+	atomic.AddInt64(&rt.retries, 1)
+	retry := *req
+	retry.Body = ioutil.NopCloser(bytes.NewReader(second))
+	return http.DefaultTransport.RoundTrip(&retry)
+}
+
+// Verify that the transport can send the batch again and that the batch is
+// only released once the transport closed every body
+func TestRequestBodyRetry(t *testing.T) {
+	var lines int64
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		body, _ := ioutil.ReadAll(r.Body)
+		atomic.AddInt64(&lines, int64(bytes.Count(body, []byte(`"line"`))))
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+	// telemetry uses the client of the endpoint
+	if err := os.Setenv(envVarSplunkTelemetry, "false"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarSplunkTelemetry, "")
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{splunkURLKey: hec.URL})
+	rt := &retryTransport{}
+	loggerDriver.(*splunkLoggerInline).hec.endpoints[0].client = &http.Client{Transport: rt}
+	for i := 0; i < 10; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if atomic.LoadInt64(&rt.retries) == 0 || atomic.LoadInt64(&lines) != 10 {
+		t.Fatalf("Expected the batches to be sent again, %d retries, %d lines received", rt.retries, lines)
+	}
+	if inFlight := atomic.LoadInt64(&encoderBytesInFlight); inFlight != 0 {
+		t.Fatalf("All batches are released, but %d bytes are still accounted", inFlight)
+	}
+}
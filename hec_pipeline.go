@@ -0,0 +1,277 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"sort"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+// postBatch is a slice of messages handed to a sender goroutine.
+// seq is the position of the batch in the order it was cut from the stream,
+// it is used to put failed batches back in their original order.
+type postBatch struct {
+	seq      uint64
+	messages []*splunkMessage
+	err      error
+}
+
+/*
+pipelinedWorker is used instead of the synchronous worker loop when more than one
+concurrent POST is allowed per logger. The worker keeps reading the stream and
+cutting batches while up to concurrentPosts batches are waiting for HEC to respond.
+
+With ordered retries a failed batch is retried before any newer batch is sent, and
+while retrying only one batch is in flight. Otherwise a failed batch is put behind
+the newer messages and the window stays fully open. Only the retries are ordered:
+the batches in flight at the same time can be indexed by HEC in any order, a logger
+keeps the order of its messages only with concurrentPosts set to 1. While batches
+fail, the failed batches and the new messages are kept under bufferMaximum and
+bufferBytesMaximum, the oldest ones are dropped first.
+
+A flush request is answered once all the batches cut from the messages queued before
+it are accepted, or as soon as one of them fails.
+*/
+func (l *splunkLogger) pipelinedWorker() {
+	var (
+		messages []*splunkMessage
+		// encoded bytes of messages
+		pendingBytes int
+		retries      []*postBatch
+		seq          uint64
+		inFlight     int
+		// set when a batch has failed, cleared on the next tick,
+		// so we do not hammer HEC while it is unavailable
+		backoff bool
+		closing bool
+		// seq of the batches waiting for HEC
+		inFlightSeqs = make(map[uint64]bool)
+		waiters      []*flushWaiter
+	)
+	hec := l.hec
+	results := make(chan *postBatch, hec.concurrentPosts)
+	stream := l.stream
+	timer := time.NewTicker(hec.postMessagesFrequency)
+	defer timer.Stop()
+
+	send := func(batch *postBatch) {
+		inFlight++
+		inFlightSeqs[batch.seq] = true
+		go func() {
+			batch.err = hec.tryPostMessages(batch.messages)
+			results <- batch
+		}()
+	}
+
+	isBatchFull := func() bool {
+		return len(messages) >= hec.postMessagesBatchSize ||
+			(hec.postMessagesBatchBytes > 0 && pendingBytes >= hec.postMessagesBatchBytes)
+	}
+
+	// dispatch sends pending batches while there is room in the window.
+	// Partial batches are only sent when flushAll is set (timer or close).
+	dispatch := func(flushAll bool) {
+		window := hec.concurrentPosts
+		if hec.orderedRetries && len(retries) > 0 {
+			window = 1
+		}
+		for inFlight < window && len(retries) > 0 {
+			send(retries[0])
+			retries = retries[1:]
+		}
+		if hec.orderedRetries && len(retries) > 0 {
+			return
+		}
+		for inFlight < window && len(messages) > 0 {
+			if !flushAll && !isBatchFull() {
+				return
+			}
+			upperBound := hec.nextBatch(messages, 0)
+			batch := &postBatch{seq: seq, messages: messages[:upperBound:upperBound]}
+			pendingBytes -= messagesSize(batch.messages)
+			send(batch)
+			seq++
+			messages = messages[upperBound:]
+		}
+	}
+
+	// isFlushed returns true when all the batches below upTo have been accepted
+	isFlushed := func(upTo uint64) bool {
+		if seq < upTo {
+			return false
+		}
+		for batchSeq := range inFlightSeqs {
+			if batchSeq < upTo {
+				return false
+			}
+		}
+		for _, batch := range retries {
+			if batch.seq < upTo {
+				return false
+			}
+		}
+		return true
+	}
+
+	for {
+		select {
+		case message, open := <-stream:
+			if !open {
+				logrus.Debugf("stream is closed with %d events and %d batches in flight", len(messages), inFlight)
+				stream = nil
+				closing = true
+				break
+			}
+			if message.flush != nil {
+				// the messages we have are cut into batches from the front, the last
+				// one of them ends up in one of the next batchesFor(messages) batches
+				waiters = append(waiters, &flushWaiter{request: message.flush, seq: seq + hec.batchesFor(messages)})
+				backoff = false
+				dispatch(true)
+				break
+			}
+			messages = append(messages, message)
+			pendingBytes += len(message.payload)
+			if backoff || len(retries) > 0 {
+				// HEC is failing, the messages keep coming while the batches wait for a retry
+				retries, messages, pendingBytes = hec.trimPending(retries, messages, pendingBytes, inFlight)
+			}
+			if !backoff && isBatchFull() {
+				dispatch(false)
+			}
+		case batch := <-results:
+			inFlight--
+			delete(inFlightSeqs, batch.seq)
+			if batch.err != nil {
+				logrus.Error(batch.err)
+				backoff = true
+				waiters = failFlushWaiters(waiters, batch)
+				if hec.orderedRetries {
+					retries = append(retries, batch)
+					sort.Slice(retries, func(i, j int) bool { return retries[i].seq < retries[j].seq })
+				} else {
+					messages = append(messages, batch.messages...)
+				}
+				retries, messages, pendingBytes = hec.trimPending(retries, messages, messagesSize(messages), inFlight)
+			} else {
+				hec.replaySpool()
+				if !backoff && !closing {
+					// partial batches are sent right away while a flush is waiting
+					dispatch(len(waiters) > 0)
+				}
+			}
+		case <-timer.C:
+			logrus.Debugf("messages buffer timeout, sending %d events", len(messages))
+			backoff = false
+			dispatch(true)
+		}
+
+		buffered := len(messages)
+		for _, batch := range retries {
+			buffered += len(batch.messages)
+		}
+		atomic.StoreInt64(&hec.bufferedMessages, int64(buffered))
+
+		pendingWaiters := waiters[:0]
+		for _, waiter := range waiters {
+			if isFlushed(waiter.seq) {
+				waiter.request.reply(nil)
+			} else {
+				pendingWaiters = append(pendingWaiters, waiter)
+			}
+		}
+		waiters = pendingWaiters
+
+		if closing && inFlight == 0 {
+			// Everything in flight has completed, give the remaining messages
+			// their last chance in order, the same way the synchronous worker does
+			var remaining []*splunkMessage
+			for _, batch := range retries {
+				remaining = append(remaining, batch.messages...)
+			}
+			remaining = append(remaining, messages...)
+			hec.postMessages(remaining, true)
+			for _, waiter := range waiters {
+				waiter.request.reply(nil)
+			}
+			hec.acks.close()
+			hec.spool.close()
+			l.lock.Lock()
+			defer l.lock.Unlock()
+			releaseEndpoints(hec.endpoints)
+			l.closed = true
+			l.closedCond.Signal()
+			return
+		}
+	}
+}
+
+// trimPending keeps the messages waiting for a retry under bufferMaximum and bufferBytesMaximum.
+// The oldest batches are dropped first, to the spool or to the daemon log.
+// messagesBytes is the encoded size of messages, the size left is returned with them.
+func (hec *hecClient) trimPending(retries []*postBatch, messages []*splunkMessage, messagesBytes int, inFlight int) ([]*postBatch, []*splunkMessage, int) {
+	pending := len(messages) + inFlight*hec.postMessagesBatchSize
+	pendingBytes := messagesBytes
+	for _, batch := range retries {
+		pending += len(batch.messages)
+		pendingBytes += messagesSize(batch.messages)
+	}
+	for pending >= hec.bufferMaximum || (hec.bufferBytesMaximum > 0 && pendingBytes >= hec.bufferBytesMaximum) {
+		var dropped []*splunkMessage
+		if len(retries) > 0 {
+			dropped = retries[0].messages
+			retries = retries[1:]
+		} else if len(messages) > 0 {
+			upperBound := hec.nextBatch(messages, 0)
+			dropped = messages[:upperBound]
+			messages = messages[upperBound:]
+			messagesBytes -= messagesSize(dropped)
+		} else {
+			break
+		}
+		hec.dropMessages(dropped)
+		pending -= len(dropped)
+		pendingBytes -= messagesSize(dropped)
+	}
+	return retries, messages, messagesBytes
+}
+
+// batchesFor returns the number of batches the messages are cut into
+func (hec *hecClient) batchesFor(messages []*splunkMessage) uint64 {
+	var n uint64
+	for i := 0; i < len(messages); i = hec.nextBatch(messages, i) {
+		n++
+	}
+	return n
+}
+
+// failFlushWaiters answers the flush requests waiting for the failed batch
+func failFlushWaiters(waiters []*flushWaiter, batch *postBatch) []*flushWaiter {
+	pending := waiters[:0]
+	for _, waiter := range waiters {
+		if batch.seq < waiter.seq {
+			waiter.request.reply(fmt.Errorf("%s: flush failed, %d messages could not be sent: %v", driverName, len(batch.messages), batch.err))
+		} else {
+			pending = append(pending, waiter)
+		}
+	}
+	return pending
+}
@@ -21,6 +21,7 @@ import (
 	"errors"
 	"io"
 	"net/http"
+	"time"
 
 	"github.com/docker/docker/daemon/logger"
 	"github.com/docker/docker/pkg/ioutils"
@@ -46,6 +47,13 @@ type ReadLogsRequest struct {
 	Config logger.ReadConfig
 }
 
+type FlushRequest struct {
+	// empty flushes all the containers
+	ContainerID string
+	// for example "10s", empty means SPLUNK_LOGGING_DRIVER_FLUSH_TIMEOUT
+	Timeout string
+}
+
 func handlers(h *sdk.Handler, d *driver) {
 	h.HandleFunc("/LogDriver.StartLogging", func(w http.ResponseWriter, r *http.Request) {
 		var req StartLoggingRequest
@@ -78,6 +86,27 @@ func handlers(h *sdk.Handler, d *driver) {
 		})
 	})
 
+	h.HandleFunc("/metrics", metricsHandler(d))
+
+	h.HandleFunc("/flush", func(w http.ResponseWriter, r *http.Request) {
+		var req FlushRequest
+		// an empty body flushes all the containers
+		if err := json.NewDecoder(r.Body).Decode(&req); err != nil && err != io.EOF {
+			http.Error(w, err.Error(), http.StatusBadRequest)
+			return
+		}
+		timeout := flushTimeout
+		if req.Timeout != "" {
+			var err error
+			if timeout, err = time.ParseDuration(req.Timeout); err != nil {
+				http.Error(w, err.Error(), http.StatusBadRequest)
+				return
+			}
+		}
+		err := d.Flush(req.ContainerID, timeout)
+		respond(err, w)
+	})
+
 	h.HandleFunc("/LogDriver.ReadLogs", func(w http.ResponseWriter, r *http.Request) {
 		var req ReadLogsRequest
 		if err := json.NewDecoder(r.Body).Decode(&req); err != nil {
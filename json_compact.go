@@ -0,0 +1,287 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import "sync/atomic"
+
+const (
+	// Lines nested deeper than this are sent as strings
+	maxJSONDepth = 1000
+	// Non JSON lines in a row after which splunk-format=json stops looking for JSON
+	defaultJSONDetectionLines = 1000
+)
+
+const (
+	envVarJSONDetectionLines = "SPLUNK_LOGGING_DRIVER_JSON_DETECTION_LINES"
+)
+
+/*
+jsonDetection lets containers with splunk-format=json which do not log JSON skip the
+check. Once the number of non JSON lines in a row reaches lines, only one line in
+lines is checked, and every line is checked again as soon as one of them is JSON.
+*/
+type jsonDetection struct {
+	lines int64
+
+	// non JSON lines in a row and lines not checked since, updated atomically
+	misses  int64
+	skipped int64
+}
+
+func newJSONDetection() *jsonDetection {
+	return &jsonDetection{lines: int64(getAdvancedOptionInt(envVarJSONDetectionLines, defaultJSONDetectionLines))}
+}
+
+// enabled tells if the next line should be checked
+func (d *jsonDetection) enabled() bool {
+	if d.lines <= 0 || atomic.LoadInt64(&d.misses) < d.lines {
+		return true
+	}
+	return atomic.AddInt64(&d.skipped, 1)%d.lines == 0
+}
+
+// observe records the result of a check
+func (d *jsonDetection) observe(isJSON bool) {
+	if isJSON {
+		atomic.StoreInt64(&d.misses, 0)
+	} else {
+		atomic.AddInt64(&d.misses, 1)
+	}
+}
+
+/*
+appendCompactJSON appends src without insignificant whitespace and with the HTML
+characters, U+2028 and U+2029 escaped, as json.Marshal does for json.RawMessage.
+The line is validated and copied in one pass, without allocating besides the growth
+of dst. It returns dst unchanged and false when src is not a single valid JSON value.
+*/
+func appendCompactJSON(dst []byte, src []byte) ([]byte, bool) {
+	start := len(dst)
+	dst, i, ok := appendJSONValue(dst, src, skipJSONSpace(src, 0), 0)
+	if !ok || skipJSONSpace(src, i) != len(src) {
+		return dst[:start], false
+	}
+	return dst, true
+}
+
+func skipJSONSpace(src []byte, i int) int {
+	for i < len(src) {
+		switch src[i] {
+		case ' ', '\t', '\n', '\r':
+			i++
+		default:
+			return i
+		}
+	}
+	return i
+}
+
+// appendJSONValue appends the value starting at src[i] and returns the index after it
+func appendJSONValue(dst []byte, src []byte, i int, depth int) ([]byte, int, bool) {
+	if i >= len(src) {
+		return dst, i, false
+	}
+	switch c := src[i]; {
+	case c == '{':
+		return appendJSONObject(dst, src, i, depth)
+	case c == '[':
+		return appendJSONArray(dst, src, i, depth)
+	case c == '"':
+		return appendJSONStringValue(dst, src, i)
+	case c == '-' || (c >= '0' && c <= '9'):
+		return appendJSONNumber(dst, src, i)
+	case c == 't':
+		return appendJSONLiteral(dst, src, i, "true")
+	case c == 'f':
+		return appendJSONLiteral(dst, src, i, "false")
+	case c == 'n':
+		return appendJSONLiteral(dst, src, i, "null")
+	}
+	return dst, i, false
+}
+
+func appendJSONObject(dst []byte, src []byte, i int, depth int) ([]byte, int, bool) {
+	if depth >= maxJSONDepth {
+		return dst, i, false
+	}
+	dst = append(dst, '{')
+	i = skipJSONSpace(src, i+1)
+	if i < len(src) && src[i] == '}' {
+		return append(dst, '}'), i + 1, true
+	}
+	var ok bool
+	for {
+		if i >= len(src) || src[i] != '"' {
+			return dst, i, false
+		}
+		if dst, i, ok = appendJSONStringValue(dst, src, i); !ok {
+			return dst, i, false
+		}
+		i = skipJSONSpace(src, i)
+		if i >= len(src) || src[i] != ':' {
+			return dst, i, false
+		}
+		dst = append(dst, ':')
+		if dst, i, ok = appendJSONValue(dst, src, skipJSONSpace(src, i+1), depth+1); !ok {
+			return dst, i, false
+		}
+		i = skipJSONSpace(src, i)
+		if i >= len(src) {
+			return dst, i, false
+		}
+		switch src[i] {
+		case ',':
+			dst = append(dst, ',')
+			i = skipJSONSpace(src, i+1)
+		case '}':
+			return append(dst, '}'), i + 1, true
+		default:
+			return dst, i, false
+		}
+	}
+}
+
+func appendJSONArray(dst []byte, src []byte, i int, depth int) ([]byte, int, bool) {
+	if depth >= maxJSONDepth {
+		return dst, i, false
+	}
+	dst = append(dst, '[')
+	i = skipJSONSpace(src, i+1)
+	if i < len(src) && src[i] == ']' {
+		return append(dst, ']'), i + 1, true
+	}
+	var ok bool
+	for {
+		if dst, i, ok = appendJSONValue(dst, src, i, depth+1); !ok {
+			return dst, i, false
+		}
+		i = skipJSONSpace(src, i)
+		if i >= len(src) {
+			return dst, i, false
+		}
+		switch src[i] {
+		case ',':
+			dst = append(dst, ',')
+			i = skipJSONSpace(src, i+1)
+		case ']':
+			return append(dst, ']'), i + 1, true
+		default:
+			return dst, i, false
+		}
+	}
+}
+
+// appendJSONStringValue copies a quoted string, escape sequences are kept as they are.
+// Like encoding/json, invalid UTF-8 is copied as is.
+func appendJSONStringValue(dst []byte, src []byte, i int) ([]byte, int, bool) {
+	dst = append(dst, '"')
+	i++
+	run := i
+	for i < len(src) {
+		c := src[i]
+		switch {
+		case c == '"':
+			dst = append(dst, src[run:i]...)
+			return append(dst, '"'), i + 1, true
+		case c < 0x20:
+			return dst, i, false
+		case c == '\\':
+			if i+1 >= len(src) {
+				return dst, i, false
+			}
+			switch src[i+1] {
+			case '"', '\\', '/', 'b', 'f', 'n', 'r', 't':
+				i += 2
+			case 'u':
+				if i+6 > len(src) || !isHex(src[i+2]) || !isHex(src[i+3]) || !isHex(src[i+4]) || !isHex(src[i+5]) {
+					return dst, i, false
+				}
+				i += 6
+			default:
+				return dst, i, false
+			}
+		case c == '<' || c == '>' || c == '&':
+			dst = append(dst, src[run:i]...)
+			dst = append(dst, '\\', 'u', '0', '0', hex[c>>4], hex[c&0xF])
+			i++
+			run = i
+		case c == 0xE2 && i+2 < len(src) && src[i+1] == 0x80 && src[i+2]&^1 == 0xA8:
+			dst = append(dst, src[run:i]...)
+			dst = append(dst, '\\', 'u', '2', '0', '2', hex[src[i+2]&0xF])
+			i += 3
+			run = i
+		default:
+			i++
+		}
+	}
+	return dst, i, false
+}
+
+func isHex(c byte) bool {
+	return (c >= '0' && c <= '9') || (c >= 'a' && c <= 'f') || (c >= 'A' && c <= 'F')
+}
+
+// appendJSONNumber copies -?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?
+func appendJSONNumber(dst []byte, src []byte, i int) ([]byte, int, bool) {
+	start := i
+	if src[i] == '-' {
+		i++
+	}
+	if i >= len(src) {
+		return dst, i, false
+	}
+	if src[i] == '0' {
+		i++
+	} else if digits := skipDigits(src, i); digits > i {
+		i = digits
+	} else {
+		return dst, i, false
+	}
+	if i < len(src) && src[i] == '.' {
+		digits := skipDigits(src, i+1)
+		if digits == i+1 {
+			return dst, i, false
+		}
+		i = digits
+	}
+	if i < len(src) && (src[i] == 'e' || src[i] == 'E') {
+		i++
+		if i < len(src) && (src[i] == '+' || src[i] == '-') {
+			i++
+		}
+		digits := skipDigits(src, i)
+		if digits == i {
+			return dst, i, false
+		}
+		i = digits
+	}
+	return append(dst, src[start:i]...), i, true
+}
+
+func skipDigits(src []byte, i int) int {
+	for i < len(src) && src[i] >= '0' && src[i] <= '9' {
+		i++
+	}
+	return i
+}
+
+func appendJSONLiteral(dst []byte, src []byte, i int, literal string) ([]byte, int, bool) {
+	if len(src)-i < len(literal) || string(src[i:i+len(literal)]) != literal {
+		return dst, i, false
+	}
+	return append(dst, literal...), i + len(literal), true
+}
@@ -0,0 +1,132 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"encoding/json"
+	"os"
+	"strings"
+	"testing"
+)
+
+var compactJSONTestLines = []string{
+	`{}`,
+	`[]`,
+	`  {"a" : 1 , "b":[true,false,null, -0.5e+10, 0, 12.25E-3]}  `,
+	`{"nested":{"deeper":[[{"x":"y"}]]}}`,
+	`"just a string"`,
+	`-12`,
+	`{"escapes":"\" \\ \/ \b \f \n \r \t é 😀"}`,
+	`{"html":"<a href='x'>&amp;</a>","separators":"` + "  " + `"}`,
+	`{"invalid utf8":"` + "\xff\xfe" + `"}`,
+	"{\"tab\tin string\":1}",
+	`{"a":1,}`,
+	`[1,2`,
+	`{"a" 1}`,
+	`{a:1}`,
+	`01`,
+	`1.`,
+	`1e`,
+	`-`,
+	`tru`,
+	`nulls`,
+	`{"a":1} {"b":2}`,
+	`"\x"`,
+	`"\u12g4"`,
+	`plain text line`,
+	`[` + strings.Repeat(`[`, maxJSONDepth) + `]` + strings.Repeat(`]`, maxJSONDepth),
+}
+
+// Lines should be embedded the same way json.Marshal embeds a json.RawMessage
+func TestAppendCompactJSON(t *testing.T) {
+	for _, line := range append(compactJSONTestLines, envelopeTestLines...) {
+		var expected []byte
+		var rawJSONMessage json.RawMessage
+		valid := json.Unmarshal([]byte(line), &rawJSONMessage) == nil
+		if valid {
+			var err error
+			if expected, err = json.Marshal(&rawJSONMessage); err != nil {
+				t.Fatal(err)
+			}
+		}
+		if strings.Count(line, "[") > maxJSONDepth {
+			// sent as a string
+			valid = false
+		}
+
+		dst, ok := appendCompactJSON([]byte("prefix"), []byte(line))
+		if ok != valid {
+			t.Fatalf("Unexpected result %v for %q", ok, line)
+		}
+		if !ok {
+			if string(dst) != "prefix" {
+				t.Fatalf("Invalid JSON should leave dst unchanged, got %q", dst)
+			}
+			continue
+		}
+		if string(dst) != "prefix"+string(expected) {
+			t.Fatalf("Unexpected JSON\n%s\nexpected\n%s", dst[len("prefix"):], expected)
+		}
+	}
+}
+
+func TestAppendCompactJSONAllocs(t *testing.T) {
+	dst := make([]byte, 0, 4096)
+	for _, line := range [][]byte{benchmarkLine, []byte("plain text line")} {
+		allocs := testing.AllocsPerRun(100, func() {
+			appendCompactJSON(dst[:0], line)
+		})
+		if allocs != 0 {
+			t.Fatalf("Expected no allocations for %q, got %v", line, allocs)
+		}
+	}
+}
+
+// Verify that detection stops after non JSON lines and resumes on a JSON line
+func TestJSONDetection(t *testing.T) {
+	if err := os.Setenv(envVarJSONDetectionLines, "10"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarJSONDetectionLines, "")
+	d := newJSONDetection()
+
+	for i := 0; i < 10; i++ {
+		if !d.enabled() {
+			t.Fatalf("Expected line %d to be checked", i)
+		}
+		d.observe(false)
+	}
+	checked := 0
+	for i := 0; i < 100; i++ {
+		if d.enabled() {
+			checked++
+			d.observe(false)
+		}
+	}
+	if checked != 10 {
+		t.Fatalf("Expected one line in 10 to be checked, got %d", checked)
+	}
+
+	for !d.enabled() {
+	}
+	d.observe(true)
+	for i := 0; i < 10; i++ {
+		if !d.enabled() {
+			t.Fatal("Expected every line to be checked after a JSON line")
+		}
+	}
+}
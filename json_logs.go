@@ -0,0 +1,220 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+	"github.com/docker/docker/daemon/logger"
+)
+
+const (
+	// Number of messages waiting to be written to the json-file log of a container
+	defaultJSONLogsQueueSize = 4 * defaultPostMessagesBatchSize
+)
+
+const (
+	envVarJSONLogsQueueSize = "SPLUNK_LOGGING_DRIVER_JSON_LOGS_QUEUE_SIZE"
+)
+
+// jsonLogsEnabled tells if the messages of the container are written to the json-file log,
+// splunk-json-logs overrides SPLUNK_LOGGING_DRIVER_JSON_LOGS
+func jsonLogsEnabled(config map[string]string) (bool, error) {
+	if enabledStr, ok := config[splunkJSONLogsKey]; ok {
+		return strconv.ParseBool(enabledStr)
+	}
+	return jsonLogs, nil
+}
+
+/*
+logQueue writes the messages of a container to the json-file logger from its own
+goroutine, so a slow disk does not hold up the messages sent to Splunk and Splunk
+does not hold up the local log. When the queue is full the splunk-json-logs-backpressure
+policy applies: block, drop-newest or drop-oldest.
+*/
+type logQueue struct {
+	logger      logger.Logger
+	policy      string
+	containerID string
+
+	lock   sync.RWMutex
+	closed bool
+	queue  chan *logger.Message
+	done   chan struct{}
+	memory *memoryBudget
+	// indexes the messages written to the json-file log, nil when disabled
+	index *logIndex
+
+	// updated atomically
+	written int64
+	dropped int64
+}
+
+func newLogQueue(l logger.Logger, config map[string]string, containerID string, index *logIndex) (*logQueue, error) {
+	q := &logQueue{
+		logger:      l,
+		policy:      backpressureBlock,
+		containerID: containerID,
+		done:        make(chan struct{}),
+		memory:      memory,
+		index:       index,
+	}
+	if policy, ok := config[splunkJSONLogsBackpressureKey]; ok {
+		q.policy = policy
+	}
+	switch q.policy {
+	case backpressureBlock:
+	case backpressureDropNewest:
+	case backpressureDropOldest:
+	default:
+		return nil, fmt.Errorf("%s: unknown %s %s, supported policies are block, drop-newest and drop-oldest",
+			driverName, splunkJSONLogsBackpressureKey, q.policy)
+	}
+	size := getAdvancedOptionInt(envVarJSONLogsQueueSize, defaultJSONLogsQueueSize)
+	if size < 1 {
+		return nil, fmt.Errorf("%s: %s should be at least 1", driverName, envVarJSONLogsQueueSize)
+	}
+	q.queue = make(chan *logger.Message, size)
+	go q.run()
+	return q, nil
+}
+
+// log queues a copy of the line, the caller reuses its buffer.
+// The line is accounted in the memory budget but never waits for it: the queue
+// has its own bound, so the loggers waiting for HEC do not hold up the local log.
+func (q *logQueue) log(line []byte, source string, partial bool, timestamp time.Time) {
+	q.lock.RLock()
+	defer q.lock.RUnlock()
+	if q.closed {
+		return
+	}
+	q.memory.force(len(line))
+	msg := &logger.Message{
+		Line:      append([]byte(nil), line...),
+		Source:    source,
+		Partial:   partial,
+		Timestamp: timestamp,
+	}
+
+	switch q.policy {
+	case backpressureDropNewest:
+		select {
+		case q.queue <- msg:
+		default:
+			atomic.AddInt64(&q.dropped, 1)
+			q.memory.release(len(msg.Line))
+		}
+	case backpressureDropOldest:
+		for {
+			select {
+			case q.queue <- msg:
+				return
+			default:
+			}
+			select {
+			case oldest := <-q.queue:
+				atomic.AddInt64(&q.dropped, 1)
+				q.memory.release(len(oldest.Line))
+			default:
+			}
+		}
+	default:
+		q.queue <- msg
+	}
+}
+
+/*
+run writes the queued messages, what is queued at each wakeup is written as one
+batch: the memory budget, the counters and the index are updated once per batch.
+The json-file logger still gets one Log call per message, it marshals each message
+and writes it to its rotating file under its own lock, and neither the writer nor
+the encoder are exposed to wrap them in a buffered writer.
+*/
+func (q *logQueue) run() {
+	defer close(q.done)
+	var batch []*logger.Message
+	for msg := range q.queue {
+		batch = append(batch[:0], msg)
+		size := len(msg.Line)
+	drain:
+		// a batch is indexed as a whole, it is kept under the index interval
+		for len(batch) < cap(q.queue) && (q.index == nil || size < q.index.interval) {
+			select {
+			case msg, open := <-q.queue:
+				if !open {
+					break drain
+				}
+				batch = append(batch, msg)
+				size += len(msg.Line)
+			default:
+				break drain
+			}
+		}
+		q.write(batch)
+		for i := range batch {
+			batch[i] = nil
+		}
+	}
+}
+
+// write writes a batch of messages to the json-file logger
+func (q *logQueue) write(batch []*logger.Message) {
+	var size, written, writtenSize int
+	var maxTime time.Time
+	for _, msg := range batch {
+		lineSize := len(msg.Line)
+		timestamp := msg.Timestamp
+		size += lineSize
+		if err := q.logger.Log(msg); err != nil {
+			logrus.WithField("id", q.containerID).WithError(err).Error("Error writing log message to the json-file log")
+			continue
+		}
+		written++
+		writtenSize += lineSize
+		if timestamp.After(maxTime) {
+			maxTime = timestamp
+		}
+	}
+	// the json-file logger is done with the lines once Log returns
+	q.memory.release(size)
+	atomic.AddInt64(&q.written, int64(written))
+	if q.index != nil && written > 0 {
+		q.index.written(written, writtenSize, maxTime)
+	}
+}
+
+// Close waits for the queued messages to be written, the json-file logger is closed by the caller
+func (q *logQueue) Close() {
+	q.lock.Lock()
+	if !q.closed {
+		q.closed = true
+		close(q.queue)
+	}
+	q.lock.Unlock()
+	<-q.done
+	if dropped := atomic.LoadInt64(&q.dropped); dropped > 0 {
+		logrus.WithField("id", q.containerID).
+			WithField("policy", q.policy).
+			WithField("dropped", dropped).
+			Info("Messages dropped from the json-file log")
+	}
+}
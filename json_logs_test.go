@@ -0,0 +1,206 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"io/ioutil"
+	"os"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+// slowLogger stands for a json-file logger on a slow disk, it writes once released
+type slowLogger struct {
+	release chan struct{}
+	lock    sync.Mutex
+	lines   []string
+}
+
+func newSlowLogger() *slowLogger {
+	return &slowLogger{release: make(chan struct{})}
+}
+
+func (l *slowLogger) Log(msg *logger.Message) error {
+	<-l.release
+	l.lock.Lock()
+	l.lines = append(l.lines, string(msg.Line))
+	l.lock.Unlock()
+	return nil
+}
+
+func (l *slowLogger) Name() string { return "slow" }
+func (l *slowLogger) Close() error { return nil }
+
+func newTestLogQueue(t *testing.T, l logger.Logger, policy string) *logQueue {
+	if err := os.Setenv(envVarJSONLogsQueueSize, "4"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarJSONLogsQueueSize, "")
+	q, err := newLogQueue(l, map[string]string{splunkJSONLogsBackpressureKey: policy}, "containeriid", nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return q
+}
+
+// Verify that a slow json-file log does not hold up the caller with the drop policies
+func TestLogQueueDrop(t *testing.T) {
+	for _, policy := range []string{backpressureDropNewest, backpressureDropOldest} {
+		l := newSlowLogger()
+		q := newTestLogQueue(t, l, policy)
+
+		done := make(chan struct{})
+		go func() {
+			for i := 0; i < 20; i++ {
+				q.log([]byte(fmt.Sprintf("%d", i)), "stdout", false, time.Now())
+			}
+			close(done)
+		}()
+		select {
+		case <-done:
+		case <-time.After(10 * time.Second):
+			t.Fatalf("%s: logging should not wait for the json-file log", policy)
+		}
+
+		close(l.release)
+		q.Close()
+		written, dropped := atomic.LoadInt64(&q.written), atomic.LoadInt64(&q.dropped)
+		if written+dropped != 20 || dropped == 0 || int(written) != len(l.lines) {
+			t.Fatalf("%s: unexpected counters, written %d, dropped %d", policy, written, dropped)
+		}
+		if policy == backpressureDropOldest && l.lines[len(l.lines)-1] != "19" {
+			t.Fatalf("%s: expected the newest message to be kept, got %v", policy, l.lines)
+		}
+		if policy == backpressureDropNewest && l.lines[0] != "0" {
+			t.Fatalf("%s: expected the oldest message to be kept, got %v", policy, l.lines)
+		}
+	}
+}
+
+// Verify that with block every message is written in order, from a copy of the line
+func TestLogQueueBlock(t *testing.T) {
+	l := newSlowLogger()
+	close(l.release)
+	q := newTestLogQueue(t, l, backpressureBlock)
+
+	line := make([]byte, 1)
+	for i := 0; i < 20; i++ {
+		line[0] = byte('a' + i)
+		q.log(line, "stdout", false, time.Now())
+	}
+	q.Close()
+	// closed queues ignore new messages
+	q.log(line, "stdout", false, time.Now())
+
+	if len(l.lines) != 20 {
+		t.Fatalf("Expected 20 messages, got %d", len(l.lines))
+	}
+	for i, written := range l.lines {
+		if written != string(byte('a'+i)) {
+			t.Fatalf("Unexpected message %d %q", i, written)
+		}
+	}
+}
+
+// Verify that the messages queued while the json-file log writes are written in batches
+// kept under the index interval
+func TestLogQueueBatch(t *testing.T) {
+	f, err := ioutil.TempFile("", "json-log")
+	if err != nil {
+		t.Fatal(err)
+	}
+	f.Close()
+	defer os.Remove(f.Name())
+	if err := os.Setenv(envVarJSONLogsIndexInterval, "2"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarJSONLogsIndexInterval, "")
+
+	l := newSlowLogger()
+	q := newTestLogQueue(t, l, backpressureBlock)
+	q.index = newLogIndex(f.Name())
+	q.log([]byte("0"), "stdout", false, time.Now())
+	// the first message is being written
+	for i := 0; i < 1000 && len(q.queue) > 0; i++ {
+		time.Sleep(time.Millisecond)
+	}
+	for i := 1; i < 4; i++ {
+		q.log([]byte(fmt.Sprintf("%d", i)), "stdout", false, time.Now())
+	}
+	close(l.release)
+	q.Close()
+
+	if len(l.lines) != 4 || q.written != 4 {
+		t.Fatalf("Expected every message to be written, got %v", l.lines)
+	}
+	// batches of 1, 2 and 1 messages, the index is updated once the second one is written
+	if len(q.index.entries) != 1 || q.index.entries[0].lines != 3 || q.index.lines != 4 {
+		t.Fatalf("Expected the index to be updated once per batch, got %v", q.index.entries)
+	}
+}
+
+// Verify that the json-file log does not wait for the memory budget used up by other loggers
+func TestLogQueueMemoryBudget(t *testing.T) {
+	defer useMemoryBudget(10)()
+	memory.force(10)
+	defer memory.release(10)
+
+	for _, policy := range []string{backpressureBlock, backpressureDropNewest} {
+		l := newSlowLogger()
+		close(l.release)
+		q := newTestLogQueue(t, l, policy)
+		done := make(chan struct{})
+		go func() {
+			for i := 0; i < 3; i++ {
+				q.log([]byte(fmt.Sprintf("%d", i)), "stdout", false, time.Now())
+			}
+			close(done)
+		}()
+		select {
+		case <-done:
+		case <-time.After(10 * time.Second):
+			t.Fatalf("%s: logging should not wait for the memory budget", policy)
+		}
+		q.Close()
+		if len(l.lines) != 3 || q.dropped != 0 {
+			t.Fatalf("%s: expected every message to be written, got %v", policy, l.lines)
+		}
+	}
+	if used := atomic.LoadInt64(&memory.used); used != 10 {
+		t.Fatalf("Expected the written messages to be released, %d used", used)
+	}
+}
+
+func TestJSONLogsOptions(t *testing.T) {
+	if enabled, err := jsonLogsEnabled(map[string]string{}); err != nil || enabled != jsonLogs {
+		t.Fatal("Expected SPLUNK_LOGGING_DRIVER_JSON_LOGS by default")
+	}
+	if enabled, err := jsonLogsEnabled(map[string]string{splunkJSONLogsKey: "false"}); err != nil || enabled {
+		t.Fatal("Expected the log-opt to disable the json-file log")
+	}
+	if _, err := jsonLogsEnabled(map[string]string{splunkJSONLogsKey: "maybe"}); err == nil {
+		t.Fatal("Expected error for an invalid value")
+	}
+	if _, err := newLogQueue(discardLogger{}, map[string]string{splunkJSONLogsBackpressureKey: backpressureSpill}, "containeriid", nil); err == nil {
+		t.Fatal("Expected error for an unsupported policy")
+	}
+}
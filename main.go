@@ -45,8 +45,13 @@ func main() {
 		os.Exit(1)
 	}
 
+	d := newDriver()
+	if metricsAddress := os.Getenv(envVarMetricsAddress); metricsAddress != "" {
+		go serveMetrics(metricsAddress, d)
+	}
+
 	h := sdk.NewHandler(`{"Implements": ["LoggingDriver"]}`)
-	handlers(&h, newDriver())
+	handlers(&h, d)
 	if err := h.ServeUnix(socketAddress, 0); err != nil {
 		panic(err)
 	}
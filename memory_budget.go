@@ -0,0 +1,147 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"sync"
+	"sync/atomic"
+)
+
+const (
+	// Bytes all the loggers can hold in memory, 0 means no limit
+	defaultMemoryBudget = 0
+)
+
+const (
+	envVarMemoryBudget = "SPLUNK_LOGGING_DRIVER_MEMORY_BUDGET"
+)
+
+// memory is shared by the loggers of all the containers
+var memory = newMemoryBudget(int64(getAdvancedOptionInt(envVarMemoryBudget, defaultMemoryBudget)))
+
+/*
+memoryBudget bounds the bytes held by all the loggers: messages in the stream
+channels and in the buffers of the workers, batches waiting for their
+acknowledgement, partial messages being reassembled and lines waiting for the
+json-file log. The bytes are reserved when a message is buffered and released
+once HEC accepted it, or it was dropped or spooled. When the budget is used up
+the policy of the container decides what happens to new messages. The usage is
+tracked without a limit too. A nil budget accounts nothing.
+*/
+type memoryBudget struct {
+	limit int64
+
+	// updated atomically
+	used   int64
+	peak   int64
+	denied int64
+
+	// waiters are woken up when bytes are released
+	mu      sync.Mutex
+	waiting int32
+	freed   chan struct{}
+}
+
+func newMemoryBudget(limit int64) *memoryBudget {
+	return &memoryBudget{limit: limit, freed: make(chan struct{})}
+}
+
+// reserve takes n bytes from the budget if they fit. A message bigger than the
+// whole budget fits when nothing else is held.
+func (b *memoryBudget) reserve(n int) bool {
+	if b == nil || n <= 0 {
+		return true
+	}
+	if !b.take(n) {
+		atomic.AddInt64(&b.denied, 1)
+		return false
+	}
+	return true
+}
+
+func (b *memoryBudget) take(n int) bool {
+	need := int64(n)
+	if b.limit > 0 && need > b.limit {
+		need = b.limit
+	}
+	for {
+		used := atomic.LoadInt64(&b.used)
+		if b.limit > 0 && used+need > b.limit {
+			return false
+		}
+		if atomic.CompareAndSwapInt64(&b.used, used, used+int64(n)) {
+			b.updatePeak(used + int64(n))
+			return true
+		}
+	}
+}
+
+// force takes n bytes even over the limit, for the messages the policy keeps anyway
+func (b *memoryBudget) force(n int) {
+	if b == nil || n <= 0 {
+		return
+	}
+	b.updatePeak(atomic.AddInt64(&b.used, int64(n)))
+}
+
+// wait blocks until n bytes are reserved, it returns false when stop is closed first
+func (b *memoryBudget) wait(n int, stop <-chan struct{}) bool {
+	if b == nil || n <= 0 {
+		return true
+	}
+	for {
+		b.mu.Lock()
+		atomic.AddInt32(&b.waiting, 1)
+		freed := b.freed
+		b.mu.Unlock()
+		reserved := b.take(n)
+		stopped := false
+		if !reserved {
+			select {
+			case <-freed:
+			case <-stop:
+				stopped = true
+			}
+		}
+		atomic.AddInt32(&b.waiting, -1)
+		if reserved || stopped {
+			return reserved
+		}
+	}
+}
+
+func (b *memoryBudget) release(n int) {
+	if b == nil || n <= 0 {
+		return
+	}
+	atomic.AddInt64(&b.used, -int64(n))
+	if atomic.LoadInt32(&b.waiting) > 0 {
+		b.mu.Lock()
+		close(b.freed)
+		b.freed = make(chan struct{})
+		b.mu.Unlock()
+	}
+}
+
+func (b *memoryBudget) updatePeak(used int64) {
+	for {
+		peak := atomic.LoadInt64(&b.peak)
+		if used <= peak || atomic.CompareAndSwapInt64(&b.peak, peak, used) {
+			return
+		}
+	}
+}
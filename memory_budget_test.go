@@ -0,0 +1,190 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"strings"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/api/types/plugins/logdriver"
+	"github.com/docker/docker/daemon/logger"
+)
+
+func TestMemoryBudget(t *testing.T) {
+	b := newMemoryBudget(100)
+	if !b.reserve(60) || b.reserve(60) || !b.reserve(40) {
+		t.Fatal("Expected reservations up to the limit")
+	}
+	b.release(100)
+	if !b.reserve(500) || b.reserve(1) {
+		t.Fatal("Expected a message bigger than the budget to fit only alone")
+	}
+	b.release(500)
+	if b.used != 0 || b.peak != 500 || b.denied != 2 {
+		t.Fatalf("Unexpected accounting, used %d, peak %d, denied %d", b.used, b.peak, b.denied)
+	}
+
+	b.force(100)
+	done := make(chan struct{})
+	go func() {
+		b.wait(10, nil)
+		close(done)
+	}()
+	select {
+	case <-done:
+		t.Fatal("Expected to wait for the budget")
+	case <-time.After(50 * time.Millisecond):
+	}
+	b.release(100)
+	select {
+	case <-done:
+	case <-time.After(10 * time.Second):
+		t.Fatal("Expected the release to wake up the waiter")
+	}
+
+	var unlimited *memoryBudget
+	if !unlimited.reserve(1 << 30) {
+		t.Fatal("Expected no limit without a budget")
+	}
+}
+
+// useMemoryBudget replaces the budget of the plugin until restore is called
+func useMemoryBudget(limit int64) (restore func()) {
+	saved := memory
+	memory = newMemoryBudget(limit)
+	return func() { memory = saved }
+}
+
+// Verify that the messages over the budget follow the policy of the container and
+// that every reserved byte is released once the logger is closed
+func TestMemoryBudgetLogger(t *testing.T) {
+	defer useMemoryBudget(4096)()
+	if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarPostMessagesFrequency, "")
+
+	var requests int64
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		atomic.AddInt64(&requests, 1)
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:          hec.URL,
+		splunkBackpressureKey: backpressureDropNewest,
+	})
+	line := []byte(strings.Repeat("x", 500))
+	for i := 0; i < 20; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: line, Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	used := atomic.LoadInt64(&memory.used)
+	if used == 0 || used > memory.limit {
+		t.Fatalf("Expected the buffered messages to hold up to the budget, got %d", used)
+	}
+	limited := loggerDriver.(*splunkLoggerInline).memoryLimited
+	if limited.dropped == 0 || limited.dropped != limited.limited {
+		t.Fatalf("Expected the messages over the budget to be dropped, got %v", limited)
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if used := atomic.LoadInt64(&memory.used); used != 0 || atomic.LoadInt64(&requests) == 0 {
+		t.Fatalf("Expected every byte to be released once sent, %d still used", used)
+	}
+}
+
+// Verify that chunks are not held while the budget is used up
+func TestMemoryBudgetPartials(t *testing.T) {
+	defer useMemoryBudget(10)()
+	partialMsgBufferHoldDuration = time.Hour
+	partialMsgBufferMaximum = defaultPartialMsgBufferMaximum
+	defer func() {
+		partialMsgBufferHoldDuration = defaultPartialMsgBufferHoldDuration
+	}()
+
+	var messages reassembledMessages
+	r := newPartialReassembler(messages.emit)
+	for _, entry := range []*logdriver.LogEntry{
+		{Source: "stdout", Line: []byte("out1 "), Partial: true},
+		{Source: "stdout", Line: []byte("out2 "), Partial: true},
+		{Source: "stdout", Line: []byte("out3 "), Partial: true},
+		{Source: "stdout", Line: []byte("out4"), Partial: false},
+	} {
+		r.add(entry)
+	}
+
+	got := messages.get()
+	if len(got) != 3 ||
+		got[0] != (reassembledMessage{"out1 out2 ", "stdout", true}) ||
+		got[1] != (reassembledMessage{"out3 ", "stdout", true}) ||
+		got[2] != (reassembledMessage{"out4", "stdout", false}) {
+		t.Fatalf("Unexpected messages %v", got)
+	}
+	if memory.used != 0 {
+		t.Fatalf("Expected the reassembled chunks to be released, %d still used", memory.used)
+	}
+}
+
+// Verify that closing a logger wakes up a message waiting for the budget
+func TestMemoryBudgetClose(t *testing.T) {
+	defer useMemoryBudget(100)()
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{splunkURLKey: hec.URL})
+	// held by another container
+	memory.force(100)
+	defer memory.release(100)
+
+	logged := make(chan error, 1)
+	go func() {
+		logged <- loggerDriver.Log(&logger.Message{Line: []byte("line"), Source: "stdout", Timestamp: time.Now()})
+	}()
+	select {
+	case err := <-logged:
+		t.Fatalf("Expected the message to wait for the budget, got %v", err)
+	case <-time.After(50 * time.Millisecond):
+	}
+
+	closed := make(chan error, 1)
+	go func() {
+		closed <- loggerDriver.Close()
+	}()
+	select {
+	case err := <-closed:
+		if err != nil {
+			t.Fatal(err)
+		}
+	case <-time.After(10 * time.Second):
+		t.Fatal("Close is blocked by the message waiting for the budget")
+	}
+	if err := <-logged; err == nil {
+		t.Fatal("Expected the waiting message to be rejected once the logger is closed")
+	}
+}
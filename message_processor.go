@@ -22,6 +22,7 @@ import (
 	"io"
 	"os"
 	"strings"
+	"sync/atomic"
 	"time"
 	"unicode/utf8"
 
@@ -49,10 +50,6 @@ This is a routine to decode the log stream into LogEntry and store it in buffer
 and send the buffer to splunk logger and json logger
 */
 func (mg messageProcessor) consumeLog(lf *logPair) {
-	// Initialize temp buffer
-	tmpBuf := &partialMsgBuffer{
-		bufferTimer: time.Now(),
-	}
 	// create a protobuf reader for the log stream
 	dec := protoio.NewUint32DelimitedReader(lf.stream, binary.BigEndian, 1e6)
 	defer dec.Close()
@@ -82,43 +79,53 @@ func (mg messageProcessor) consumeLog(lf *logPair) {
 			dec = protoio.NewUint32DelimitedReader(lf.stream, binary.BigEndian, 1e6)
 		}
 		curRetryNumber = 0
+		atomic.AddInt64(&lf.read.lines, 1)
+		atomic.AddInt64(&lf.read.bytes, int64(len(buf.Line)))
+		if buf.Partial {
+			atomic.AddInt64(&lf.read.partialEntries, 1)
+		}
 
 		if mg.shouldSendMessage(buf.Line) {
-			if tmpBuf.tBuf.Len() == 0 {
-				logrus.Debug("First messaging, reseting timer")
-				tmpBuf.bufferTimer = time.Now()
-			}
-			// Append to temp buffer
-			if err := tmpBuf.append(&buf); err == nil {
-				// Send message to splunk and also json logger if enabled
-				mg.sendMessage(lf.splunkl, &buf, tmpBuf, lf.info.ContainerID)
-				if jsonLogs {
-					mg.sendMessage(lf.jsonl, &buf, tmpBuf, lf.info.ContainerID)
-				}
-				//temp buffer and values reset
-				tmpBuf.reset()
-			}
+			// Partial entries are joined per stream, complete messages are sent
+			// to splunk and also json logger if enabled
+			lf.partials.add(&buf)
 		}
 		buf.Reset()
 	}
 }
 
+// log sends a reassembled message to splunk, through the multiline events if enabled,
+// and queues it for the json logger if enabled
+func (lf *logPair) log(line []byte, source string, partial bool, timestamp time.Time) {
+	if lf.multiline != nil {
+		lf.multiline.add(line, source, partial, timestamp)
+	} else {
+		lf.send(line, source, partial, timestamp)
+	}
+	if lf.jsonq != nil {
+		lf.jsonq.log(line, source, partial, timestamp)
+	}
+}
+
+// send sends a message to splunk, unless the filter rules drop it
+func (lf *logPair) send(line []byte, source string, partial bool, timestamp time.Time) {
+	if lf.filter != nil && !lf.filter.send(line) {
+		return
+	}
+	sendMessage(lf.splunkl, line, source, partial, timestamp, lf.info.ContainerID)
+}
+
 // send the log entry message to logger
-func (mg messageProcessor) sendMessage(l logger.Logger, buf *logdriver.LogEntry, t *partialMsgBuffer, containerid string) {
+func sendMessage(l logger.Logger, line []byte, source string, partial bool, timestamp time.Time, containerid string) {
 	var msg logger.Message
-	// Only send if partial bit is not set or temp buffer size reached max or temp buffer timer expired
-	// Check for temp buffer timer expiration
-	if !buf.Partial || t.shouldFlush(time.Now()) {
-		msg.Line = t.tBuf.Bytes()
-		msg.Source = buf.Source
-		msg.Partial = buf.Partial
-		msg.Timestamp = time.Unix(0, buf.TimeNano)
-
-		if err := l.Log(&msg); err != nil {
-			logrus.WithField("id", containerid).WithError(err).WithField("message",
-				msg).Error("Error writing log message")
-		}
-		t.bufferReset = true
+	msg.Line = line
+	msg.Source = source
+	msg.Partial = partial
+	msg.Timestamp = timestamp
+
+	if err := l.Log(&msg); err != nil {
+		logrus.WithField("id", containerid).WithError(err).WithField("message",
+			msg).Error("Error writing log message")
 	}
 }
 
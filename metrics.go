@@ -0,0 +1,328 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bufio"
+	"compress/gzip"
+	"io"
+	"net/http"
+	"sort"
+	"strconv"
+	"strings"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	envVarMetricsAddress = "SPLUNK_LOGGING_DRIVER_METRICS_ADDR"
+
+	metricsContentType = "text/plain; version=0.0.4"
+)
+
+// Upper bounds of the buckets of the POST latency histogram, in seconds
+var postLatencyBuckets = []float64{0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10}
+
+// fifoCounters counts what the message processor reads from the FIFO of a container
+type fifoCounters struct {
+	lines          int64
+	bytes          int64
+	partialEntries int64
+}
+
+// latencyHistogram is a fixed bucket histogram updated with atomic operations only
+type latencyHistogram struct {
+	// the last bucket is +Inf
+	buckets [12]int64
+	sumNano int64
+}
+
+func (h *latencyHistogram) observe(d time.Duration) {
+	seconds := d.Seconds()
+	i := 0
+	for i < len(postLatencyBuckets) && seconds > postLatencyBuckets[i] {
+		i++
+	}
+	atomic.AddInt64(&h.buckets[i], 1)
+	atomic.AddInt64(&h.sumNano, int64(d))
+}
+
+type metricSample struct {
+	name   string
+	labels string
+	value  float64
+}
+
+type metricFamily struct {
+	name    string
+	help    string
+	typ     string
+	samples []metricSample
+}
+
+/*
+metricsSet collects samples and writes them in the Prometheus text format.
+Samples of every family are written together, no matter in which order they were added.
+*/
+type metricsSet struct {
+	families map[string]*metricFamily
+	order    []string
+}
+
+func newMetricsSet() *metricsSet {
+	return &metricsSet{families: make(map[string]*metricFamily)}
+}
+
+func (s *metricsSet) family(name string, typ string, help string) *metricFamily {
+	family, ok := s.families[name]
+	if !ok {
+		family = &metricFamily{name: name, help: help, typ: typ}
+		s.families[name] = family
+		s.order = append(s.order, name)
+	}
+	return family
+}
+
+func (s *metricsSet) counter(name string, help string, labels string, value int64) {
+	f := s.family(name, "counter", help)
+	f.samples = append(f.samples, metricSample{name: name, labels: labels, value: float64(value)})
+}
+
+func (s *metricsSet) gauge(name string, help string, labels string, value float64) {
+	f := s.family(name, "gauge", help)
+	f.samples = append(f.samples, metricSample{name: name, labels: labels, value: value})
+}
+
+func (s *metricsSet) histogram(name string, help string, labels string, h *latencyHistogram) {
+	f := s.family(name, "histogram", help)
+	var cumulative int64
+	for i := range h.buckets {
+		cumulative += atomic.LoadInt64(&h.buckets[i])
+		le := "+Inf"
+		if i < len(postLatencyBuckets) {
+			le = strconv.FormatFloat(postLatencyBuckets[i], 'g', -1, 64)
+		}
+		f.samples = append(f.samples, metricSample{name: name + "_bucket", labels: joinLabels(labels, metricLabel("le", le)), value: float64(cumulative)})
+	}
+	f.samples = append(f.samples,
+		metricSample{name: name + "_sum", labels: labels, value: time.Duration(atomic.LoadInt64(&h.sumNano)).Seconds()},
+		metricSample{name: name + "_count", labels: labels, value: float64(cumulative)})
+}
+
+func (s *metricsSet) write(w io.Writer) error {
+	out := bufio.NewWriter(w)
+	for _, name := range s.order {
+		f := s.families[name]
+		out.WriteString("# HELP " + f.name + " " + f.help + "\n")
+		out.WriteString("# TYPE " + f.name + " " + f.typ + "\n")
+		for _, sample := range f.samples {
+			out.WriteString(sample.name)
+			if sample.labels != "" {
+				out.WriteString("{" + sample.labels + "}")
+			}
+			out.WriteString(" " + strconv.FormatFloat(sample.value, 'g', -1, 64) + "\n")
+		}
+	}
+	return out.Flush()
+}
+
+var metricLabelEscaper = strings.NewReplacer(`\`, `\\`, `"`, `\"`, "\n", `\n`)
+
+func metricLabel(name string, value string) string {
+	return name + `="` + metricLabelEscaper.Replace(value) + `"`
+}
+
+func joinLabels(labels ...string) string {
+	nonEmpty := labels[:0:0]
+	for _, label := range labels {
+		if label != "" {
+			nonEmpty = append(nonEmpty, label)
+		}
+	}
+	return strings.Join(nonEmpty, ",")
+}
+
+// writeMetrics writes the metrics of all the containers and of the plugin
+func (d *driver) writeMetrics(w io.Writer) error {
+	s := newMetricsSet()
+
+	d.mu.Lock()
+	files := make([]string, 0, len(d.logs))
+	for file := range d.logs {
+		files = append(files, file)
+	}
+	sort.Strings(files)
+	for _, file := range files {
+		lf := d.logs[file]
+		labels := metricLabel("container_id", lf.info.ContainerID)
+		s.counter("splunk_logging_fifo_lines_total", "Log entries read from the FIFO.", labels, atomic.LoadInt64(&lf.read.lines))
+		s.counter("splunk_logging_fifo_bytes_total", "Bytes of log lines read from the FIFO.", labels, atomic.LoadInt64(&lf.read.bytes))
+		s.counter("splunk_logging_fifo_partial_entries_total", "Partial log entries read from the FIFO and reassembled.", labels, atomic.LoadInt64(&lf.read.partialEntries))
+		if m := lf.multiline; m != nil {
+			s.counter("splunk_logging_multiline_lines_total", "Lines joined into multiline events.", labels, atomic.LoadInt64(&m.lines))
+			s.counter("splunk_logging_multiline_events_total", "Multiline events sent.", labels, atomic.LoadInt64(&m.events))
+			s.counter("splunk_logging_multiline_split_events_total", "Multiline events sent before their end because of splunk-multiline-max-lines or splunk-multiline-max-bytes.", labels, atomic.LoadInt64(&m.split))
+		}
+		if f := lf.filter; f != nil {
+			for _, rule := range f.rules {
+				ruleLabels := joinLabels(labels, metricLabel("action", rule.action), metricLabel("pattern", rule.pattern))
+				s.counter("splunk_logging_filter_matched_total", "Messages matching a filter rule, counted on the rule which decided.", ruleLabels, atomic.LoadInt64(&rule.matched))
+				s.counter("splunk_logging_filter_dropped_total", "Messages dropped by a filter rule.", ruleLabels, atomic.LoadInt64(&rule.dropped))
+				s.counter("splunk_logging_filter_dropped_bytes_total", "Bytes of the messages dropped by a filter rule.", ruleLabels, atomic.LoadInt64(&rule.droppedBytes))
+			}
+		}
+		if q := lf.jsonq; q != nil {
+			s.gauge("splunk_logging_json_logs_queue_depth", "Messages waiting to be written to the json-file log.", labels, float64(len(q.queue)))
+			s.counter("splunk_logging_json_logs_written_total", "Messages written to the json-file log.", labels, atomic.LoadInt64(&q.written))
+			s.counter("splunk_logging_json_logs_dropped_total", "Messages dropped from the json-file log because its queue was full.", labels, atomic.LoadInt64(&q.dropped))
+		}
+		if l, ok := lf.splunkl.(interface {
+			collectMetrics(s *metricsSet, labels string)
+		}); ok {
+			l.collectMetrics(s, labels)
+		}
+	}
+	d.mu.Unlock()
+
+	for _, stats := range transports.stats() {
+		labels := metricLabel("host", stats.Host)
+		s.gauge("splunk_logging_transport_loggers", "Loggers sharing the HEC transport.", labels, float64(stats.Loggers))
+		s.gauge("splunk_logging_transport_connections", "Open connections of the HEC transport.", labels, float64(stats.ConnsOpen))
+		s.counter("splunk_logging_transport_connections_opened_total", "Connections opened by the HEC transport.", labels, stats.ConnsOpened)
+		s.counter("splunk_logging_transport_requests_total", "Requests sent by the HEC transport.", labels, stats.Requests)
+		s.counter("splunk_logging_transport_connections_reused_total", "Requests sent on a reused connection.", labels, stats.ConnsReused)
+		s.counter("splunk_logging_transport_dial_failures_total", "Failed attempts to connect to HEC.", labels, stats.DialFailures)
+		s.gauge("splunk_logging_transport_outstanding_requests", "Requests in flight to the HEC endpoint from all the loggers.", labels, float64(stats.Outstanding))
+		breakerOpen := 0.0
+		if stats.BreakerOpen {
+			breakerOpen = 1
+		}
+		s.gauge("splunk_logging_transport_breaker_open", "1 while the HEC endpoint is out of rotation.", labels, breakerOpen)
+		s.counter("splunk_logging_transport_breaker_trips_total", "Times the HEC endpoint was taken out of rotation.", labels, stats.BreakerTrips)
+		s.gauge("splunk_logging_transport_fair_queue_depth", "Batches waiting for SPLUNK_LOGGING_DRIVER_ENDPOINT_CONCURRENCY.", labels, float64(stats.FairWaiting))
+		s.counter("splunk_logging_transport_fair_queue_waits_total", "Batches which waited for SPLUNK_LOGGING_DRIVER_ENDPOINT_CONCURRENCY.", labels, stats.FairWaits)
+	}
+	s.gauge("splunk_logging_encoder_bytes", "Bytes held by encoded batches being sent.", "", float64(atomic.LoadInt64(&encoderBytesInFlight)))
+	s.gauge("splunk_logging_encoder_bytes_peak", "Highest number of bytes held by encoded batches being sent.", "", float64(atomic.LoadInt64(&encoderBytesPeak)))
+	s.gauge("splunk_logging_memory_budget_bytes", "Bytes all the loggers can hold, 0 means no limit.", "", float64(memory.limit))
+	s.gauge("splunk_logging_memory_used_bytes", "Bytes held by all the loggers.", "", float64(atomic.LoadInt64(&memory.used)))
+	s.gauge("splunk_logging_memory_used_bytes_peak", "Highest number of bytes held by all the loggers.", "", float64(atomic.LoadInt64(&memory.peak)))
+	s.counter("splunk_logging_memory_denied_total", "Messages and chunks which did not fit in the memory budget.", "", atomic.LoadInt64(&memory.denied))
+	s.gauge("splunk_logging_spools_bytes", "Bytes in the spools of all the containers, also of the containers without logger.", "", float64(atomic.LoadInt64(&spools.size)))
+	s.counter("splunk_logging_spool_orphaned_bytes_total", "Bytes removed with the spools no logger used for SPLUNK_LOGGING_DRIVER_SPOOL_ORPHAN_TIMEOUT.", "", atomic.LoadInt64(&spools.orphanedBytes))
+	for _, result := range []struct {
+		name  string
+		value *int64
+	}{
+		{"checked", &healthChecks.checked},
+		{"cached", &healthChecks.cached},
+		{"shared", &healthChecks.shared},
+	} {
+		s.counter("splunk_logging_verify_connection_total", "Endpoint verifications of splunk-verify-connection, by whether HEC was checked, the cached result was used or a check in flight was shared.", metricLabel("result", result.name), atomic.LoadInt64(result.value))
+	}
+	return s.write(w)
+}
+
+// collectMetrics adds the metrics of the logger of one container
+func (l *splunkLogger) collectMetrics(s *metricsSet, labels string) {
+	hec := l.hec
+	s.gauge("splunk_logging_stream_depth", "Messages waiting in the channel to the worker.", labels, float64(len(l.stream)))
+	s.gauge("splunk_logging_stream_capacity", "Capacity of the channel to the worker.", labels, float64(cap(l.stream)))
+	s.gauge("splunk_logging_buffered_messages", "Messages buffered by the worker, waiting to be sent or retried.", labels, float64(atomic.LoadInt64(&hec.bufferedMessages)))
+	s.histogram("splunk_logging_post_duration_seconds", "Latency of the requests to HEC.", labels, &hec.postLatency)
+	for code := range hec.postStatusCodes {
+		if count := atomic.LoadInt64(&hec.postStatusCodes[code]); count > 0 {
+			s.counter("splunk_logging_post_responses_total", "Responses from HEC by status code.", joinLabels(labels, metricLabel("code", strconv.Itoa(code))), count)
+		}
+	}
+	s.counter("splunk_logging_post_errors_total", "Requests to HEC which failed without a response.", labels, atomic.LoadInt64(&hec.postErrors))
+	s.counter("splunk_logging_post_failures_total", "Batches which were not accepted by HEC and are retried, spooled or dropped.", labels, atomic.LoadInt64(&hec.postFailures))
+	s.counter("splunk_logging_requests_total", "Batches posted to HEC.", labels, atomic.LoadInt64(&hec.requestsSent))
+	s.counter("splunk_logging_request_bytes_total", "Bytes posted to HEC, after compression.", labels, atomic.LoadInt64(&hec.requestBytesSent))
+	s.counter("splunk_logging_request_raw_bytes_total", "Bytes posted to HEC, before compression.", labels, atomic.LoadInt64(&hec.requestRawBytesSent))
+	if body := atomic.LoadInt64(&hec.requestBytesSent); body > 0 {
+		s.gauge("splunk_logging_gzip_ratio", "Bytes before compression divided by bytes posted.", labels, float64(atomic.LoadInt64(&hec.requestRawBytesSent))/float64(body))
+	}
+	if p := hec.gzip; p != nil {
+		s.gauge("splunk_logging_gzip_level", "Level the next batches are compressed with.", labels, float64(atomic.LoadInt64(&p.currentLevel)))
+		for i := range p.batches {
+			count := atomic.LoadInt64(&p.batches[i])
+			if count == 0 {
+				continue
+			}
+			level := i + gzip.DefaultCompression
+			levelLabels := joinLabels(labels, metricLabel("level", strconv.Itoa(level)))
+			s.counter("splunk_logging_gzip_batches_total", "Batches compressed, by level.", levelLabels, count)
+			if ratio := p.levelRatio(level); ratio > 0 {
+				s.gauge("splunk_logging_gzip_level_ratio", "Average compression ratio of the batches accepted by HEC, by level.", levelLabels, ratio)
+			}
+		}
+		s.counter("splunk_logging_gzip_skipped_batches_total", "Batches sent uncompressed, by reason.", joinLabels(labels, metricLabel("reason", "small")), atomic.LoadInt64(&p.skippedSmall))
+		s.counter("splunk_logging_gzip_skipped_batches_total", "Batches sent uncompressed, by reason.", joinLabels(labels, metricLabel("reason", "ratio")), atomic.LoadInt64(&p.skippedRatio))
+		s.counter("splunk_logging_gzip_level_changes_total", "Times splunk-gzip-level=auto changed the level.", labels, atomic.LoadInt64(&p.levelChanges))
+	}
+	s.counter("splunk_logging_dropped_messages_total", "Messages dropped, by reason.", joinLabels(labels, metricLabel("reason", "buffer_full")), atomic.LoadInt64(&hec.droppedMessages))
+	if b := l.backpressure; b != nil {
+		s.counter("splunk_logging_dropped_messages_total", "Messages dropped, by reason.", joinLabels(labels, metricLabel("reason", "backpressure")), atomic.LoadInt64(&b.dropped))
+		s.counter("splunk_logging_backpressure_overflowed_total", "Messages which found the channel to the worker full.", labels, atomic.LoadInt64(&b.overflowed))
+		s.counter("splunk_logging_backpressure_spilled_total", "Messages written to the spool because the channel to the worker was full.", labels, atomic.LoadInt64(&b.spilled))
+	}
+	s.counter("splunk_logging_dropped_messages_total", "Messages dropped, by reason.", joinLabels(labels, metricLabel("reason", "memory_budget")), atomic.LoadInt64(&l.memoryLimited.dropped))
+	s.counter("splunk_logging_memory_limited_total", "Messages which found the memory budget used up.", labels, atomic.LoadInt64(&l.memoryLimited.limited))
+	s.counter("splunk_logging_memory_spilled_total", "Messages over the memory budget written to the spool.", labels, atomic.LoadInt64(&l.memoryLimited.spilled))
+	if r := l.rateLimit; r != nil {
+		s.counter("splunk_logging_dropped_messages_total", "Messages dropped, by reason.", joinLabels(labels, metricLabel("reason", "rate_limit")), atomic.LoadInt64(&r.dropped))
+		s.counter("splunk_logging_rate_limited_total", "Messages over the rate limits of the container.", labels, atomic.LoadInt64(&r.limited))
+		s.counter("splunk_logging_rate_limit_delayed_total", "Messages which waited for the rate limits.", labels, atomic.LoadInt64(&r.delayed))
+		s.counter("splunk_logging_rate_limit_spilled_total", "Messages over the rate limits written to the spool.", labels, atomic.LoadInt64(&r.spilled))
+	}
+	if acks := hec.acks; acks != nil {
+		s.gauge("splunk_logging_ack_pending_batches", "Batches accepted by HEC and waiting for the acknowledgement of the indexers.", labels, float64(atomic.LoadInt64(&acks.pendingBatches)))
+		s.counter("splunk_logging_ack_acknowledged_batches_total", "Batches acknowledged by the indexers.", labels, atomic.LoadInt64(&acks.ackedBatches))
+		s.counter("splunk_logging_ack_resent_batches_total", "Batches sent again because they were not acknowledged in time.", labels, atomic.LoadInt64(&acks.resentBatches))
+	}
+	if sp := hec.spool; sp != nil {
+		sp.mu.Lock()
+		size := sp.size
+		sp.mu.Unlock()
+		s.gauge("splunk_logging_spool_bytes", "Bytes of batches in the spool.", labels, float64(size))
+		s.counter("splunk_logging_spool_batches_total", "Batches written to the spool.", labels, atomic.LoadInt64(&sp.spooledBatches))
+		s.counter("splunk_logging_spool_replayed_batches_total", "Spooled batches accepted by HEC.", labels, atomic.LoadInt64(&sp.replayedBatches))
+		s.counter("splunk_logging_spool_evicted_bytes_total", "Bytes removed from the full spool.", labels, atomic.LoadInt64(&sp.evictedBytes))
+	}
+}
+
+func metricsHandler(d *driver) http.HandlerFunc {
+	return func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Set("Content-Type", metricsContentType)
+		if err := d.writeMetrics(w); err != nil {
+			logrus.WithError(err).Debug("Cannot write metrics")
+		}
+	}
+}
+
+// serveMetrics exposes the metrics on a TCP address in addition to the plugin socket
+func serveMetrics(address string, d *driver) {
+	mux := http.NewServeMux()
+	mux.HandleFunc("/metrics", metricsHandler(d))
+	logrus.WithField("address", address).Info("Serving metrics")
+	if err := http.ListenAndServe(address, mux); err != nil {
+		logrus.WithError(err).Error("Cannot serve metrics")
+	}
+}
@@ -0,0 +1,68 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"testing"
+	"time"
+)
+
+func TestMetricsSet(t *testing.T) {
+	var h latencyHistogram
+	h.observe(3 * time.Millisecond)
+	h.observe(200 * time.Millisecond)
+	h.observe(time.Minute)
+
+	s := newMetricsSet()
+	s.counter("test_total", "Test counter.", metricLabel("container_id", "a"), 1)
+	s.gauge("test_gauge", "Test gauge.", "", 0.5)
+	s.counter("test_total", "Test counter.", metricLabel("container_id", `b"\`), 2)
+	s.histogram("test_seconds", "Test histogram.", metricLabel("container_id", "a"), &h)
+
+	var out bytes.Buffer
+	if err := s.write(&out); err != nil {
+		t.Fatal(err)
+	}
+	expected := `# HELP test_total Test counter.
+# TYPE test_total counter
+test_total{container_id="a"} 1
+test_total{container_id="b\"\\"} 2
+# HELP test_gauge Test gauge.
+# TYPE test_gauge gauge
+test_gauge 0.5
+# HELP test_seconds Test histogram.
+# TYPE test_seconds histogram
+test_seconds_bucket{container_id="a",le="0.005"} 1
+test_seconds_bucket{container_id="a",le="0.01"} 1
+test_seconds_bucket{container_id="a",le="0.025"} 1
+test_seconds_bucket{container_id="a",le="0.05"} 1
+test_seconds_bucket{container_id="a",le="0.1"} 1
+test_seconds_bucket{container_id="a",le="0.25"} 2
+test_seconds_bucket{container_id="a",le="0.5"} 2
+test_seconds_bucket{container_id="a",le="1"} 2
+test_seconds_bucket{container_id="a",le="2.5"} 2
+test_seconds_bucket{container_id="a",le="5"} 2
+test_seconds_bucket{container_id="a",le="10"} 2
+test_seconds_bucket{container_id="a",le="+Inf"} 3
+test_seconds_sum{container_id="a"} 60.203
+test_seconds_count{container_id="a"} 3
+`
+	if out.String() != expected {
+		t.Fatalf("Unexpected metrics\n%s", out.String())
+	}
+}
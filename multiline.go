@@ -0,0 +1,250 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"regexp"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// Maximum number of lines joined into one event
+	defaultMultilineMaxLines = 500
+	// Maximum size of an event, like a reassembled partial message
+	defaultMultilineMaxBytes = defaultPartialMsgBufferMaximum
+	// How long an event waits for its next line before it is sent
+	defaultMultilineTimeout = time.Second
+)
+
+// one wheel sends the idle multiline events of all the containers
+var multilineFlushWheel = newTimingWheel(partialFlushTick(defaultMultilineTimeout))
+
+type multilineEvent struct {
+	buf   []byte
+	lines int
+	// time of the first line, the time of the event
+	timestamp time.Time
+	partial   bool
+	// when the last line was added, for the idle timeout
+	last time.Time
+	// incremented on every flush, so a stale timer does not flush the next event
+	generation uint64
+	// bytes reserved from the memory budget for the event
+	reserved int
+}
+
+/*
+multilineAggregator joins the lines of a container into events, so a stack trace
+is sent to Splunk as one event instead of one event per line. With
+splunk-multiline-start a line matching the pattern starts a new event and the
+other lines are appended to the current one. With splunk-multiline-continue a line
+matching the pattern is appended and the other lines start a new event. Every
+stream has its own event. An event is sent when its next event starts, when it
+reaches splunk-multiline-max-lines or splunk-multiline-max-bytes, when no line
+was added for splunk-multiline-timeout, or when the logger is flushed or stopped.
+Lines go to the json-file log as they are.
+*/
+type multilineAggregator struct {
+	start        *regexp.Regexp
+	continuation *regexp.Regexp
+	maxLines     int
+	maxBytes     int
+	timeout      time.Duration
+
+	mu      sync.Mutex
+	streams map[string]*multilineEvent
+	emit    func(line []byte, source string, partial bool, timestamp time.Time)
+	memory  *memoryBudget
+
+	// updated atomically
+	lines  int64
+	events int64
+	split  int64
+}
+
+// newMultilineAggregator reads the multiline options of the container, it returns nil without a pattern
+func newMultilineAggregator(config map[string]string) (*multilineAggregator, error) {
+	m := &multilineAggregator{
+		maxLines: defaultMultilineMaxLines,
+		maxBytes: defaultMultilineMaxBytes,
+		timeout:  defaultMultilineTimeout,
+		streams:  make(map[string]*multilineEvent),
+		memory:   memory,
+	}
+	var err error
+	if pattern, ok := config[splunkMultilineStartKey]; ok {
+		if m.start, err = regexp.Compile(pattern); err != nil {
+			return nil, fmt.Errorf("%s: %s: %v", driverName, splunkMultilineStartKey, err)
+		}
+	}
+	if pattern, ok := config[splunkMultilineContinueKey]; ok {
+		if m.start != nil {
+			return nil, fmt.Errorf("%s: %s and %s cannot be used together", driverName, splunkMultilineStartKey, splunkMultilineContinueKey)
+		}
+		if m.continuation, err = regexp.Compile(pattern); err != nil {
+			return nil, fmt.Errorf("%s: %s: %v", driverName, splunkMultilineContinueKey, err)
+		}
+	}
+	if m.start == nil && m.continuation == nil {
+		for _, key := range []string{splunkMultilineMaxLinesKey, splunkMultilineMaxBytesKey, splunkMultilineTimeoutKey} {
+			if _, ok := config[key]; ok {
+				return nil, fmt.Errorf("%s: %s requires %s or %s", driverName, key, splunkMultilineStartKey, splunkMultilineContinueKey)
+			}
+		}
+		return nil, nil
+	}
+
+	if m.maxLines, err = multilineLimit(config, splunkMultilineMaxLinesKey, m.maxLines); err != nil {
+		return nil, err
+	}
+	if m.maxBytes, err = multilineLimit(config, splunkMultilineMaxBytesKey, m.maxBytes); err != nil {
+		return nil, err
+	}
+	if timeoutStr, ok := config[splunkMultilineTimeoutKey]; ok {
+		if m.timeout, err = time.ParseDuration(timeoutStr); err != nil {
+			return nil, err
+		}
+		if m.timeout <= 0 {
+			return nil, fmt.Errorf("%s: %s should be positive", driverName, splunkMultilineTimeoutKey)
+		}
+	}
+	return m, nil
+}
+
+func multilineLimit(config map[string]string, key string, defaultValue int) (int, error) {
+	valueStr, ok := config[key]
+	if !ok {
+		return defaultValue, nil
+	}
+	value, err := strconv.ParseInt(valueStr, 10, 32)
+	if err != nil {
+		return 0, err
+	}
+	if value < 1 {
+		return 0, fmt.Errorf("%s: %s should be at least 1", driverName, key)
+	}
+	return int(value), nil
+}
+
+// continues tells if the line belongs to the event before it
+func (m *multilineAggregator) continues(line []byte) bool {
+	if m.start != nil {
+		return !m.start.Match(line)
+	}
+	return m.continuation.Match(line)
+}
+
+// add appends the line to the event of its stream, the caller reuses the line
+func (m *multilineAggregator) add(line []byte, source string, partial bool, timestamp time.Time) {
+	m.mu.Lock()
+	defer m.mu.Unlock()
+	atomic.AddInt64(&m.lines, 1)
+	e, ok := m.streams[source]
+	if !ok {
+		e = &multilineEvent{}
+		m.streams[source] = e
+	}
+	if e.lines > 0 {
+		if !m.continues(line) {
+			m.flushLocked(source, e)
+		} else if len(e.buf)+1+len(line) > m.maxBytes {
+			// the line does not fit, the event is split
+			atomic.AddInt64(&m.split, 1)
+			m.flushLocked(source, e)
+		}
+	}
+	if !m.memory.reserve(len(line) + 1) {
+		// the memory budget is used up, send the lines right away instead of holding them
+		if e.lines > 0 {
+			m.flushLocked(source, e)
+		}
+		atomic.AddInt64(&m.events, 1)
+		m.emit(line, source, partial, timestamp)
+		return
+	}
+	e.reserved += len(line) + 1
+
+	now := time.Now()
+	if e.lines == 0 {
+		e.buf = getReassemblyBuffer(len(line))
+		e.timestamp = timestamp
+		m.schedule(source, e.generation, m.timeout)
+	} else {
+		e.buf = append(e.buf, '\n')
+	}
+	e.buf = append(e.buf, line...)
+	e.lines++
+	e.partial = partial
+	e.last = now
+	if e.lines >= m.maxLines || len(e.buf) >= m.maxBytes {
+		atomic.AddInt64(&m.split, 1)
+		m.flushLocked(source, e)
+	}
+}
+
+func (m *multilineAggregator) schedule(source string, generation uint64, delay time.Duration) {
+	multilineFlushWheel.schedule(delay, func() {
+		m.expire(source, generation)
+	})
+}
+
+// expire sends the event of the stream once it has been idle for the timeout
+func (m *multilineAggregator) expire(source string, generation uint64) {
+	m.mu.Lock()
+	defer m.mu.Unlock()
+	e, ok := m.streams[source]
+	if !ok || e.generation != generation || e.lines == 0 {
+		return
+	}
+	if idle := time.Since(e.last); idle < m.timeout {
+		m.schedule(source, generation, m.timeout-idle)
+		return
+	}
+	logrus.WithField("source", source).Debug("Multiline event timeout expired")
+	m.flushLocked(source, e)
+}
+
+// flushAll sends the events held by all the streams, it is called when the logger is flushed or stops
+func (m *multilineAggregator) flushAll() {
+	if m == nil {
+		return
+	}
+	m.mu.Lock()
+	defer m.mu.Unlock()
+	for source, e := range m.streams {
+		if e.lines > 0 {
+			m.flushLocked(source, e)
+		}
+	}
+}
+
+func (m *multilineAggregator) flushLocked(source string, e *multilineEvent) {
+	atomic.AddInt64(&m.events, 1)
+	m.emit(e.buf, source, e.partial, e.timestamp)
+	m.memory.release(e.reserved)
+	putReassemblyBuffer(e.buf)
+	e.buf = nil
+	e.lines = 0
+	e.reserved = 0
+	e.generation++
+}
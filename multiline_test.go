@@ -0,0 +1,170 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"testing"
+	"time"
+)
+
+func newTestMultilineAggregator(t *testing.T, config map[string]string, messages *reassembledMessages) *multilineAggregator {
+	m, err := newMultilineAggregator(config)
+	if err != nil {
+		t.Fatal(err)
+	}
+	m.emit = messages.emit
+	return m
+}
+
+func addLines(m *multilineAggregator, source string, lines ...string) {
+	for _, line := range lines {
+		m.add([]byte(line), source, false, time.Now())
+	}
+}
+
+// Verify that the lines after a line matching the start pattern are joined,
+// separately for stdout and stderr
+func TestMultilineStart(t *testing.T) {
+	var messages reassembledMessages
+	m := newTestMultilineAggregator(t, map[string]string{
+		splunkMultilineStartKey:   `^\d{4}-\d{2}-\d{2} `,
+		splunkMultilineTimeoutKey: "1h",
+	}, &messages)
+
+	addLines(m, "stdout", "2018-01-02 ERROR failed", "java.lang.NullPointerException")
+	addLines(m, "stderr", "2018-01-02 warning")
+	addLines(m, "stdout", "\tat Main.main(Main.java:3)", "2018-01-02 INFO next")
+
+	got := messages.get()
+	if len(got) != 1 || got[0] != (reassembledMessage{"2018-01-02 ERROR failed\njava.lang.NullPointerException\n\tat Main.main(Main.java:3)", "stdout", false}) {
+		t.Fatalf("Unexpected events %v", got)
+	}
+
+	m.flushAll()
+	if got = messages.get(); len(got) != 3 {
+		t.Fatalf("Expected the events left to be sent, got %v", got)
+	}
+	m.flushAll()
+	if len(messages.get()) != 3 || m.lines != 5 || m.events != 3 {
+		t.Fatal("Nothing should be sent when there is nothing left")
+	}
+}
+
+// Verify that lines matching the continuation pattern are joined to the line before them
+func TestMultilineContinue(t *testing.T) {
+	var messages reassembledMessages
+	m := newTestMultilineAggregator(t, map[string]string{
+		splunkMultilineContinueKey: `^(\s|Caused by:)`,
+		splunkMultilineTimeoutKey:  "1h",
+	}, &messages)
+
+	addLines(m, "stderr",
+		"Traceback (most recent call last):",
+		`  File "main.py", line 1, in <module>`,
+		"ValueError: bad",
+		"Caused by: nothing",
+		"done")
+	m.flushAll()
+
+	got := messages.get()
+	if len(got) != 3 ||
+		got[0].line != "Traceback (most recent call last):\n  File \"main.py\", line 1, in <module>" ||
+		got[1].line != "ValueError: bad\nCaused by: nothing" ||
+		got[2].line != "done" {
+		t.Fatalf("Unexpected events %v", got)
+	}
+}
+
+// Verify that events are split at the maximum number of lines and bytes
+func TestMultilineLimits(t *testing.T) {
+	var messages reassembledMessages
+	m := newTestMultilineAggregator(t, map[string]string{
+		splunkMultilineStartKey:    `^start`,
+		splunkMultilineMaxLinesKey: "3",
+		splunkMultilineMaxBytesKey: "20",
+		splunkMultilineTimeoutKey:  "1h",
+	}, &messages)
+
+	addLines(m, "stdout", "start", "a", "b", "c", "start", "0123456789", "0123456789")
+	m.flushAll()
+
+	got := messages.get()
+	if len(got) != 4 ||
+		got[0].line != "start\na\nb" ||
+		got[1].line != "c" ||
+		got[2].line != "start\n0123456789" ||
+		got[3].line != "0123456789" ||
+		m.split != 2 {
+		t.Fatalf("Unexpected events %v, %d split", got, m.split)
+	}
+}
+
+// Verify that an event is sent once no line was added for the timeout
+func TestMultilineTimeout(t *testing.T) {
+	var messages reassembledMessages
+	m := newTestMultilineAggregator(t, map[string]string{
+		splunkMultilineStartKey:   `^start`,
+		splunkMultilineTimeoutKey: "100ms",
+	}, &messages)
+
+	addLines(m, "stdout", "start", "a")
+	for i := 0; i < 500 && len(messages.get()) == 0; i++ {
+		time.Sleep(10 * time.Millisecond)
+	}
+	got := messages.get()
+	if len(got) != 1 || got[0].line != "start\na" {
+		t.Fatalf("Unexpected events %v", got)
+	}
+}
+
+// Verify that lines are sent as they come while the memory budget is used up
+func TestMultilineMemoryBudget(t *testing.T) {
+	defer useMemoryBudget(12)()
+	var messages reassembledMessages
+	m := newTestMultilineAggregator(t, map[string]string{
+		splunkMultilineStartKey:   `^start`,
+		splunkMultilineTimeoutKey: "1h",
+	}, &messages)
+
+	addLines(m, "stdout", "start", "tail", "more lines")
+	got := messages.get()
+	if len(got) != 2 || got[0].line != "start\ntail" || got[1].line != "more lines" {
+		t.Fatalf("Unexpected events %v", got)
+	}
+	if memory.used != 0 {
+		t.Fatalf("Expected the events to be released, %d still used", memory.used)
+	}
+}
+
+func TestMultilineOptions(t *testing.T) {
+	if m, err := newMultilineAggregator(map[string]string{}); err != nil || m != nil {
+		t.Fatal("Expected no aggregation without a pattern")
+	}
+	for _, config := range []map[string]string{
+		{splunkMultilineStartKey: "("},
+		{splunkMultilineContinueKey: "["},
+		{splunkMultilineStartKey: "^a", splunkMultilineContinueKey: "^b"},
+		{splunkMultilineMaxLinesKey: "10"},
+		{splunkMultilineStartKey: "^a", splunkMultilineMaxLinesKey: "0"},
+		{splunkMultilineStartKey: "^a", splunkMultilineMaxBytesKey: "many"},
+		{splunkMultilineStartKey: "^a", splunkMultilineTimeoutKey: "0s"},
+	} {
+		if _, err := newMultilineAggregator(config); err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+	}
+}
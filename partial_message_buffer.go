@@ -18,6 +18,7 @@ package main
 
 import (
 	"bytes"
+	"sync"
 	"time"
 
 	"github.com/Sirupsen/logrus"
@@ -27,32 +28,89 @@ import (
 var (
 	partialMsgBufferHoldDuration = getAdvancedOptionDuration(envVarPartialMsgBufferHoldDuration, defaultPartialMsgBufferHoldDuration)
 	partialMsgBufferMaximum      = getAdvancedOptionInt(envVarPartialMsgBufferMaximum, defaultPartialMsgBufferMaximum)
+	// one wheel flushes the expired partial messages of all the containers
+	partialFlushWheel = newTimingWheel(partialFlushTick(partialMsgBufferHoldDuration))
 )
 
+// Capacities of the pooled reassembly buffers, docker splits lines in 16kb chunks
+var reassemblyBufferClasses = [...]int{16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024}
+
+var reassemblyBufferPools [len(reassemblyBufferClasses)]sync.Pool
+
+// getReassemblyBuffer returns an empty buffer from the smallest class which fits size
+func getReassemblyBuffer(size int) []byte {
+	for i, class := range reassemblyBufferClasses {
+		if size <= class {
+			if buf, ok := reassemblyBufferPools[i].Get().([]byte); ok {
+				return buf[:0]
+			}
+			return make([]byte, 0, class)
+		}
+	}
+	return make([]byte, 0, size)
+}
+
+// putReassemblyBuffer returns the buffer to the largest class it can hold
+func putReassemblyBuffer(buf []byte) {
+	for i := len(reassemblyBufferClasses) - 1; i >= 0; i-- {
+		if cap(buf) >= reassemblyBufferClasses[i] {
+			if cap(buf) <= 2*reassemblyBufferClasses[i] {
+				reassemblyBufferPools[i].Put(buf[:0])
+			}
+			return
+		}
+	}
+}
+
+// partialFlushTick is the precision of the hold duration
+func partialFlushTick(holdDuration time.Duration) time.Duration {
+	tick := holdDuration / 20
+	if tick < 10*time.Millisecond {
+		tick = 10 * time.Millisecond
+	}
+	if tick > time.Second {
+		tick = time.Second
+	}
+	return tick
+}
+
 type partialMsgBuffer struct {
 	tBuf        bytes.Buffer
 	bufferTimer time.Time
 	bufferReset bool
+	// time of the last appended entry
+	timeNano int64
+	// incremented on every flush, so a stale timer does not flush the next message
+	generation uint64
+	// bytes reserved from the memory budget for the held message
+	reserved int
 }
 
+// append adds the chunk to the held message, the caller sends the held message
+// first when it should be flushed, so no chunk is ever dropped here
 func (b *partialMsgBuffer) append(l *logdriver.LogEntry) (err error) {
 	// Add msg to temp buffer and disable buffer reset flag
-	if !(b.shouldFlush(time.Now())){
-		ps, err := b.tBuf.Write(l.Line)
-		b.bufferReset = false
-		if err != nil {
-			logrus.WithError(err).WithField("Appending to Temp Buffer with size:", ps).Error(
-				"Error appending to temp buffer")
-			b.reset()
-			return err
-		}
+	if b.tBuf.Cap() == 0 {
+		// borrow the storage, it is returned to the pool on reset
+		b.tBuf = *bytes.NewBuffer(getReassemblyBuffer(len(l.Line)))
+	}
+	ps, err := b.tBuf.Write(l.Line)
+	b.bufferReset = false
+	if err != nil {
+		logrus.WithError(err).WithField("Appending to Temp Buffer with size:", ps).Error(
+			"Error appending to temp buffer")
+		b.reset()
+		return err
 	}
 	return nil
 }
 
 func (b *partialMsgBuffer) reset() {
 	if b.bufferReset {
-		b.tBuf.Reset()
+		if b.tBuf.Cap() > 0 {
+			putReassemblyBuffer(b.tBuf.Bytes())
+			b.tBuf = bytes.Buffer{}
+		}
 		b.bufferTimer = time.Now()
 		logrus.WithField("resetBufferTimer", b.bufferTimer).Debug("resetting buffer Timer")
 	}
@@ -74,3 +132,96 @@ func (b *partialMsgBuffer) shouldFlush(t time.Time) bool {
 	logrus.WithField("should flush", b.hasLengthExceeded() || b.hasHoldDurationExpired(t)).Debug("flush check")
 	return b.hasLengthExceeded() || b.hasHoldDurationExpired(t)
 }
+
+/*
+partialReassembler joins the partial entries docker splits long lines into. Every
+stream (stdout and stderr) has its own buffer, so chunks of the two never interleave.
+A message is sent when its last chunk arrives, when it gets over the maximum size,
+when the hold duration expires (even if no other entry arrives) or when the logger
+is stopped. While the memory budget is used up the chunks are sent as they come.
+*/
+type partialReassembler struct {
+	mu      sync.Mutex
+	streams map[string]*partialMsgBuffer
+	emit    func(line []byte, source string, partial bool, timestamp time.Time)
+	memory  *memoryBudget
+}
+
+func newPartialReassembler(emit func(line []byte, source string, partial bool, timestamp time.Time)) *partialReassembler {
+	return &partialReassembler{
+		streams: make(map[string]*partialMsgBuffer),
+		emit:    emit,
+		memory:  memory,
+	}
+}
+
+// add appends the entry to the buffer of its stream and sends the message if it is complete
+func (r *partialReassembler) add(entry *logdriver.LogEntry) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	b, ok := r.streams[entry.Source]
+	if !ok {
+		b = &partialMsgBuffer{}
+		r.streams[entry.Source] = b
+	}
+	now := time.Now()
+	if b.tBuf.Len() > 0 && b.shouldFlush(now) {
+		r.flushLocked(entry.Source, b, true)
+	}
+	if b.tBuf.Len() == 0 {
+		b.bufferTimer = now
+		if entry.Partial {
+			source := entry.Source
+			generation := b.generation
+			partialFlushWheel.schedule(partialMsgBufferHoldDuration, func() {
+				r.expire(source, generation)
+			})
+		}
+	}
+	if !r.memory.reserve(len(entry.Line)) {
+		// the memory budget is used up, send the chunks right away instead of holding them
+		if b.tBuf.Len() > 0 {
+			r.flushLocked(entry.Source, b, true)
+		}
+		r.emit(entry.Line, entry.Source, entry.Partial, time.Unix(0, entry.TimeNano))
+		return
+	}
+	b.reserved += len(entry.Line)
+	if err := b.append(entry); err != nil {
+		return
+	}
+	b.timeNano = entry.TimeNano
+	if !entry.Partial || b.hasLengthExceeded() {
+		r.flushLocked(entry.Source, b, entry.Partial)
+	}
+}
+
+// expire sends the message held by the stream if it is still the one the timer was set for
+func (r *partialReassembler) expire(source string, generation uint64) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	if b, ok := r.streams[source]; ok && b.generation == generation && b.tBuf.Len() > 0 {
+		logrus.WithField("source", source).Debug("Partial message hold duration expired")
+		r.flushLocked(source, b, true)
+	}
+}
+
+// flushAll sends the messages held by all the streams, it is called when the logger stops
+func (r *partialReassembler) flushAll() {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	for source, b := range r.streams {
+		if b.tBuf.Len() > 0 {
+			r.flushLocked(source, b, true)
+		}
+	}
+}
+
+func (r *partialReassembler) flushLocked(source string, b *partialMsgBuffer, partial bool) {
+	r.emit(b.tBuf.Bytes(), source, partial, time.Unix(0, b.timeNano))
+	r.memory.release(b.reserved)
+	b.reserved = 0
+	b.generation++
+	b.bufferReset = true
+	b.reset()
+}
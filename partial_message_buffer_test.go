@@ -2,6 +2,7 @@ package main
 
 import (
 	"os"
+	"sync"
 	"testing"
 	"time"
 
@@ -48,6 +49,13 @@ func TestAppend(t *testing.T) {
 	if buf.bufferReset {
 		t.Fatal("bufferReset should be false")
 	}
+
+	// the caller flushes the expired message, the chunk is never dropped
+	buf.bufferTimer = time.Now().Add(-2 * partialMsgBufferHoldDuration)
+	buf.append(entry)
+	if buf.tBuf.Len() != length2+len(entry.Line) {
+		t.Fatal("append to partialMsgBuffer failed after the hold duration expired")
+	}
 }
 
 func TestReset(t *testing.T) {
@@ -203,3 +211,85 @@ func TestHasLengthExceeded(t *testing.T) {
 	}
 
 }
+
+type reassembledMessage struct {
+	line    string
+	source  string
+	partial bool
+}
+
+type reassembledMessages struct {
+	lock     sync.Mutex
+	messages []reassembledMessage
+}
+
+func (m *reassembledMessages) emit(line []byte, source string, partial bool, timestamp time.Time) {
+	m.lock.Lock()
+	defer m.lock.Unlock()
+	m.messages = append(m.messages, reassembledMessage{string(line), source, partial})
+}
+
+func (m *reassembledMessages) get() []reassembledMessage {
+	m.lock.Lock()
+	defer m.lock.Unlock()
+	return append([]reassembledMessage(nil), m.messages...)
+}
+
+// Verify that chunks of stdout and stderr are joined separately
+// and that what is left is sent when the logger stops
+func TestPartialReassembler(t *testing.T) {
+	partialMsgBufferHoldDuration = time.Hour
+	partialMsgBufferMaximum = defaultPartialMsgBufferMaximum
+	defer func() {
+		partialMsgBufferHoldDuration = defaultPartialMsgBufferHoldDuration
+	}()
+
+	var messages reassembledMessages
+	r := newPartialReassembler(messages.emit)
+	for _, entry := range []*logdriver.LogEntry{
+		{Source: "stdout", Line: []byte("out1 "), Partial: true},
+		{Source: "stderr", Line: []byte("err1 "), Partial: true},
+		{Source: "stdout", Line: []byte("out2"), Partial: false},
+		{Source: "stderr", Line: []byte("err2"), Partial: true},
+	} {
+		r.add(entry)
+	}
+
+	got := messages.get()
+	if len(got) != 1 || got[0] != (reassembledMessage{"out1 out2", "stdout", false}) {
+		t.Fatalf("Unexpected messages %v", got)
+	}
+
+	r.flushAll()
+	got = messages.get()
+	if len(got) != 2 || got[1] != (reassembledMessage{"err1 err2", "stderr", true}) {
+		t.Fatalf("Unexpected messages %v", got)
+	}
+
+	r.flushAll()
+	if len(messages.get()) != 2 {
+		t.Fatal("Nothing should be sent when there is nothing left")
+	}
+}
+
+// Verify that a partial message is sent when the hold duration expires,
+// even if no other entry arrives
+func TestPartialReassemblerHoldDuration(t *testing.T) {
+	partialMsgBufferHoldDuration = 20 * time.Millisecond
+	partialMsgBufferMaximum = defaultPartialMsgBufferMaximum
+	defer func() {
+		partialMsgBufferHoldDuration = defaultPartialMsgBufferHoldDuration
+	}()
+
+	var messages reassembledMessages
+	r := newPartialReassembler(messages.emit)
+	r.add(&logdriver.LogEntry{Source: "stdout", Line: []byte("trailing"), Partial: true})
+
+	for i := 0; i < 200 && len(messages.get()) == 0; i++ {
+		time.Sleep(10 * time.Millisecond)
+	}
+	got := messages.get()
+	if len(got) != 1 || got[0] != (reassembledMessage{"trailing", "stdout", true}) {
+		t.Fatalf("Unexpected messages %v", got)
+	}
+}
@@ -0,0 +1,194 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"os"
+	"strconv"
+	"sync"
+	"time"
+)
+
+const (
+	// How long a container can log above its rate, at the rate
+	defaultRateLimitBurst = time.Second
+)
+
+const (
+	envVarRateLimitEvents = "SPLUNK_LOGGING_DRIVER_RATE_LIMIT_EVENTS"
+	envVarRateLimitBytes  = "SPLUNK_LOGGING_DRIVER_RATE_LIMIT_BYTES"
+	envVarRateLimitBurst  = "SPLUNK_LOGGING_DRIVER_RATE_LIMIT_BURST"
+)
+
+// tokenBucket refills at rate tokens per second up to burst tokens
+type tokenBucket struct {
+	rate   float64
+	burst  float64
+	tokens float64
+	last   time.Time
+}
+
+func newTokenBucket(rate float64, burst time.Duration, now time.Time) *tokenBucket {
+	size := rate * burst.Seconds()
+	if size < 1 {
+		size = 1
+	}
+	return &tokenBucket{rate: rate, burst: size, tokens: size, last: now}
+}
+
+func (b *tokenBucket) refill(now time.Time) {
+	if elapsed := now.Sub(b.last).Seconds(); elapsed > 0 {
+		b.tokens += elapsed * b.rate
+		if b.tokens > b.burst {
+			b.tokens = b.burst
+		}
+	}
+	b.last = now
+}
+
+// wait returns how long until n tokens are available, a message bigger than
+// the bucket only waits for a full bucket
+func (b *tokenBucket) wait(n float64) time.Duration {
+	if n > b.burst {
+		n = b.burst
+	}
+	if b.tokens >= n {
+		return 0
+	}
+	return time.Duration((n - b.tokens) / b.rate * float64(time.Second))
+}
+
+/*
+rateLimiter keeps a container under splunk-rate-limit-events events and
+splunk-rate-limit-bytes bytes per second. A container can go over its rates for
+splunk-rate-limit-burst, then the messages over the limits go through the
+splunk-backpressure policy of the container.
+*/
+type rateLimiter struct {
+	mu     sync.Mutex
+	events *tokenBucket
+	bytes  *tokenBucket
+
+	limitCounters
+}
+
+// newRateLimiter reads the limits of the container, it returns nil without limits
+func newRateLimiter(config map[string]string) (*rateLimiter, error) {
+	eventsRate, err := rateLimitOption(config, splunkRateLimitEventsKey, envVarRateLimitEvents)
+	if err != nil {
+		return nil, err
+	}
+	bytesRate, err := rateLimitOption(config, splunkRateLimitBytesKey, envVarRateLimitBytes)
+	if err != nil {
+		return nil, err
+	}
+	burst := getAdvancedOptionDuration(envVarRateLimitBurst, defaultRateLimitBurst)
+	if burstStr, ok := config[splunkRateLimitBurstKey]; ok {
+		if burst, err = time.ParseDuration(burstStr); err != nil {
+			return nil, err
+		}
+	}
+	if burst <= 0 {
+		return nil, fmt.Errorf("%s: %s should be positive", driverName, splunkRateLimitBurstKey)
+	}
+	if eventsRate == 0 && bytesRate == 0 {
+		return nil, nil
+	}
+
+	r := &rateLimiter{}
+	now := time.Now()
+	if eventsRate > 0 {
+		r.events = newTokenBucket(eventsRate, burst, now)
+	}
+	if bytesRate > 0 {
+		r.bytes = newTokenBucket(bytesRate, burst, now)
+	}
+	return r, nil
+}
+
+// rateLimitOption reads a rate from the log-opt, or from the plugin-wide default, 0 means no limit
+func rateLimitOption(config map[string]string, key string, envVar string) (float64, error) {
+	rateStr, ok := config[key]
+	if !ok {
+		if rateStr = os.Getenv(envVar); rateStr == "" {
+			return 0, nil
+		}
+	}
+	rate, err := strconv.ParseFloat(rateStr, 64)
+	if err != nil {
+		return 0, err
+	}
+	if rate < 0 {
+		return 0, fmt.Errorf("%s: %s should not be negative", driverName, key)
+	}
+	return rate, nil
+}
+
+// take uses the tokens of a message of size bytes when both buckets have them,
+// otherwise it returns how long until they would
+func (r *rateLimiter) take(size int, now time.Time) time.Duration {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	var wait time.Duration
+	if r.events != nil {
+		r.events.refill(now)
+		wait = r.events.wait(1)
+	}
+	if r.bytes != nil {
+		r.bytes.refill(now)
+		if bytesWait := r.bytes.wait(float64(size)); bytesWait > wait {
+			wait = bytesWait
+		}
+	}
+	if wait > 0 {
+		return wait
+	}
+	if r.events != nil {
+		r.events.tokens--
+	}
+	if r.bytes != nil {
+		// a message bigger than the bucket leaves it in debt
+		r.bytes.tokens -= float64(size)
+	}
+	return 0
+}
+
+// limit returns true when the message can be queued, see backpressure.overLimit
+func (r *rateLimiter) limit(l *splunkLogger, message *splunkMessage) (bool, error) {
+	if r.take(len(message.payload), time.Now()) == 0 {
+		return true, nil
+	}
+	return l.backpressure.overLimit(l, message, r, &r.limitCounters, "Container is over its rate limit")
+}
+
+// wait blocks until the tokens of the message are taken, it returns false when stop is closed first
+func (r *rateLimiter) wait(size int, stop <-chan struct{}) bool {
+	for wait := r.take(size, time.Now()); wait > 0; wait = r.take(size, time.Now()) {
+		timer := time.NewTimer(wait)
+		select {
+		case <-timer.C:
+		case <-stop:
+			timer.Stop()
+			return false
+		}
+	}
+	return true
+}
+
+// force lets a message go over the rates, the tokens are not taken
+func (r *rateLimiter) force(size int) {}
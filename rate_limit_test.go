@@ -0,0 +1,166 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bytes"
+	"io/ioutil"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+func TestRateLimiterBuckets(t *testing.T) {
+	r, err := newRateLimiter(map[string]string{
+		splunkRateLimitEventsKey: "10",
+		splunkRateLimitBytesKey:  "1000",
+		splunkRateLimitBurstKey:  "1s",
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	now := r.events.last
+
+	for i := 0; i < 10; i++ {
+		if wait := r.take(10, now); wait != 0 {
+			t.Fatalf("Expected the burst to allow message %d, waiting %v", i, wait)
+		}
+	}
+	if wait := r.take(10, now); wait != 100*time.Millisecond {
+		t.Fatalf("Expected to wait for one event, got %v", wait)
+	}
+	now = now.Add(100 * time.Millisecond)
+	if wait := r.take(10, now); wait != 0 {
+		t.Fatalf("Expected the event bucket to refill, waiting %v", wait)
+	}
+
+	// a message bigger than the bucket waits for a full bucket and leaves it in debt
+	now = now.Add(time.Second)
+	if wait := r.take(5000, now); wait != 0 {
+		t.Fatalf("Expected a big message to go with a full bucket, waiting %v", wait)
+	}
+	if wait := r.take(10, now.Add(time.Second)); wait < 3009*time.Millisecond || wait > 3011*time.Millisecond {
+		t.Fatalf("Expected to wait for the debt, got %v", wait)
+	}
+}
+
+func TestRateLimiterOptions(t *testing.T) {
+	if r, err := newRateLimiter(map[string]string{}); err != nil || r != nil {
+		t.Fatal("Expected no limiter without limits")
+	}
+
+	if err := os.Setenv(envVarRateLimitBytes, "2048"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarRateLimitBytes, "")
+	r, err := newRateLimiter(map[string]string{})
+	if err != nil || r == nil || r.events != nil || r.bytes.rate != 2048 {
+		t.Fatal("Expected the plugin-wide bytes limit")
+	}
+	if r, err := newRateLimiter(map[string]string{splunkRateLimitBytesKey: "0"}); err != nil || r != nil {
+		t.Fatal("Expected the log-opt to remove the plugin-wide limit")
+	}
+
+	for _, config := range []map[string]string{
+		{splunkRateLimitEventsKey: "many"},
+		{splunkRateLimitEventsKey: "-1"},
+		{splunkRateLimitBurstKey: "0s"},
+		{splunkWeightKey: "0"},
+	} {
+		_, err := newRateLimiter(config)
+		if err == nil {
+			_, err = parseWeight(config)
+		}
+		if err == nil {
+			t.Fatalf("Expected error for %v", config)
+		}
+	}
+}
+
+// Verify that messages over the limit follow the backpressure policy of the container
+func TestRateLimitDrop(t *testing.T) {
+	var events int64
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		body, _ := ioutil.ReadAll(r.Body)
+		atomic.AddInt64(&events, int64(bytes.Count(body, []byte(`"event"`))))
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	// a burst of one message, the next one comes in 1000s
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:             hec.URL,
+		splunkRateLimitEventsKey: "0.001",
+		splunkBackpressureKey:    backpressureDropNewest,
+	})
+	for i := 0; i < 20; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte("line"), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	r := loggerDriver.(*splunkLoggerInline).rateLimit
+	if events := atomic.LoadInt64(&events); events != 1 || r.limited != 19 || r.dropped != 19 {
+		t.Fatalf("Expected one message over a burst of one, got %d events, %d limited, %d dropped", events, r.limited, r.dropped)
+	}
+}
+
+// Verify that with block the container waits for its tokens
+func TestRateLimitBlock(t *testing.T) {
+	var lock sync.Mutex
+	var events int64
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		body, _ := ioutil.ReadAll(r.Body)
+		lock.Lock()
+		events += int64(bytes.Count(body, []byte(`"event"`)))
+		lock.Unlock()
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	loggerDriver := newEndpointsTestLogger(t, map[string]string{
+		splunkURLKey:             hec.URL,
+		splunkRateLimitEventsKey: "100",
+		splunkRateLimitBurstKey:  "10ms",
+	})
+	start := time.Now()
+	for i := 0; i < 11; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte("line"), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if elapsed := time.Since(start); elapsed < 90*time.Millisecond {
+		t.Fatalf("Expected 10 messages over the burst to take 100ms at 100 events/s, took %v", elapsed)
+	}
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+	r := loggerDriver.(*splunkLoggerInline).rateLimit
+	lock.Lock()
+	defer lock.Unlock()
+	if events != 11 || r.dropped != 0 || r.delayed != 10 {
+		t.Fatalf("Expected every message to wait and be sent, got %d events, %d delayed", events, r.delayed)
+	}
+}
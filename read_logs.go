@@ -0,0 +1,294 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/binary"
+	"encoding/json"
+	"io"
+	"os"
+	"sort"
+	"sync"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+	"github.com/docker/docker/api/types/plugins/logdriver"
+	"github.com/docker/docker/daemon/logger"
+	protoio "github.com/gogo/protobuf/io"
+)
+
+const (
+	// Bytes of messages written to the json-file log between two entries of its index, 0 disables the index
+	defaultJSONLogsIndexInterval = 1024 * 1024
+	// Size of the writes of ReadLogs to docker
+	readLogsBufferSize = 64 * 1024
+)
+
+const (
+	envVarJSONLogsIndexInterval = "SPLUNK_LOGGING_DRIVER_JSON_LOGS_INDEX_INTERVAL"
+)
+
+type logIndexEntry struct {
+	// offset of the end of a message in the file
+	offset int64
+	// messages written up to offset
+	lines int64
+	// latest timestamp of the messages up to offset, in nanoseconds
+	maxTime int64
+}
+
+/*
+logIndex maps the timestamps and the number of messages of the json-file log of a
+container to offsets in the file, so `docker logs --since` and `--tail` seek close
+to the first message they return instead of reading the whole file. An entry is
+added every SPLUNK_LOGGING_DRIVER_JSON_LOGS_INDEX_INTERVAL bytes of messages, with
+the size of the file once the message is written. The index only covers what was
+written since the logger started, the file is read from the start for older
+messages.
+*/
+type logIndex struct {
+	path     string
+	interval int
+
+	mu sync.Mutex
+	// size of the file when the logger started
+	base    int64
+	entries []logIndexEntry
+	lines   int64
+	maxTime int64
+	// bytes of messages since the last entry
+	pending int
+}
+
+// newLogIndex returns nil when the index is disabled
+func newLogIndex(path string) *logIndex {
+	interval := getAdvancedOptionInt(envVarJSONLogsIndexInterval, defaultJSONLogsIndexInterval)
+	if interval <= 0 {
+		return nil
+	}
+	idx := &logIndex{path: path, interval: interval}
+	if info, err := os.Stat(path); err == nil {
+		idx.base = info.Size()
+	}
+	return idx
+}
+
+// written is called once the messages are in the file, with their size and their newest timestamp
+func (idx *logIndex) written(lines int, size int, maxTime time.Time) {
+	idx.mu.Lock()
+	defer idx.mu.Unlock()
+	idx.lines += int64(lines)
+	if t := maxTime.UnixNano(); t > idx.maxTime {
+		idx.maxTime = t
+	}
+	if idx.pending += size; idx.pending < idx.interval {
+		return
+	}
+	info, err := os.Stat(idx.path)
+	if err != nil {
+		logrus.WithField("path", idx.path).WithError(err).Debug("Cannot index the json-file log")
+		return
+	}
+	idx.entries = append(idx.entries, logIndexEntry{offset: info.Size(), lines: idx.lines, maxTime: idx.maxTime})
+	idx.pending = 0
+}
+
+// seek returns an offset before the first message returned with config
+func (idx *logIndex) seek(config logger.ReadConfig) int64 {
+	idx.mu.Lock()
+	defer idx.mu.Unlock()
+	return idx.seekLocked(config)
+}
+
+func (idx *logIndex) seekLocked(config logger.ReadConfig) int64 {
+	var offset int64
+	if !config.Since.IsZero() {
+		since := config.Since.UnixNano()
+		// every message before the entry is older than since
+		i := sort.Search(len(idx.entries), func(i int) bool { return idx.entries[i].maxTime >= since })
+		if i > 0 {
+			offset = idx.entries[i-1].offset
+		}
+	}
+	if config.Tail > 0 && int64(config.Tail) <= idx.lines {
+		// at least config.Tail messages after the entry
+		i := sort.Search(len(idx.entries), func(i int) bool { return idx.entries[i].lines > idx.lines-int64(config.Tail) })
+		tailOffset := idx.base
+		if i > 0 {
+			tailOffset = idx.entries[i-1].offset
+		}
+		if tailOffset > offset {
+			offset = tailOffset
+		}
+	}
+	return offset
+}
+
+// jsonFileEntry is a line of the json-file log
+type jsonFileEntry struct {
+	Log    string    `json:"log"`
+	Stream string    `json:"stream"`
+	Time   time.Time `json:"time"`
+}
+
+// read writes the messages of the json-file log selected by config to w as logdriver.LogEntry frames
+func (idx *logIndex) read(config logger.ReadConfig, w io.Writer) error {
+	if config.Tail == 0 {
+		return nil
+	}
+	f, err := os.Open(idx.path)
+	if err != nil {
+		if os.IsNotExist(err) {
+			return nil
+		}
+		return err
+	}
+	defer f.Close()
+	// the file is measured and the index read at once, so the index does not count
+	// messages written after size: a tail would return fewer lines
+	idx.mu.Lock()
+	info, err := f.Stat()
+	if err != nil {
+		idx.mu.Unlock()
+		return err
+	}
+	// messages written from now on are not returned, like with the json-file reader
+	size := info.Size()
+	offset := idx.seekLocked(config)
+	idx.mu.Unlock()
+	// the file was rotated
+	if offset > size {
+		offset = 0
+	}
+	if config.Tail > 0 {
+		if offset, err = tailOffset(f, offset, size, config.Tail); err != nil {
+			return err
+		}
+	}
+
+	bw := bufio.NewWriterSize(w, readLogsBufferSize)
+	enc := protoio.NewUint32DelimitedWriter(bw, binary.BigEndian)
+	dec := json.NewDecoder(io.NewSectionReader(f, offset, size-offset))
+	var buf logdriver.LogEntry
+	for {
+		var line jsonFileEntry
+		if err := dec.Decode(&line); err != nil {
+			// the last message can be cut while it is written
+			if err == io.EOF || err == io.ErrUnexpectedEOF {
+				break
+			}
+			return err
+		}
+		if !config.Since.IsZero() && line.Time.Before(config.Since) {
+			continue
+		}
+		buf.Line = []byte(line.Log)
+		buf.Source = line.Stream
+		buf.TimeNano = line.Time.UnixNano()
+		if err := enc.WriteMsg(&buf); err != nil {
+			return err
+		}
+		buf.Reset()
+	}
+	return bw.Flush()
+}
+
+// tailOffset returns the offset of the last tail lines between offset and size
+func tailOffset(f *os.File, offset int64, size int64, tail int) (int64, error) {
+	chunk := make([]byte, readLogsBufferSize)
+	var lines int64
+	if err := scanLines(f, offset, size, chunk, func(b []byte) bool {
+		lines += int64(bytes.Count(b, []byte{'\n'}))
+		return true
+	}); err != nil {
+		return 0, err
+	}
+	skip := lines - int64(tail)
+	if skip <= 0 {
+		return offset, nil
+	}
+	start := offset
+	err := scanLines(f, offset, size, chunk, func(b []byte) bool {
+		for skip > 0 {
+			i := bytes.IndexByte(b, '\n')
+			if i < 0 {
+				start += int64(len(b))
+				return true
+			}
+			start += int64(i + 1)
+			b = b[i+1:]
+			skip--
+		}
+		return false
+	})
+	return start, err
+}
+
+// scanLines calls fn with the bytes of the file between offset and size, until it returns false
+func scanLines(f *os.File, offset int64, size int64, chunk []byte, fn func(b []byte) bool) error {
+	r := io.NewSectionReader(f, offset, size-offset)
+	for {
+		n, err := r.Read(chunk)
+		if n > 0 && !fn(chunk[:n]) {
+			return nil
+		}
+		if err == io.EOF {
+			return nil
+		}
+		if err != nil {
+			return err
+		}
+	}
+}
+
+// followLogs writes the messages of the watcher to w as logdriver.LogEntry frames, the
+// frames are flushed to docker once the watcher has no message ready
+func followLogs(watcher *logger.LogWatcher, w io.Writer) error {
+	defer watcher.Close()
+	bw := bufio.NewWriterSize(w, readLogsBufferSize)
+	enc := protoio.NewUint32DelimitedWriter(bw, binary.BigEndian)
+	var buf logdriver.LogEntry
+	for {
+		select {
+		case msg, ok := <-watcher.Msg:
+			if !ok {
+				return bw.Flush()
+			}
+
+			buf.Line = msg.Line
+			buf.Partial = msg.Partial
+			buf.TimeNano = msg.Timestamp.UnixNano()
+			buf.Source = msg.Source
+
+			if err := enc.WriteMsg(&buf); err != nil {
+				return err
+			}
+			if len(watcher.Msg) == 0 {
+				if err := bw.Flush(); err != nil {
+					return err
+				}
+			}
+		case err := <-watcher.Err:
+			bw.Flush()
+			return err
+		}
+
+		buf.Reset()
+	}
+}
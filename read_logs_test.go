@@ -0,0 +1,176 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"encoding/binary"
+	"encoding/json"
+	"fmt"
+	"io"
+	"io/ioutil"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+
+	"github.com/docker/docker/api/types/plugins/logdriver"
+	"github.com/docker/docker/daemon/logger"
+	protoio "github.com/gogo/protobuf/io"
+)
+
+// fileLogger writes the messages in the format of the json-file logger
+type fileLogger struct {
+	f *os.File
+}
+
+func (l *fileLogger) Log(msg *logger.Message) error {
+	line, err := json.Marshal(jsonFileEntry{Log: string(msg.Line) + "\n", Stream: msg.Source, Time: msg.Timestamp})
+	if err != nil {
+		return err
+	}
+	_, err = l.f.Write(append(line, '\n'))
+	return err
+}
+
+func (l *fileLogger) Name() string { return "file" }
+func (l *fileLogger) Close() error { return l.f.Close() }
+
+// readFrames returns the lines of the frames written by ReadLogs
+func readFrames(t *testing.T, r io.Reader) []string {
+	dec := protoio.NewUint32DelimitedReader(r, binary.BigEndian, 1e6)
+	var lines []string
+	for {
+		var entry logdriver.LogEntry
+		if err := dec.ReadMsg(&entry); err != nil {
+			if err == io.EOF {
+				return lines
+			}
+			t.Fatal(err)
+		}
+		lines = append(lines, string(entry.Line))
+	}
+}
+
+func logLines(lines ...int) []string {
+	var expected []string
+	for _, i := range lines {
+		expected = append(expected, fmt.Sprintf("line %d\n", i))
+	}
+	return expected
+}
+
+func lineRange(from int, to int) []int {
+	var lines []int
+	for i := from; i < to; i++ {
+		lines = append(lines, i)
+	}
+	return lines
+}
+
+// Verify that --since and --tail seek with the index and return what the json-file reader would
+func TestReadLogsIndex(t *testing.T) {
+	dir, err := ioutil.TempDir("", "read-logs")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+	if err := os.Setenv(envVarJSONLogsIndexInterval, "100"); err != nil {
+		t.Fatal(err)
+	}
+	defer os.Setenv(envVarJSONLogsIndexInterval, "")
+
+	path := filepath.Join(dir, "containeriid-json.log")
+	f, err := os.OpenFile(path, os.O_CREATE|os.O_WRONLY|os.O_APPEND, 0640)
+	if err != nil {
+		t.Fatal(err)
+	}
+	l := &fileLogger{f}
+	start := time.Date(2018, 3, 1, 10, 0, 0, 0, time.UTC)
+	// written before the logger started, not in the index
+	for i := 0; i < 50; i++ {
+		l.Log(&logger.Message{Line: []byte(fmt.Sprintf("line %d", i)), Source: "stdout", Timestamp: start.Add(time.Duration(i) * time.Second)})
+	}
+
+	q, err := newLogQueue(l, map[string]string{}, "containeriid", newLogIndex(path))
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i := 50; i < 1000; i++ {
+		q.log([]byte(fmt.Sprintf("line %d", i)), "stdout", false, start.Add(time.Duration(i)*time.Second))
+	}
+	q.Close()
+	// a message being written
+	f.Write([]byte(`{"log":"line 1000\n","stream":"stdout","ti`))
+
+	d := newDriver()
+	d.idx["containeriid"] = &logPair{jsonl: l, jsonq: q, info: logger.Info{ContainerID: "containeriid"}}
+
+	for _, test := range []struct {
+		name     string
+		config   logger.ReadConfig
+		expected []int
+		seek     bool
+	}{
+		{"all", logger.ReadConfig{Tail: -1}, lineRange(0, 1000), false},
+		{"none", logger.ReadConfig{Tail: 0}, nil, false},
+		{"tail", logger.ReadConfig{Tail: 10}, lineRange(990, 1000), true},
+		{"tail over the index", logger.ReadConfig{Tail: 980}, lineRange(20, 1000), false},
+		{"since", logger.ReadConfig{Tail: -1, Since: start.Add(995 * time.Second)}, lineRange(995, 1000), true},
+		{"since before the index", logger.ReadConfig{Tail: -1, Since: start.Add(10 * time.Second)}, lineRange(10, 1000), false},
+		{"since and tail", logger.ReadConfig{Tail: 3, Since: start.Add(998 * time.Second)}, lineRange(998, 1000), true},
+	} {
+		if seek := q.index.seek(test.config) > 0; seek != test.seek {
+			t.Fatalf("%s: expected seek %v", test.name, test.seek)
+		}
+		r, err := d.ReadLogs(logger.Info{ContainerID: "containeriid"}, test.config)
+		if err != nil {
+			t.Fatal(err)
+		}
+		lines := readFrames(t, r)
+		r.Close()
+		expected := logLines(test.expected...)
+		if len(lines) != len(expected) {
+			t.Fatalf("%s: expected %d lines, got %d", test.name, len(expected), len(lines))
+		}
+		for i := range lines {
+			if lines[i] != expected[i] {
+				t.Fatalf("%s: expected %q, got %q", test.name, expected[i], lines[i])
+			}
+		}
+	}
+}
+
+// Verify that following the json-file reader sends every message
+func TestFollowLogs(t *testing.T) {
+	watcher := logger.NewLogWatcher()
+	go func() {
+		for i := 0; i < 100; i++ {
+			watcher.Msg <- &logger.Message{Line: []byte(fmt.Sprintf("line %d\n", i)), Source: "stdout", Timestamp: time.Now()}
+		}
+		close(watcher.Msg)
+	}()
+
+	r, w := io.Pipe()
+	go func() {
+		w.CloseWithError(followLogs(watcher, w))
+	}()
+	lines := readFrames(t, r)
+	expected := logLines(lineRange(0, 100)...)
+	if len(lines) != len(expected) || lines[0] != expected[0] || lines[99] != expected[99] {
+		t.Fatalf("Unexpected lines %v", lines)
+	}
+}
@@ -19,17 +19,13 @@ package main
 import (
 	"bytes"
 	"compress/gzip"
-	"crypto/tls"
-	"crypto/x509"
-	"encoding/json"
 	"fmt"
-	"io/ioutil"
-	"net/http"
 	"net/url"
 	"os"
 	"strconv"
 	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"github.com/Sirupsen/logrus"
@@ -51,8 +47,36 @@ const (
 	splunkInsecureSkipVerifyKey   = "splunk-insecureskipverify"
 	splunkFormatKey               = "splunk-format"
 	splunkVerifyConnectionKey     = "splunk-verify-connection"
+	splunkVerifyDeadlineKey       = "splunk-verify-connection-deadline"
 	splunkGzipCompressionKey      = "splunk-gzip"
 	splunkGzipCompressionLevelKey = "splunk-gzip-level"
+	splunkGzipMinLevelKey         = "splunk-gzip-min-level"
+	splunkGzipMaxLevelKey         = "splunk-gzip-max-level"
+	splunkGzipMinBytesKey         = "splunk-gzip-min-bytes"
+	splunkGzipMinRatioKey         = "splunk-gzip-min-ratio"
+	splunkBackpressureKey         = "splunk-backpressure"
+	splunkBackpressureSampleKey   = "splunk-backpressure-sample"
+	splunkIndexerAckKey           = "splunk-indexer-ack"
+	splunkLoadBalanceKey          = "splunk-load-balance"
+	splunkRawEndpointKey          = "splunk-raw-endpoint"
+	splunkJSONLogsKey             = "splunk-json-logs"
+	splunkJSONLogsBackpressureKey = "splunk-json-logs-backpressure"
+	splunkRateLimitEventsKey      = "splunk-rate-limit-events"
+	splunkRateLimitBytesKey       = "splunk-rate-limit-bytes"
+	splunkRateLimitBurstKey       = "splunk-rate-limit-burst"
+	splunkWeightKey               = "splunk-weight"
+	splunkMultilineStartKey       = "splunk-multiline-start"
+	splunkMultilineContinueKey    = "splunk-multiline-continue"
+	splunkMultilineMaxLinesKey    = "splunk-multiline-max-lines"
+	splunkMultilineMaxBytesKey    = "splunk-multiline-max-bytes"
+	splunkMultilineTimeoutKey     = "splunk-multiline-timeout"
+	splunkFilterKeepKey           = "splunk-filter-keep"
+	splunkFilterKeepRegexKey      = "splunk-filter-keep-regex"
+	splunkFilterDropKey           = "splunk-filter-drop"
+	splunkFilterDropRegexKey      = "splunk-filter-drop-regex"
+	splunkFilterSampleKey         = "splunk-filter-sample"
+	splunkFilterSampleRegexKey    = "splunk-filter-sample-regex"
+	splunkFilterSampleRateKey     = "splunk-filter-sample-rate"
 	envKey                        = "env"
 	envRegexKey                   = "env-regex"
 	labelsKey                     = "labels"
@@ -66,6 +90,10 @@ const (
 	defaultPostMessagesBatchSize = 1000
 	// Maximum number of messages we can store in buffer
 	defaultBufferMaximum = 10 * defaultPostMessagesBatchSize
+	// How many bytes can be posted in one request, 0 means no limit
+	defaultPostMessagesBatchBytes = 16 * 1024 * 1024
+	// Maximum number of bytes we can store in buffer, 0 means no limit
+	defaultBufferBytesMaximum = 10 * defaultPostMessagesBatchBytes
 	// Number of messages allowed to be queued in the channel
 	defaultStreamChannelSize = 4 * defaultPostMessagesBatchSize
 	// Partial log hold duration (if we are not reaching max buffer size)
@@ -79,18 +107,26 @@ const (
 	defaultJSONLogs = true
 	// Determines if telemetry is enabled
 	defaultSplunkTelemetry = true
+	// Number of batches a logger can have in flight to HEC at the same time
+	defaultConcurrentPosts = 1
+	// Determines if failed batches are retried before newer batches are sent
+	defaultOrderedRetries = true
 )
 
 const (
 	envVarPostMessagesFrequency        = "SPLUNK_LOGGING_DRIVER_POST_MESSAGES_FREQUENCY"
 	envVarPostMessagesBatchSize        = "SPLUNK_LOGGING_DRIVER_POST_MESSAGES_BATCH_SIZE"
 	envVarBufferMaximum                = "SPLUNK_LOGGING_DRIVER_BUFFER_MAX"
+	envVarPostMessagesBatchBytes       = "SPLUNK_LOGGING_DRIVER_POST_MESSAGES_BATCH_BYTES"
+	envVarBufferBytesMaximum           = "SPLUNK_LOGGING_DRIVER_BUFFER_BYTES_MAX"
 	envVarStreamChannelSize            = "SPLUNK_LOGGING_DRIVER_CHANNEL_SIZE"
 	envVarPartialMsgBufferHoldDuration = "SPLUNK_LOGGING_DRIVER_TEMP_MESSAGES_HOLD_DURATION"
 	envVarPartialMsgBufferMaximum      = "SPLUNK_LOGGING_DRIVER_TEMP_MESSAGES_BUFFER_SIZE"
 	envVarReadFifoErrorRetryNumber     = "SPLUNK_LOGGING_DRIVER_FIFO_ERROR_RETRY_TIME"
 	envVarJSONLogs                     = "SPLUNK_LOGGING_DRIVER_JSON_LOGS"
 	envVarSplunkTelemetry              = "SPLUNK_TELEMETRY"
+	envVarConcurrentPosts              = "SPLUNK_LOGGING_DRIVER_CONCURRENT_POSTS"
+	envVarOrderedRetries               = "SPLUNK_LOGGING_DRIVER_ORDERED_RETRIES"
 )
 
 type splunkLoggerInterface interface {
@@ -101,6 +137,25 @@ type splunkLoggerInterface interface {
 type splunkLogger struct {
 	hec         *hecClient
 	nullMessage *splunkMessage
+	// constant parts of every message, rendered once
+	envelope *messageEnvelope
+	// what to do when the stream channel is full
+	backpressure *backpressure
+	// limits of the container, nil without limits
+	rateLimit *rateLimiter
+	// messages which found the memory budget used up
+	memoryLimited limitCounters
+	// set for splunk-format=json
+	jsonDetection *jsonDetection
+	// closed when the logger is closed, before Close takes the lock
+	stop     chan struct{}
+	stopOnce sync.Once
+	// set atomically while the endpoints are not healthy past splunk-verify-connection-deadline,
+	// the messages are dropped in the meantime and counted in rejected
+	verifyFailed int32
+	rejected     limitCounters
+	// done when verifyAsync returns
+	verifying sync.WaitGroup
 
 	// For synchronization between background worker and logger.
 	// We use channel to send messages to worker go routine.
@@ -135,6 +190,12 @@ type splunkMessage struct {
 	SourceType string      `json:"sourcetype,omitempty"`
 	Index      string      `json:"index,omitempty"`
 	Entity     string      `json:"entity,omitempty"`
+
+	// Messages created by loggers are already encoded with the logger envelope,
+	// when payload is set it is sent as is and the fields above are not used
+	payload []byte
+	// set on the requests to flush, which are not sent
+	flush *flushRequest
 }
 
 type splunkMessageEvent struct {
@@ -159,8 +220,13 @@ func New(info logger.Info) (logger.Logger, error) {
 		return nil, fmt.Errorf("%s: cannot access hostname to set source field", driverName)
 	}
 
-	// Parse and validate Splunk URL
-	splunkURL, err := parseURL(info)
+	// Parse and validate Splunk URLs
+	splunkURLs, err := parseURL(info)
+	if err != nil {
+		return nil, err
+	}
+
+	loadBalance, err := parseLoadBalance(info.Config)
 	if err != nil {
 		return nil, err
 	}
@@ -171,61 +237,32 @@ func New(info logger.Info) (logger.Logger, error) {
 		return nil, fmt.Errorf("%s: %s is expected", driverName, splunkTokenKey)
 	}
 
-	tlsConfig := &tls.Config{}
-
 	// Splunk is using autogenerated certificates by default,
 	// allow users to trust them with skipping verification
+	insecureSkipVerify := false
 	if insecureSkipVerifyStr, ok := info.Config[splunkInsecureSkipVerifyKey]; ok {
-		insecureSkipVerify, err := strconv.ParseBool(insecureSkipVerifyStr)
+		insecureSkipVerify, err = strconv.ParseBool(insecureSkipVerifyStr)
 		if err != nil {
 			return nil, err
 		}
-		tlsConfig.InsecureSkipVerify = insecureSkipVerify
 	}
 
-	// If path to the root certificate is provided - load it
-	if caPath, ok := info.Config[splunkCAPathKey]; ok {
-		caCert, err := ioutil.ReadFile(caPath)
-		if err != nil {
-			return nil, err
-		}
-		caPool := x509.NewCertPool()
-		caPool.AppendCertsFromPEM(caCert)
-		tlsConfig.RootCAs = caPool
+	gzipPolicy, err := newGzipPolicy(info.Config)
+	if err != nil {
+		return nil, err
 	}
-
-	if caName, ok := info.Config[splunkCANameKey]; ok {
-		tlsConfig.ServerName = caName
+	gzipCompression := gzipPolicy != nil
+	rateLimit, err := newRateLimiter(info.Config)
+	if err != nil {
+		return nil, err
 	}
-
-	gzipCompression := false
-	if gzipCompressionStr, ok := info.Config[splunkGzipCompressionKey]; ok {
-		gzipCompression, err = strconv.ParseBool(gzipCompressionStr)
-		if err != nil {
-			return nil, err
-		}
+	weight, err := parseWeight(info.Config)
+	if err != nil {
+		return nil, err
 	}
-
 	gzipCompressionLevel := gzip.DefaultCompression
-	if gzipCompressionLevelStr, ok := info.Config[splunkGzipCompressionLevelKey]; ok {
-		var err error
-		gzipCompressionLevel64, err := strconv.ParseInt(gzipCompressionLevelStr, 10, 32)
-		if err != nil {
-			return nil, err
-		}
-		gzipCompressionLevel = int(gzipCompressionLevel64)
-		if gzipCompressionLevel < gzip.DefaultCompression || gzipCompressionLevel > gzip.BestCompression {
-			err := fmt.Errorf("not supported level '%s' for %s (supported values between %d and %d)",
-				gzipCompressionLevelStr, splunkGzipCompressionLevelKey, gzip.DefaultCompression, gzip.BestCompression)
-			return nil, err
-		}
-	}
-
-	transport := &http.Transport{
-		TLSClientConfig: tlsConfig,
-	}
-	client := &http.Client{
-		Transport: transport,
+	if gzipCompression {
+		gzipCompressionLevel = gzipPolicy.level
 	}
 
 	source := info.Config[splunkSourceKey]
@@ -257,43 +294,53 @@ func New(info logger.Info) (logger.Logger, error) {
 	}
 
 	var (
-		postMessagesFrequency = getAdvancedOptionDuration(envVarPostMessagesFrequency, defaultPostMessagesFrequency)
-		postMessagesBatchSize = getAdvancedOptionInt(envVarPostMessagesBatchSize, defaultPostMessagesBatchSize)
-		bufferMaximum         = getAdvancedOptionInt(envVarBufferMaximum, defaultBufferMaximum)
-		streamChannelSize     = getAdvancedOptionInt(envVarStreamChannelSize, defaultStreamChannelSize)
+		postMessagesFrequency  = getAdvancedOptionDuration(envVarPostMessagesFrequency, defaultPostMessagesFrequency)
+		postMessagesBatchSize  = getAdvancedOptionInt(envVarPostMessagesBatchSize, defaultPostMessagesBatchSize)
+		postMessagesBatchBytes = getAdvancedOptionInt(envVarPostMessagesBatchBytes, defaultPostMessagesBatchBytes)
+		bufferMaximum          = getAdvancedOptionInt(envVarBufferMaximum, defaultBufferMaximum)
+		bufferBytesMaximum     = getAdvancedOptionInt(envVarBufferBytesMaximum, defaultBufferBytesMaximum)
+		streamChannelSize      = getAdvancedOptionInt(envVarStreamChannelSize, defaultStreamChannelSize)
+		concurrentPosts        = getAdvancedOptionInt(envVarConcurrentPosts, defaultConcurrentPosts)
+		orderedRetries         = getAdvancedOptionBool(envVarOrderedRetries, defaultOrderedRetries)
 	)
 
-	logger := &splunkLogger{
-		hec: &hecClient{
-			client:                client,
-			transport:             transport,
-			url:                   splunkURL.String(),
-			healthCheckURL:        composeHealthCheckURL(splunkURL),
-			auth:                  "Splunk " + splunkToken,
-			gzipCompression:       gzipCompression,
-			gzipCompressionLevel:  gzipCompressionLevel,
-			postMessagesFrequency: postMessagesFrequency,
-			postMessagesBatchSize: postMessagesBatchSize,
-			bufferMaximum:         bufferMaximum,
-		},
-		nullMessage: nullMessage,
-		stream:      make(chan *splunkMessage, streamChannelSize),
+	if concurrentPosts < 1 {
+		return nil, fmt.Errorf("%s: %s should be at least 1", driverName, envVarConcurrentPosts)
+	}
+
+	indexerAck := false
+	if indexerAckStr, ok := info.Config[splunkIndexerAckKey]; ok {
+		indexerAck, err = strconv.ParseBool(indexerAckStr)
+		if err != nil {
+			return nil, err
+		}
 	}
 
 	// By default we don't verify connection, but we allow user to enable that
 	verifyConnection := false
+	verifyConnectionAsync := false
 	if verifyConnectionStr, ok := info.Config[splunkVerifyConnectionKey]; ok {
-		var err error
-		verifyConnection, err = strconv.ParseBool(verifyConnectionStr)
-		if err != nil {
-			return nil, err
+		if verifyConnectionStr == verifyConnectionAsyncValue {
+			verifyConnectionAsync = true
+		} else {
+			var err error
+			verifyConnection, err = strconv.ParseBool(verifyConnectionStr)
+			if err != nil {
+				return nil, err
+			}
 		}
 	}
-	if verifyConnection {
-		err = logger.hec.verifySplunkConnection(logger)
-		if err != nil {
+	verifyConnectionDeadline := defaultVerifyConnectionDeadline
+	if deadlineStr, ok := info.Config[splunkVerifyDeadlineKey]; ok {
+		if !verifyConnectionAsync {
+			return nil, fmt.Errorf("%s: %s requires %s=%s", driverName, splunkVerifyDeadlineKey, splunkVerifyConnectionKey, verifyConnectionAsyncValue)
+		}
+		if verifyConnectionDeadline, err = time.ParseDuration(deadlineStr); err != nil {
 			return nil, err
 		}
+		if verifyConnectionDeadline <= 0 {
+			return nil, fmt.Errorf("%s: %s should be positive", driverName, splunkVerifyDeadlineKey)
+		}
 	}
 
 	var splunkFormat string
@@ -310,6 +357,62 @@ func New(info logger.Info) (logger.Logger, error) {
 		splunkFormat = splunkFormatInline
 	}
 
+	rawEndpoint := false
+	if rawEndpointStr, ok := info.Config[splunkRawEndpointKey]; ok {
+		rawEndpoint, err = strconv.ParseBool(rawEndpointStr)
+		if err != nil {
+			return nil, err
+		}
+		if rawEndpoint && splunkFormat != splunkFormatRaw {
+			return nil, fmt.Errorf("%s: %s requires %s=%s", driverName, splunkRawEndpointKey, splunkFormatKey, splunkFormatRaw)
+		}
+	}
+
+	// Containers with the same endpoint and TLS settings share one connection pool,
+	// so the root certificate from splunk-capath is only loaded when the pool is created
+	endpoints, err := acquireEndpoints(splunkURLs, info.Config, insecureSkipVerify)
+	if err != nil {
+		return nil, err
+	}
+	if rawEndpoint {
+		for i, ep := range endpoints {
+			ep.url = composeRawURL(splunkURLs[i], nullMessage)
+		}
+	}
+
+	logger := &splunkLogger{
+		hec: &hecClient{
+			endpoints:              endpoints,
+			loadBalance:            loadBalance,
+			rawEndpoint:            rawEndpoint,
+			auth:                   "Splunk " + splunkToken,
+			gzipCompression:        gzipCompression,
+			gzipCompressionLevel:   gzipCompressionLevel,
+			gzip:                   gzipPolicy,
+			weight:                 weight,
+			memory:                 memory,
+			postMessagesFrequency:  postMessagesFrequency,
+			postMessagesBatchSize:  postMessagesBatchSize,
+			postMessagesBatchBytes: postMessagesBatchBytes,
+			bufferMaximum:          bufferMaximum,
+			bufferBytesMaximum:     bufferBytesMaximum,
+			concurrentPosts:        concurrentPosts,
+			orderedRetries:         orderedRetries,
+		},
+		nullMessage: nullMessage,
+		rateLimit:   rateLimit,
+		stream:      make(chan *splunkMessage, streamChannelSize),
+		stop:        make(chan struct{}),
+	}
+
+	if verifyConnection {
+		err = logger.hec.verifySplunkConnection()
+		if err != nil {
+			releaseEndpoints(endpoints)
+			return nil, err
+		}
+	}
+
 	var loggerWrapper splunkLoggerInterface
 
 	switch splunkFormat {
@@ -319,6 +422,7 @@ func New(info logger.Info) (logger.Logger, error) {
 			Attrs: attrs,
 		}
 
+		logger.envelope, err = newMessageEnvelope(nullMessage, nullEvent, nil)
 		loggerWrapper = &splunkLoggerInline{logger, nullEvent}
 	case splunkFormatJSON:
 		nullEvent := &splunkMessageEvent{
@@ -326,6 +430,8 @@ func New(info logger.Info) (logger.Logger, error) {
 			Attrs: attrs,
 		}
 
+		logger.envelope, err = newMessageEnvelope(nullMessage, nullEvent, nil)
+		logger.jsonDetection = newJSONDetection()
 		loggerWrapper = &splunkLoggerJSON{&splunkLoggerInline{logger, nullEvent}}
 	case splunkFormatRaw:
 		var prefix bytes.Buffer
@@ -340,16 +446,58 @@ func New(info logger.Info) (logger.Logger, error) {
 			prefix.WriteString(" ")
 		}
 
+		if rawEndpoint {
+			logger.envelope = newRawLinesEnvelope(prefix.Bytes())
+		} else {
+			logger.envelope, err = newMessageEnvelope(nullMessage, nil, prefix.Bytes())
+		}
 		loggerWrapper = &splunkLoggerRaw{logger, prefix.Bytes()}
 	default:
-		return nil, fmt.Errorf("unexpected format %s", splunkFormat)
+		err = fmt.Errorf("unexpected format %s", splunkFormat)
+	}
+	if err != nil {
+		releaseEndpoints(endpoints)
+		return nil, err
 	}
 
+	logger.hec.spool, err = openSpool(info.ContainerID)
+	if err != nil {
+		releaseEndpoints(endpoints)
+		return nil, err
+	}
+	logger.backpressure, err = newBackpressure(info.Config, info.ContainerID, logger.hec.spool)
+	if err != nil {
+		logger.hec.spool.close()
+		releaseEndpoints(endpoints)
+		return nil, err
+	}
+	// HEC requires a channel for the raw endpoint and for indexer acknowledgement
+	if indexerAck || rawEndpoint {
+		logger.hec.channel, err = newChannelID()
+		if err != nil {
+			logger.hec.spool.close()
+			releaseEndpoints(endpoints)
+			return nil, err
+		}
+	}
+	if indexerAck {
+		logger.hec.acks = newAckTracker(logger.hec)
+	}
+	// send what is left from the previous run of the plugin
+	logger.hec.replaySpool()
+
 	if getAdvancedOptionBool(envVarSplunkTelemetry, defaultSplunkTelemetry) {
 		go telemetry(info, logger, sourceType, splunkFormat)
 	}
 
 	go loggerWrapper.worker()
+	if verifyConnectionAsync {
+		logger.verifying.Add(1)
+		go func() {
+			defer logger.verifying.Done()
+			logger.verifyAsync(verifyConnectionDeadline)
+		}()
+	}
 
 	return loggerWrapper, nil
 }
@@ -371,8 +519,36 @@ func ValidateLogOpt(cfg map[string]string) error {
 		case splunkInsecureSkipVerifyKey:
 		case splunkFormatKey:
 		case splunkVerifyConnectionKey:
+		case splunkVerifyDeadlineKey:
 		case splunkGzipCompressionKey:
 		case splunkGzipCompressionLevelKey:
+		case splunkGzipMinLevelKey:
+		case splunkGzipMaxLevelKey:
+		case splunkGzipMinBytesKey:
+		case splunkGzipMinRatioKey:
+		case splunkBackpressureKey:
+		case splunkBackpressureSampleKey:
+		case splunkIndexerAckKey:
+		case splunkLoadBalanceKey:
+		case splunkRawEndpointKey:
+		case splunkJSONLogsKey:
+		case splunkJSONLogsBackpressureKey:
+		case splunkRateLimitEventsKey:
+		case splunkRateLimitBytesKey:
+		case splunkRateLimitBurstKey:
+		case splunkWeightKey:
+		case splunkMultilineStartKey:
+		case splunkMultilineContinueKey:
+		case splunkMultilineMaxLinesKey:
+		case splunkMultilineMaxBytesKey:
+		case splunkMultilineTimeoutKey:
+		case splunkFilterKeepKey:
+		case splunkFilterKeepRegexKey:
+		case splunkFilterDropKey:
+		case splunkFilterDropRegexKey:
+		case splunkFilterSampleKey:
+		case splunkFilterSampleRegexKey:
+		case splunkFilterSampleRateKey:
 		case envKey:
 		case envRegexKey:
 		case labelsKey:
@@ -384,12 +560,27 @@ func ValidateLogOpt(cfg map[string]string) error {
 	return nil
 }
 
-func parseURL(info logger.Info) (*url.URL, error) {
+/*
+parseURL returns the HEC endpoints of splunk-url, a comma separated list
+*/
+func parseURL(info logger.Info) ([]*url.URL, error) {
 	splunkURLStr, ok := info.Config[splunkURLKey]
 	if !ok {
 		return nil, fmt.Errorf("%s: %s is expected", driverName, splunkURLKey)
 	}
 
+	var splunkURLs []*url.URL
+	for _, str := range strings.Split(splunkURLStr, ",") {
+		splunkURL, err := parseEndpointURL(strings.TrimSpace(str), info)
+		if err != nil {
+			return nil, err
+		}
+		splunkURLs = append(splunkURLs, splunkURL)
+	}
+	return splunkURLs, nil
+}
+
+func parseEndpointURL(splunkURLStr string, info logger.Info) (*url.URL, error) {
 	splunkURL, err := url.Parse(splunkURLStr)
 	if err != nil {
 		return nil, fmt.Errorf("%s: failed to parse %s as url value in %s", driverName, splunkURLStr, splunkURLKey)
@@ -424,6 +615,26 @@ func composeHealthCheckURL(splunkURL *url.URL) string {
 	return splunkURL.Scheme + "://" + splunkURL.Host + "/services/collector/health"
 }
 
+func composeAckURL(splunkURL *url.URL) string {
+	return splunkURL.Scheme + "://" + splunkURL.Host + "/services/collector/ack"
+}
+
+// composeRawURL returns the raw endpoint with the metadata of the messages as query parameters
+func composeRawURL(splunkURL *url.URL, nullMessage *splunkMessage) string {
+	query := url.Values{}
+	query.Set("host", nullMessage.Host)
+	if nullMessage.Source != "" {
+		query.Set("source", nullMessage.Source)
+	}
+	if nullMessage.SourceType != "" {
+		query.Set("sourcetype", nullMessage.SourceType)
+	}
+	if nullMessage.Index != "" {
+		query.Set("index", nullMessage.Index)
+	}
+	return splunkURL.Scheme + "://" + splunkURL.Host + "/services/collector/raw?" + query.Encode()
+}
+
 func getAdvancedOptionDuration(envName string, defaultValue time.Duration) time.Duration {
 	valueStr := os.Getenv(envName)
 	if valueStr == "" {
@@ -466,51 +677,58 @@ func getAdvancedOptionBool(envName string, defaultValue bool) bool {
 // Log() takes in a log message reference and put it into a queue: stream
 // stream is used by the HEC workers
 func (l *splunkLoggerInline) Log(msg *logger.Message) error {
-	message := l.createSplunkMessage(msg)
-
-	event := *l.nullEvent
-	event.Line = string(msg.Line)
-	event.Source = msg.Source
-
-	message.Event = &event
+	message := l.createSplunkMessage(msg, false)
 	logger.PutMessage(msg)
 	return l.queueMessageAsync(message)
 }
 
+// Lines which are valid JSON are embedded as JSON objects, all other lines as strings
 func (l *splunkLoggerJSON) Log(msg *logger.Message) error {
-	message := l.createSplunkMessage(msg)
-	event := *l.nullEvent
-
-	var rawJSONMessage json.RawMessage
-	if err := json.Unmarshal(msg.Line, &rawJSONMessage); err == nil {
-		event.Line = &rawJSONMessage
-	} else {
-		event.Line = string(msg.Line)
+	detectJSON := l.jsonDetection.enabled()
+	payload, isJSON := l.envelope.encodeLine(msg.Line, detectJSON, msg.Source, msg.Timestamp)
+	if detectJSON {
+		l.jsonDetection.observe(isJSON)
 	}
-
-	event.Source = msg.Source
-
-	message.Event = &event
 	logger.PutMessage(msg)
-	return l.queueMessageAsync(message)
+	return l.queueMessageAsync(&splunkMessage{payload: payload})
 }
 
 func (l *splunkLoggerRaw) Log(msg *logger.Message) error {
-	message := l.createSplunkMessage(msg)
-
-	message.Event = string(append(l.prefix, msg.Line...))
+	message := l.createSplunkMessage(msg, false)
 	logger.PutMessage(msg)
 	return l.queueMessageAsync(message)
 }
 
+// budget returns the memory budget the messages of the logger are accounted in
+func (l *splunkLogger) budget() *memoryBudget {
+	if l.hec == nil {
+		return nil
+	}
+	return l.hec.memory
+}
+
 func (l *splunkLogger) queueMessageAsync(message *splunkMessage) error {
 	l.lock.RLock()
 	defer l.lock.RUnlock()
 	if l.closedCond != nil {
 		return fmt.Errorf("%s: driver is closed", driverName)
 	}
-	l.stream <- message
-	return nil
+	if atomic.LoadInt32(&l.verifyFailed) != 0 {
+		atomic.AddInt64(&l.rejected.limited, 1)
+		atomic.AddInt64(&l.rejected.dropped, 1)
+		return nil
+	}
+	if l.rateLimit != nil {
+		if ok, err := l.rateLimit.limit(l, message); !ok {
+			return err
+		}
+	}
+	if !l.budget().reserve(len(message.payload)) {
+		if ok, err := l.backpressure.overLimit(l, message, l.budget(), &l.memoryLimited, "Memory budget is used up"); !ok {
+			return err
+		}
+	}
+	return l.backpressure.queue(l, message)
 }
 
 func telemetry(info logger.Info, l *splunkLogger, sourceType string, splunkFormat string) {
@@ -561,11 +779,13 @@ func telemetry(info logger.Info, l *splunkLogger, sourceType string, splunkForma
 
 	messageArray = append(messageArray, telemMessage)
 
+	// telemetry is an event, also for loggers posting to the raw endpoint
+	telemEndpoint := *l.hec.endpoints[0]
+	telemEndpoint.url = telemEndpoint.eventURL
 	telemClient := hecClient{
-		transport: l.hec.transport,
-		client:    l.hec.client,
+		endpoints: []*hecEndpoint{&telemEndpoint},
 		auth:      l.hec.auth,
-		url:       l.hec.url,
+		channel:   l.hec.channel,
 	}
 
 	time.Sleep(5 * time.Second)
@@ -589,9 +809,17 @@ main function that handles the log stream processing
 Do a HEC POST when
 - the number of messages matches the batch size
 - time out
+- a flush is requested
+With more than one concurrent post allowed the pipelined worker is used instead
 */
 func (l *splunkLogger) worker() {
+	if l.hec.concurrentPosts > 1 {
+		l.pipelinedWorker()
+		return
+	}
 	var messages []*splunkMessage
+	// bytes received since the last time we tried to post
+	var batchBytes int
 	timer := time.NewTicker(l.hec.postMessagesFrequency)
 	for {
 		select {
@@ -600,36 +828,70 @@ func (l *splunkLogger) worker() {
 			if !open {
 				logrus.Debugf("stream is closed with %d events", len(messages))
 				l.hec.postMessages(messages, true)
+				l.hec.acks.close()
+				l.hec.spool.close()
 				l.lock.Lock()
 				defer l.lock.Unlock()
-				l.hec.transport.CloseIdleConnections()
+				releaseEndpoints(l.hec.endpoints)
 				l.closed = true
 				l.closedCond.Signal()
 				return
 			}
+			if message.flush != nil {
+				messages = l.hec.postMessages(messages, false)
+				batchBytes = 0
+				message.flush.reply(flushResult(messages))
+				break
+			}
+			// Send what we have when the new message does not fit in the batch bytes
+			if l.hec.postMessagesBatchBytes > 0 && batchBytes > 0 && batchBytes+len(message.payload) > l.hec.postMessagesBatchBytes {
+				messages = l.hec.postMessages(messages, false)
+				batchBytes = 0
+			}
 			messages = append(messages, message)
+			batchBytes += len(message.payload)
 			// Only sending when we get exactly to the batch size,
 			// This also helps not to fire postMessages on every new message,
 			// when previous try failed.
 			if len(messages)%l.hec.postMessagesBatchSize == 0 {
 				messages = l.hec.postMessages(messages, false)
+				batchBytes = 0
 			}
 		case <-timer.C:
 			logrus.Debugf("messages buffer timeout, sending %d events", len(messages))
 			messages = l.hec.postMessages(messages, false)
+			batchBytes = 0
 		}
+		atomic.StoreInt64(&l.hec.bufferedMessages, int64(len(messages)))
 	}
 }
 
 func (l *splunkLogger) Close() error {
+	// Log can wait for the memory budget or the rate limits while it holds the lock
+	l.stopOnce.Do(func() {
+		if l.stop != nil {
+			close(l.stop)
+		}
+	})
+	l.verifying.Wait()
 	l.lock.Lock()
 	defer l.lock.Unlock()
 	if l.closedCond == nil {
 		l.closedCond = sync.NewCond(&l.lock)
+		// the spool is closed with the stream
+		if err := l.backpressure.flushSpill(l); err != nil {
+			logrus.WithField("id", l.backpressure.containerID).WithError(err).Error("Cannot spool the spilled messages")
+		}
 		close(l.stream)
 		for !l.closed {
 			l.closedCond.Wait()
 		}
+		l.backpressure.report()
+		if l.rateLimit != nil {
+			l.rateLimit.report(l.backpressure.containerID, "Messages over the rate limit")
+		}
+		l.memoryLimited.report(l.backpressure.containerID, "Messages over the memory budget")
+		l.rejected.report(l.backpressure.containerID, "Messages rejected while HEC was not healthy")
 	}
 	return nil
 }
@@ -638,8 +900,10 @@ func (l *splunkLogger) Name() string {
 	return driverName
 }
 
-func (l *splunkLogger) createSplunkMessage(msg *logger.Message) *splunkMessage {
-	message := *l.nullMessage
-	message.Time = fmt.Sprintf("%f", float64(msg.Timestamp.UnixNano())/float64(time.Second))
-	return &message
+// createSplunkMessage encodes the message with the envelope of the logger,
+// the line is copied, so msg can be returned to the pool right after
+func (l *splunkLogger) createSplunkMessage(msg *logger.Message, detectJSON bool) *splunkMessage {
+	return &splunkMessage{
+		payload: l.envelope.encode(msg.Line, detectJSON, msg.Source, msg.Timestamp),
+	}
 }
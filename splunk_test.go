@@ -19,8 +19,12 @@ package main
 import (
 	"compress/gzip"
 	"fmt"
+	"io/ioutil"
+	"net/http"
+	"net/http/httptest"
 	"os"
 	"strings"
+	"sync"
 	"testing"
 	"time"
 
@@ -42,6 +46,7 @@ func TestValidateLogOpt(t *testing.T) {
 		splunkVerifyConnectionKey:     "true",
 		splunkGzipCompressionKey:      "true",
 		splunkGzipCompressionLevelKey: "1",
+		splunkRawEndpointKey:          "false",
 		envKey:                        "a",
 		envRegexKey:                   "^foo",
 		labelsKey:                     "b",
@@ -171,9 +176,9 @@ func TestUrlFormat(t *testing.T) {
 		},
 	}
 
-	url, err := parseURL(info)
+	urls, err := parseURL(info)
 
-	if url.String() != "https://127.0.1:8000/services/collector/event/1.0" {
+	if url := urls[0]; url.String() != "https://127.0.1:8000/services/collector/event/1.0" {
 		t.Fatalf("%s is not the right format of HEC endpoint.", url.String())
 	}
 
@@ -183,9 +188,9 @@ func TestUrlFormat(t *testing.T) {
 		},
 	}
 
-	url, err = parseURL(info)
+	urls, err = parseURL(info)
 
-	if url.String() != "https://127.0.1:8000/services/collector/event/1.0" {
+	if url := urls[0]; url.String() != "https://127.0.1:8000/services/collector/event/1.0" {
 		t.Fatalf("%s is not the right format of HEC endpoint.", url.String())
 	}
 }
@@ -243,7 +248,7 @@ func TestDefault(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "" ||
@@ -374,7 +379,7 @@ func TestInlineFormatWithNonDefaultOptions(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "mysource" ||
@@ -474,7 +479,7 @@ func TestJsonFormat(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "" ||
@@ -591,7 +596,7 @@ func TestRawFormat(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "" ||
@@ -705,7 +710,7 @@ func TestRawFormatWithLabels(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "" ||
@@ -817,7 +822,7 @@ func TestRawFormatWithoutTag(t *testing.T) {
 		t.Fatal("Unexpected Splunk Logging Driver type")
 	}
 
-	if splunkLoggerDriver.hec.url != hec.URL()+"/services/collector/event/1.0" ||
+	if splunkLoggerDriver.hec.endpoints[0].url != hec.URL()+"/services/collector/event/1.0" ||
 		splunkLoggerDriver.hec.auth != "Splunk "+hec.token ||
 		splunkLoggerDriver.nullMessage.Host != hostname ||
 		splunkLoggerDriver.nullMessage.Source != "" ||
@@ -958,6 +963,268 @@ func TestBatching(t *testing.T) {
 	}
 }
 
+// Verify that batches are cut by size in bytes before they reach the batch size
+func TestBatchBytes(t *testing.T) {
+	if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarPostMessagesBatchBytes, "4096"); err != nil {
+		t.Fatal(err)
+	}
+
+	hec := NewHTTPEventCollectorMock(t)
+
+	go hec.Serve()
+
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:   hec.URL(),
+			splunkTokenKey: hec.token,
+		},
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	splunkLoggerDriver, ok := loggerDriver.(*splunkLoggerInline)
+	if !ok {
+		t.Fatal("Unexpected Splunk Logging Driver type")
+	}
+
+	line := strings.Repeat("x", 1000)
+	for i := 0; i < 100; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d %s", i, line)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	err = loggerDriver.Close()
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if len(hec.messages) != 100 {
+		t.Fatalf("Not all messages delivered, got %d", len(hec.messages))
+	}
+
+	for i, message := range hec.messages {
+		if event, err := message.EventAsMap(); err != nil {
+			t.Fatal(err)
+		} else {
+			if event["line"] != fmt.Sprintf("%d %s", i, line) {
+				t.Fatalf("Unexpected event in message %v", event)
+			}
+		}
+	}
+
+	// every message is a bit over 1000 bytes, so 3 messages fit in a batch
+	if hec.numOfRequests != 34 {
+		t.Fatalf("Unexpected number of requests %d", hec.numOfRequests)
+	}
+
+	if splunkLoggerDriver.hec.largestBatchBytes > 4096 {
+		t.Fatalf("Batch of %d bytes is over the limit", splunkLoggerDriver.hec.largestBatchBytes)
+	}
+
+	err = hec.Close()
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarPostMessagesFrequency, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarPostMessagesBatchBytes, ""); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that all messages are delivered exactly once when several batches
+// are posted concurrently, with and without ordered retries
+func TestConcurrentPosts(t *testing.T) {
+	for _, ordered := range []string{"true", "false"} {
+		if err := os.Setenv(envVarPostMessagesFrequency, "10h"); err != nil {
+			t.Fatal(err)
+		}
+
+		if err := os.Setenv(envVarConcurrentPosts, "4"); err != nil {
+			t.Fatal(err)
+		}
+
+		if err := os.Setenv(envVarOrderedRetries, ordered); err != nil {
+			t.Fatal(err)
+		}
+
+		hec := NewHTTPEventCollectorMock(t)
+
+		go hec.Serve()
+
+		info := logger.Info{
+			Config: map[string]string{
+				splunkURLKey:   hec.URL(),
+				splunkTokenKey: hec.token,
+			},
+			ContainerID:        "containeriid",
+			ContainerName:      "/container_name",
+			ContainerImageID:   "contaimageid",
+			ContainerImageName: "container_image_name",
+		}
+
+		loggerDriver, err := New(info)
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		for i := 0; i < defaultStreamChannelSize*4; i++ {
+			if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+				t.Fatal(err)
+			}
+		}
+
+		err = loggerDriver.Close()
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		if len(hec.messages) != defaultStreamChannelSize*4 {
+			t.Fatalf("Not all messages delivered, got %d", len(hec.messages))
+		}
+
+		received := make(map[string]bool)
+		for _, message := range hec.messages {
+			if event, err := message.EventAsMap(); err != nil {
+				t.Fatal(err)
+			} else {
+				line := event["line"].(string)
+				if received[line] {
+					t.Fatalf("Message %s delivered more than once", line)
+				}
+				received[line] = true
+			}
+		}
+
+		// 16 batches
+		if hec.numOfRequests != 16 {
+			t.Fatalf("Unexpected number of requests %d", hec.numOfRequests)
+		}
+
+		err = hec.Close()
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	if err := os.Setenv(envVarPostMessagesFrequency, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarConcurrentPosts, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarOrderedRetries, ""); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that concurrent posts do not block close when HEC is down for the whole time
+func TestConcurrentPostsServerAlwaysDown(t *testing.T) {
+	if err := os.Setenv(envVarPostMessagesBatchSize, "2"); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarBufferMaximum, "4"); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarConcurrentPosts, "4"); err != nil {
+		t.Fatal(err)
+	}
+
+	hec := NewHTTPEventCollectorMock(t)
+	hec.simulateServerError = true
+	go hec.Serve()
+
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:   hec.URL(),
+			splunkTokenKey: hec.token,
+		},
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	for i := 0; i < 20; i++ {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(fmt.Sprintf("%d", i)), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	err = loggerDriver.Close()
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if len(hec.messages) != 0 {
+		t.Fatal("No messages should be sent")
+	}
+
+	err = hec.Close()
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarPostMessagesBatchSize, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarBufferMaximum, ""); err != nil {
+		t.Fatal(err)
+	}
+
+	if err := os.Setenv(envVarConcurrentPosts, ""); err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Verify that the messages queued while batches wait for a retry stay under the buffer maximum
+func TestTrimPending(t *testing.T) {
+	hec := &hecClient{postMessagesBatchSize: 2, bufferMaximum: 6}
+	var retries []*postBatch
+	var messages []*splunkMessage
+	pendingBytes := 0
+	retries = append(retries, &postBatch{messages: []*splunkMessage{{payload: []byte("a")}, {payload: []byte("b")}}})
+	for i := 0; i < 10; i++ {
+		messages = append(messages, &splunkMessage{payload: []byte(fmt.Sprintf("%d", i))})
+		pendingBytes++
+		retries, messages, pendingBytes = hec.trimPending(retries, messages, pendingBytes, 1)
+	}
+	if len(retries) != 0 {
+		t.Fatal("The oldest batch waiting for a retry should be dropped first")
+	}
+	if len(messages)+2 >= hec.bufferMaximum || pendingBytes != len(messages) {
+		t.Fatalf("Expected the messages to stay under the buffer maximum, got %d messages of %d bytes", len(messages), pendingBytes)
+	}
+	if string(messages[len(messages)-1].payload) != "9" || int(hec.droppedMessages)+len(messages) != 12 {
+		t.Fatalf("Expected the oldest messages to be dropped, %d dropped", hec.droppedMessages)
+	}
+}
+
 // Verify that test is using time to fire events not rare than specified frequency
 func TestFrequency(t *testing.T) {
 	if err := os.Setenv(envVarPostMessagesFrequency, "5ms"); err != nil {
@@ -1431,6 +1698,78 @@ func TestCannotSendAfterClose(t *testing.T) {
 	}
 }
 
+// Verify that raw format posts lines to the raw endpoint with the metadata in the query
+func TestRawEndpoint(t *testing.T) {
+	type rawRequest struct {
+		path    string
+		query   string
+		channel string
+		body    string
+	}
+	var lock sync.Mutex
+	var requests []rawRequest
+	hec := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		body, _ := ioutil.ReadAll(r.Body)
+		lock.Lock()
+		requests = append(requests, rawRequest{r.URL.Path, r.URL.RawQuery, r.Header.Get(splunkChannelHeader), string(body)})
+		lock.Unlock()
+		w.Write([]byte(`{"text":"Success","code":0}`))
+	}))
+	defer hec.Close()
+
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:         hec.URL,
+			splunkTokenKey:       "4642492F-D8BD-47F1-A005-0C08AE4657DF",
+			splunkFormatKey:      splunkFormatRaw,
+			splunkRawEndpointKey: "true",
+			splunkSourceKey:      "mysource",
+			splunkIndexKey:       "myindex",
+		},
+		ContainerID:        "containeriid",
+		ContainerName:      "/container_name",
+		ContainerImageID:   "contaimageid",
+		ContainerImageName: "container_image_name",
+	}
+
+	hostname, err := info.Hostname()
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	loggerDriver, err := New(info)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	for _, line := range []string{"{\"a\":\"b\"}", "notjson"} {
+		if err := loggerDriver.Log(&logger.Message{Line: []byte(line), Source: "stdout", Timestamp: time.Now()}); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	if err := loggerDriver.Close(); err != nil {
+		t.Fatal(err)
+	}
+
+	if len(requests) != 1 {
+		t.Fatalf("Expected one request, got %d", len(requests))
+	}
+	request := requests[0]
+	expectedQuery := "host=" + hostname + "&index=myindex&source=mysource&sourcetype=splunk_connect_docker"
+	if request.path != "/services/collector/raw" || request.query != expectedQuery || request.channel == "" {
+		t.Fatalf("Unexpected request %v", request)
+	}
+	if request.body != "containeriid {\"a\":\"b\"}\ncontaineriid notjson\n" {
+		t.Fatalf("Unexpected body %q", request.body)
+	}
+
+	info.Config[splunkFormatKey] = splunkFormatInline
+	if _, err := New(info); err == nil {
+		t.Fatal("Expected error for the raw endpoint without raw format")
+	}
+}
+
 func TestSetTelemetry(t *testing.T) {
 	if err := os.Setenv(envVarSplunkTelemetry, ""); err != nil {
 		t.Fatal(err)
@@ -24,6 +24,7 @@ import (
 	"io/ioutil"
 	"net"
 	"net/http"
+	"sync"
 	"testing"
 )
 
@@ -50,6 +51,9 @@ type HTTPEventCollectorMock struct {
 
 	test *testing.T
 
+	// the driver can post batches concurrently
+	lock sync.Mutex
+
 	connectionVerified bool
 	gzipEnabled        *bool
 	messages           []*splunkMessage
@@ -86,6 +90,9 @@ func (hec *HTTPEventCollectorMock) Close() error {
 func (hec *HTTPEventCollectorMock) ServeHTTP(writer http.ResponseWriter, request *http.Request) {
 	var err error
 
+	hec.lock.Lock()
+	defer hec.lock.Unlock()
+
 	hec.numOfRequests++
 
 	if hec.simulateServerError {
@@ -0,0 +1,617 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"bufio"
+	"encoding/binary"
+	"fmt"
+	"hash/crc32"
+	"io"
+	"io/ioutil"
+	"os"
+	"path/filepath"
+	"sort"
+	"strconv"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// Maximum size of the spool of one container
+	defaultSpoolMaxBytes = 1024 * 1024 * 1024
+	// Size after which a new segment file is started
+	defaultSpoolSegmentBytes = 64 * 1024 * 1024
+	// Number of spooled batches posted at the same time while replaying
+	defaultSpoolReplayConcurrency = 2
+	// Maximum size of the spools of all the containers
+	defaultSpoolTotalMaxBytes = 4 * 1024 * 1024 * 1024
+	// How long the spool of a container is kept once no logger uses it
+	defaultSpoolOrphanTimeout = 24 * time.Hour
+	// How often the spools no logger uses are checked
+	spoolOrphanCheckInterval = time.Minute
+
+	spoolSegmentSuffix = ".seg"
+	// length of the body, crc32 of the body and flags
+	spoolRecordHeaderSize = 9
+	spoolRecordCompressed = 1
+	// HEC does not accept requests over 800 MB by default, a bigger record is corrupted
+	maxSpoolRecordSize = 1024 * 1024 * 1024
+)
+
+const (
+	envVarSpoolDir               = "SPLUNK_LOGGING_DRIVER_SPOOL_DIR"
+	envVarSpoolMaxBytes          = "SPLUNK_LOGGING_DRIVER_SPOOL_MAX_BYTES"
+	envVarSpoolSegmentBytes      = "SPLUNK_LOGGING_DRIVER_SPOOL_SEGMENT_BYTES"
+	envVarSpoolReplayConcurrency = "SPLUNK_LOGGING_DRIVER_SPOOL_REPLAY_CONCURRENCY"
+	envVarSpoolTotalMaxBytes     = "SPLUNK_LOGGING_DRIVER_SPOOL_TOTAL_MAX_BYTES"
+	envVarSpoolOrphanTimeout     = "SPLUNK_LOGGING_DRIVER_SPOOL_ORPHAN_TIMEOUT"
+)
+
+// spools keeps track of the spools of all the containers
+var spools = newSpoolRegistry()
+
+/*
+spool keeps encoded batches which could not be sent to HEC on disk instead of
+dropping them. Batches are appended to segment files, and when the spool gets over
+its maximum size the oldest segment is removed. Spooled batches are replayed oldest
+first once HEC accepts requests again. Segments left by a previous run of the plugin
+are picked up by the next logger of the same container.
+
+A batch is removed from the spool only after HEC has accepted it, so replay is at
+least once: a batch which was being replayed when the plugin stopped is sent again.
+
+The spools of all the containers are also kept under a plugin-wide maximum size by
+spoolRegistry, which removes the oldest segment of any container when it is reached.
+*/
+type spool struct {
+	dir          string
+	maxBytes     int64
+	segmentBytes int64
+	concurrency  int
+
+	mu sync.Mutex
+	// sequence numbers of the segments, oldest first
+	segments []uint64
+	sizes    map[uint64]int64
+	// last write to the segments
+	written map[uint64]time.Time
+	size    int64
+	// segment we are appending to, always the last one
+	active     *os.File
+	activeSeq  uint64
+	activeSize int64
+	// replay position in the oldest segment
+	readSeq    uint64
+	readOffset int64
+	replaying  bool
+	closed     bool
+	done       chan struct{}
+	wg         sync.WaitGroup
+	// when the last logger of the container closed the spool
+	orphaned time.Time
+
+	// statistics, updated atomically
+	spooledBatches  int64
+	replayedBatches int64
+	evictedBytes    int64
+}
+
+// openSpool opens the spool of the container, it returns nil when spooling is disabled
+func openSpool(containerID string) (*spool, error) {
+	spoolDir := os.Getenv(envVarSpoolDir)
+	if spoolDir == "" {
+		return nil, nil
+	}
+	return spools.open(spoolDir, containerID)
+}
+
+// newSpool opens the spool in dir, it takes over the segments of previous when it
+// is the spool the last logger of the container left, otherwise it reads the directory
+func newSpool(dir string, previous *spool) (*spool, error) {
+	s := &spool{
+		dir:          dir,
+		maxBytes:     int64(getAdvancedOptionInt(envVarSpoolMaxBytes, defaultSpoolMaxBytes)),
+		segmentBytes: int64(getAdvancedOptionInt(envVarSpoolSegmentBytes, defaultSpoolSegmentBytes)),
+		concurrency:  getAdvancedOptionInt(envVarSpoolReplayConcurrency, defaultSpoolReplayConcurrency),
+		sizes:        make(map[uint64]int64),
+		written:      make(map[uint64]time.Time),
+		done:         make(chan struct{}),
+	}
+	if s.concurrency < 1 {
+		s.concurrency = 1
+	}
+	if err := os.MkdirAll(s.dir, 0700); err != nil {
+		return nil, fmt.Errorf("%s: cannot create spool directory: %v", driverName, err)
+	}
+	if previous != nil {
+		previous.mu.Lock()
+		s.segments, s.sizes, s.written, s.size, s.activeSeq = previous.segments, previous.sizes, previous.written, previous.size, previous.activeSeq
+		previous.segments, previous.sizes, previous.written, previous.size = nil, make(map[uint64]int64), make(map[uint64]time.Time), 0
+		previous.mu.Unlock()
+	} else {
+		files, err := ioutil.ReadDir(s.dir)
+		if err != nil {
+			return nil, fmt.Errorf("%s: cannot read spool directory: %v", driverName, err)
+		}
+		for _, file := range files {
+			name := file.Name()
+			if !strings.HasSuffix(name, spoolSegmentSuffix) {
+				continue
+			}
+			seq, err := strconv.ParseUint(strings.TrimSuffix(name, spoolSegmentSuffix), 16, 64)
+			if err != nil {
+				continue
+			}
+			s.segments = append(s.segments, seq)
+			s.sizes[seq] = file.Size()
+			s.written[seq] = file.ModTime()
+			s.size += file.Size()
+		}
+		sort.Slice(s.segments, func(i, j int) bool { return s.segments[i] < s.segments[j] })
+		atomic.AddInt64(&spools.size, s.size)
+	}
+	if len(s.segments) > 0 {
+		s.activeSeq = s.segments[len(s.segments)-1]
+		logrus.WithField("dir", s.dir).WithField("segments", len(s.segments)).WithField("bytes", s.size).
+			Info("Found spooled batches")
+	}
+	return s, nil
+}
+
+func (s *spool) segmentPath(seq uint64) string {
+	return filepath.Join(s.dir, fmt.Sprintf("%016x%s", seq, spoolSegmentSuffix))
+}
+
+// write appends an encoded batch to the spool
+func (s *spool) write(body []byte, compressed bool) error {
+	if err := s.writeRecord(body, compressed); err != nil {
+		return err
+	}
+	spools.evict()
+	return nil
+}
+
+func (s *spool) writeRecord(body []byte, compressed bool) error {
+	record := make([]byte, spoolRecordHeaderSize+len(body))
+	binary.BigEndian.PutUint32(record[0:4], uint32(len(body)))
+	binary.BigEndian.PutUint32(record[4:8], crc32.ChecksumIEEE(body))
+	if compressed {
+		record[8] = spoolRecordCompressed
+	}
+	copy(record[spoolRecordHeaderSize:], body)
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.closed {
+		return fmt.Errorf("%s: spool is closed", driverName)
+	}
+	if s.active != nil && s.activeSize > 0 && s.activeSize+int64(len(record)) > s.segmentBytes {
+		s.sealLocked()
+	}
+	if s.active == nil {
+		seq := s.activeSeq + 1
+		file, err := os.OpenFile(s.segmentPath(seq), os.O_CREATE|os.O_EXCL|os.O_WRONLY|os.O_APPEND, 0600)
+		if err != nil {
+			return err
+		}
+		s.active = file
+		s.activeSeq = seq
+		s.activeSize = 0
+		s.segments = append(s.segments, seq)
+	}
+	n, err := s.active.Write(record)
+	s.activeSize += int64(n)
+	s.sizes[s.activeSeq] += int64(n)
+	s.written[s.activeSeq] = time.Now()
+	s.size += int64(n)
+	atomic.AddInt64(&spools.size, int64(n))
+	if err != nil {
+		// do not append after a partial record
+		s.sealLocked()
+		return err
+	}
+	atomic.AddInt64(&s.spooledBatches, 1)
+	s.evictLocked()
+	return nil
+}
+
+// sealLocked closes the active segment, the next write starts a new one
+func (s *spool) sealLocked() {
+	if s.active == nil {
+		return
+	}
+	if err := s.active.Sync(); err != nil {
+		logrus.WithField("dir", s.dir).WithError(err).Warn("Cannot sync spool segment")
+	}
+	s.active.Close()
+	s.active = nil
+}
+
+// evictLocked removes the oldest segments while the spool is over its maximum size
+func (s *spool) evictLocked() {
+	for s.size > s.maxBytes && len(s.segments) > 1 {
+		s.evictOldestLocked("Spool is full, dropping the oldest spooled batches")
+	}
+}
+
+func (s *spool) evictOldestLocked(msg string) {
+	seq := s.segments[0]
+	if s.active != nil && s.activeSeq == seq {
+		s.sealLocked()
+	}
+	logrus.WithField("dir", s.dir).WithField("bytes", s.sizes[seq]).Error(msg)
+	atomic.AddInt64(&s.evictedBytes, s.sizes[seq])
+	s.removeLocked(seq)
+}
+
+func (s *spool) removeLocked(seq uint64) {
+	if len(s.segments) == 0 || s.segments[0] != seq {
+		return
+	}
+	if err := os.Remove(s.segmentPath(seq)); err != nil && !os.IsNotExist(err) {
+		logrus.WithField("dir", s.dir).WithError(err).Warn("Cannot remove spool segment")
+	}
+	s.size -= s.sizes[seq]
+	atomic.AddInt64(&spools.size, -s.sizes[seq])
+	delete(s.sizes, seq)
+	delete(s.written, seq)
+	s.segments = s.segments[1:]
+	if s.readSeq == seq {
+		s.readOffset = 0
+	}
+}
+
+// replay starts sending spooled batches in the background, unless it is already running.
+// It stops on the first batch HEC does not accept, and is started again by the next
+// successful post.
+func (s *spool) replay(post func(body []byte, compressed bool) error) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.closed || s.replaying || s.size == 0 {
+		return
+	}
+	s.replaying = true
+	s.wg.Add(1)
+	go func() {
+		defer s.wg.Done()
+		for s.replayOldest(post) {
+		}
+		s.mu.Lock()
+		s.replaying = false
+		s.mu.Unlock()
+	}()
+}
+
+// replayOldest replays the oldest segment and removes it,
+// it returns false when there is nothing more to replay or a post failed
+func (s *spool) replayOldest(post func(body []byte, compressed bool) error) bool {
+	s.mu.Lock()
+	if s.closed || len(s.segments) == 0 {
+		s.mu.Unlock()
+		return false
+	}
+	seq := s.segments[0]
+	if s.active != nil && s.activeSeq == seq {
+		s.sealLocked()
+	}
+	if s.readSeq != seq {
+		s.readSeq = seq
+		s.readOffset = 0
+	}
+	offset := s.readOffset
+	s.mu.Unlock()
+
+	file, err := os.Open(s.segmentPath(seq))
+	if err != nil {
+		if !os.IsNotExist(err) {
+			logrus.WithField("dir", s.dir).WithError(err).Error("Cannot open spool segment")
+			return false
+		}
+	} else {
+		completed := s.replaySegment(file, seq, offset, post)
+		file.Close()
+		if !completed {
+			return false
+		}
+	}
+
+	s.mu.Lock()
+	s.removeLocked(seq)
+	s.mu.Unlock()
+	return true
+}
+
+type spoolRecord struct {
+	body       []byte
+	compressed bool
+	// offset right after the record
+	end int64
+	err error
+}
+
+// replaySegment posts the batches of one segment, up to concurrency at a time,
+// and moves the replay position after every batch which was accepted in order
+func (s *spool) replaySegment(file *os.File, seq uint64, offset int64, post func(body []byte, compressed bool) error) bool {
+	if _, err := file.Seek(offset, io.SeekStart); err != nil {
+		logrus.WithField("dir", s.dir).WithError(err).Error("Cannot read spool segment")
+		return false
+	}
+	reader := bufio.NewReader(file)
+	for {
+		select {
+		case <-s.done:
+			return false
+		default:
+		}
+
+		var records []*spoolRecord
+		last := false
+		for len(records) < s.concurrency {
+			record, err := readSpoolRecord(reader)
+			if err == io.EOF {
+				last = true
+				break
+			}
+			if err != nil {
+				// a torn write at the end of the segment, nothing after it can be trusted
+				logrus.WithField("dir", s.dir).WithField("segment", seq).WithError(err).Error("Dropping corrupted spool records")
+				last = true
+				break
+			}
+			offset += spoolRecordHeaderSize + int64(len(record.body))
+			record.end = offset
+			records = append(records, record)
+		}
+
+		var wg sync.WaitGroup
+		for _, record := range records {
+			wg.Add(1)
+			go func(record *spoolRecord) {
+				defer wg.Done()
+				record.err = post(record.body, record.compressed)
+			}(record)
+		}
+		wg.Wait()
+
+		for _, record := range records {
+			if record.err != nil {
+				logrus.WithField("dir", s.dir).WithError(record.err).Debug("Spool replay stopped")
+				return false
+			}
+			atomic.AddInt64(&s.replayedBatches, 1)
+			s.mu.Lock()
+			if s.readSeq == seq {
+				s.readOffset = record.end
+			}
+			s.mu.Unlock()
+		}
+		if last {
+			return true
+		}
+	}
+}
+
+func readSpoolRecord(reader *bufio.Reader) (*spoolRecord, error) {
+	var header [spoolRecordHeaderSize]byte
+	if _, err := io.ReadFull(reader, header[:]); err != nil {
+		if err == io.ErrUnexpectedEOF {
+			return nil, fmt.Errorf("%s: truncated spool record header", driverName)
+		}
+		return nil, err
+	}
+	length := binary.BigEndian.Uint32(header[0:4])
+	if length > maxSpoolRecordSize {
+		return nil, fmt.Errorf("%s: invalid spool record size %d", driverName, length)
+	}
+	body := make([]byte, length)
+	if _, err := io.ReadFull(reader, body); err != nil {
+		return nil, fmt.Errorf("%s: truncated spool record", driverName)
+	}
+	if crc32.ChecksumIEEE(body) != binary.BigEndian.Uint32(header[4:8]) {
+		return nil, fmt.Errorf("%s: spool record checksum mismatch", driverName)
+	}
+	return &spoolRecord{body: body, compressed: header[8]&spoolRecordCompressed != 0}, nil
+}
+
+// close stops the replay and closes the active segment,
+// spooled batches stay on disk for the next logger of the container
+func (s *spool) close() {
+	if s == nil {
+		return
+	}
+	s.mu.Lock()
+	if s.closed {
+		s.mu.Unlock()
+		return
+	}
+	s.closed = true
+	close(s.done)
+	s.sealLocked()
+	s.mu.Unlock()
+	s.wg.Wait()
+	spools.release(s)
+}
+
+/*
+spoolRegistry keeps the spools of all the containers under
+SPLUNK_LOGGING_DRIVER_SPOOL_TOTAL_MAX_BYTES, the oldest segment of any container is
+removed first. It also keeps the spools no logger uses: the spool of a container
+which was stopped, or which was found in the spool directory when the plugin
+started. They are picked up by the next logger of the container, and removed if no
+logger uses them for SPLUNK_LOGGING_DRIVER_SPOOL_ORPHAN_TIMEOUT, since the plugin
+does not know where to send them without the options of the container.
+*/
+type spoolRegistry struct {
+	mu            sync.Mutex
+	orphanTimeout time.Duration
+	// spools of the loggers and spools no logger uses, by directory
+	spools  map[string]*spool
+	orphans map[string]*spool
+	// spool directories which were read
+	roots   map[string]bool
+	janitor sync.Once
+
+	// updated atomically
+	maxBytes      int64
+	size          int64
+	orphanedBytes int64
+}
+
+func newSpoolRegistry() *spoolRegistry {
+	return &spoolRegistry{
+		spools:  make(map[string]*spool),
+		orphans: make(map[string]*spool),
+		roots:   make(map[string]bool),
+	}
+}
+
+// open opens the spool of the container, with the segments left by its previous logger
+func (r *spoolRegistry) open(root string, containerID string) (*spool, error) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	atomic.StoreInt64(&r.maxBytes, int64(getAdvancedOptionInt(envVarSpoolTotalMaxBytes, defaultSpoolTotalMaxBytes)))
+	r.orphanTimeout = getAdvancedOptionDuration(envVarSpoolOrphanTimeout, defaultSpoolOrphanTimeout)
+	dir := filepath.Join(root, containerID)
+	if !r.roots[root] {
+		r.roots[root] = true
+		r.readOrphansLocked(root, dir)
+		r.janitor.Do(func() { go r.collectOrphans() })
+	}
+	s, err := newSpool(dir, r.orphans[dir])
+	if err != nil {
+		return nil, err
+	}
+	delete(r.orphans, dir)
+	r.spools[dir] = s
+	return s, nil
+}
+
+// readOrphansLocked finds the spools left in root by the previous run of the plugin
+func (r *spoolRegistry) readOrphansLocked(root string, skip string) {
+	dirs, err := ioutil.ReadDir(root)
+	if err != nil {
+		if !os.IsNotExist(err) {
+			logrus.WithField("dir", root).WithError(err).Warn("Cannot read spool directory")
+		}
+		return
+	}
+	for _, info := range dirs {
+		dir := filepath.Join(root, info.Name())
+		if !info.IsDir() || dir == skip || r.spools[dir] != nil {
+			continue
+		}
+		s, err := newSpool(dir, nil)
+		if err != nil {
+			logrus.WithField("dir", dir).WithError(err).Warn("Cannot read spool directory")
+			continue
+		}
+		s.closed = true
+		close(s.done)
+		r.orphanLocked(s)
+	}
+}
+
+// release keeps the spool of a closed logger until the next logger of the container
+func (r *spoolRegistry) release(s *spool) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	if r.spools[s.dir] == s {
+		delete(r.spools, s.dir)
+		r.orphanLocked(s)
+	}
+}
+
+func (r *spoolRegistry) orphanLocked(s *spool) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	if s.size == 0 {
+		os.Remove(s.dir)
+		return
+	}
+	s.orphaned = time.Now()
+	r.orphans[s.dir] = s
+}
+
+// evict removes the oldest segments of all the spools while they are over the maximum size
+func (r *spoolRegistry) evict() {
+	if maxBytes := atomic.LoadInt64(&r.maxBytes); maxBytes <= 0 || atomic.LoadInt64(&r.size) <= maxBytes {
+		return
+	}
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	for r.maxBytes > 0 && atomic.LoadInt64(&r.size) > r.maxBytes {
+		var oldest *spool
+		var oldestTime time.Time
+		for _, all := range []map[string]*spool{r.spools, r.orphans} {
+			for _, s := range all {
+				s.mu.Lock()
+				if len(s.segments) > 0 {
+					if written := s.written[s.segments[0]]; oldest == nil || written.Before(oldestTime) {
+						oldest, oldestTime = s, written
+					}
+				}
+				s.mu.Unlock()
+			}
+		}
+		if oldest == nil {
+			return
+		}
+		oldest.mu.Lock()
+		if len(oldest.segments) > 0 {
+			oldest.evictOldestLocked("Spools of all the containers are full, dropping the oldest spooled batches")
+		}
+		oldest.mu.Unlock()
+	}
+}
+
+// collectOrphans removes the spools no logger used for the orphan timeout
+func (r *spoolRegistry) collectOrphans() {
+	ticker := time.NewTicker(spoolOrphanCheckInterval)
+	defer ticker.Stop()
+	for now := range ticker.C {
+		r.removeOrphans(now)
+	}
+}
+
+func (r *spoolRegistry) removeOrphans(now time.Time) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	for dir, s := range r.orphans {
+		s.mu.Lock()
+		if now.Sub(s.orphaned) < r.orphanTimeout && s.size > 0 {
+			s.mu.Unlock()
+			continue
+		}
+		size := s.size
+		for len(s.segments) > 0 {
+			s.removeLocked(s.segments[0])
+		}
+		s.mu.Unlock()
+		if err := os.RemoveAll(dir); err != nil {
+			logrus.WithField("dir", dir).WithError(err).Warn("Cannot remove spool directory")
+		}
+		delete(r.orphans, dir)
+		atomic.AddInt64(&r.orphanedBytes, size)
+		logrus.WithField("dir", dir).WithField("bytes", size).
+			Warn("Removed the spool of a container without logger")
+	}
+}
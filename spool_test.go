@@ -0,0 +1,244 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"fmt"
+	"io/ioutil"
+	"os"
+	"path/filepath"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+)
+
+func waitForReplay(t *testing.T, s *spool) {
+	for i := 0; i < 100; i++ {
+		s.mu.Lock()
+		replaying := s.replaying
+		s.mu.Unlock()
+		if !replaying {
+			return
+		}
+		time.Sleep(10 * time.Millisecond)
+	}
+	t.Fatal("Spool replay did not stop")
+}
+
+// Verify that spooled batches survive reopening the spool, are replayed in order
+// and stay in the spool until HEC accepts them
+func TestSpool(t *testing.T) {
+	dir, err := ioutil.TempDir("", "spool")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+
+	os.Setenv(envVarSpoolDir, dir)
+	os.Setenv(envVarSpoolSegmentBytes, "100")
+	os.Setenv(envVarSpoolReplayConcurrency, "1")
+	defer os.Setenv(envVarSpoolDir, "")
+	defer os.Setenv(envVarSpoolSegmentBytes, "")
+	defer os.Setenv(envVarSpoolReplayConcurrency, "")
+
+	s, err := openSpool("containerid")
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i := 0; i < 10; i++ {
+		if err := s.write([]byte(fmt.Sprintf(`{"event":"%d"}`, i)), i%2 == 0); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if len(s.segments) < 2 {
+		t.Fatalf("Expected several segments, got %d", len(s.segments))
+	}
+	s.close()
+
+	s, err = openSpool("containerid")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer s.close()
+
+	var lock sync.Mutex
+	var replayed []string
+	failAt := 4
+	post := func(body []byte, compressed bool) error {
+		lock.Lock()
+		defer lock.Unlock()
+		if len(replayed) == failAt {
+			failAt = -1
+			return fmt.Errorf("HEC is down")
+		}
+		if compressed != (len(replayed)%2 == 0) {
+			t.Errorf("Unexpected compression flag for %s", body)
+		}
+		replayed = append(replayed, string(body))
+		return nil
+	}
+
+	s.replay(post)
+	waitForReplay(t, s)
+	if len(replayed) != 4 {
+		t.Fatalf("Replay should stop on the first failure, replayed %d", len(replayed))
+	}
+
+	s.replay(post)
+	waitForReplay(t, s)
+	if len(replayed) != 10 {
+		t.Fatalf("Expected all batches to be replayed, got %d", len(replayed))
+	}
+	for i, body := range replayed {
+		if body != fmt.Sprintf(`{"event":"%d"}`, i) {
+			t.Fatalf("Unexpected batch %s at %d", body, i)
+		}
+	}
+	if s.size != 0 || len(s.segments) != 0 {
+		t.Fatalf("Spool should be empty, %d bytes in %d segments", s.size, len(s.segments))
+	}
+}
+
+// Verify that the oldest segments are removed when the spool is full
+func TestSpoolEviction(t *testing.T) {
+	dir, err := ioutil.TempDir("", "spool")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+
+	os.Setenv(envVarSpoolDir, dir)
+	os.Setenv(envVarSpoolSegmentBytes, "100")
+	os.Setenv(envVarSpoolMaxBytes, "300")
+	defer os.Setenv(envVarSpoolDir, "")
+	defer os.Setenv(envVarSpoolSegmentBytes, "")
+	defer os.Setenv(envVarSpoolMaxBytes, "")
+
+	s, err := openSpool("containerid")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer s.close()
+
+	for i := 0; i < 100; i++ {
+		if err := s.write([]byte(fmt.Sprintf(`{"event":"%d"}`, i)), false); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if s.size > 300 {
+		t.Fatalf("Spool is over its maximum size, %d bytes", s.size)
+	}
+	if s.evictedBytes == 0 {
+		t.Fatal("Expected the oldest segments to be evicted")
+	}
+	files, err := ioutil.ReadDir(s.dir)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(files) != len(s.segments) {
+		t.Fatalf("Expected %d segment files, got %d", len(s.segments), len(files))
+	}
+}
+
+// Verify that the spools of all the containers are kept under the plugin-wide
+// maximum size, oldest first, and that the spools no logger picks up are removed
+func TestSpoolRegistry(t *testing.T) {
+	dir, err := ioutil.TempDir("", "spool")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer os.RemoveAll(dir)
+	defer func(previous *spoolRegistry) {
+		spools = previous
+	}(spools)
+	spools = newSpoolRegistry()
+
+	os.Setenv(envVarSpoolDir, dir)
+	os.Setenv(envVarSpoolSegmentBytes, "100")
+	os.Setenv(envVarSpoolTotalMaxBytes, "400")
+	defer os.Setenv(envVarSpoolDir, "")
+	defer os.Setenv(envVarSpoolSegmentBytes, "")
+	defer os.Setenv(envVarSpoolTotalMaxBytes, "")
+
+	// left by the previous run of the plugin
+	stopped, err := openSpool("stopped")
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i := 0; i < 5; i++ {
+		if err := stopped.write([]byte(fmt.Sprintf(`{"event":"%d"}`, i)), false); err != nil {
+			t.Fatal(err)
+		}
+	}
+	stopped.close()
+	if err := os.Mkdir(filepath.Join(dir, "empty"), 0700); err != nil {
+		t.Fatal(err)
+	}
+	old := time.Now().Add(-time.Hour)
+	segments, _ := filepath.Glob(filepath.Join(dir, "stopped", "*"+spoolSegmentSuffix))
+	for _, segment := range segments {
+		os.Chtimes(segment, old, old)
+	}
+
+	spools = newSpoolRegistry()
+	a, err := openSpool("a")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer a.close()
+	b, err := openSpool("b")
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(spools.orphans) != 1 || spools.orphans[filepath.Join(dir, "stopped")] == nil {
+		t.Fatalf("Expected the spool left by the previous run to be found, got %v", spools.orphans)
+	}
+	if _, err := os.Stat(filepath.Join(dir, "empty")); !os.IsNotExist(err) {
+		t.Fatal("Expected the empty spool directory to be removed")
+	}
+
+	for i := 0; i < 50; i++ {
+		if err := a.write([]byte(fmt.Sprintf(`{"event":"a%d"}`, i)), false); err != nil {
+			t.Fatal(err)
+		}
+		if err := b.write([]byte(fmt.Sprintf(`{"event":"b%d"}`, i)), false); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if size := atomic.LoadInt64(&spools.size); size > 400 || size != a.size+b.size {
+		t.Fatalf("Spools are over their maximum size, %d bytes", size)
+	}
+	if spools.orphans[filepath.Join(dir, "stopped")].size != 0 || a.evictedBytes == 0 || b.evictedBytes == 0 {
+		t.Fatal("Expected the oldest segments of all the spools to be evicted")
+	}
+
+	b.close()
+	spools.removeOrphans(time.Now())
+	if _, err := os.Stat(filepath.Join(dir, "b")); err != nil {
+		t.Fatal("Expected the spool of the closed logger to be kept until the orphan timeout")
+	}
+	spools.removeOrphans(time.Now().Add(defaultSpoolOrphanTimeout))
+	for _, name := range []string{"b", "stopped"} {
+		if _, err := os.Stat(filepath.Join(dir, name)); !os.IsNotExist(err) {
+			t.Fatalf("Expected the spool of %s to be removed", name)
+		}
+	}
+	if len(spools.orphans) != 0 || atomic.LoadInt64(&spools.size) != a.size {
+		t.Fatalf("Unexpected spools left, %d orphans, %d bytes", len(spools.orphans), spools.size)
+	}
+}
@@ -135,7 +135,7 @@ def __open_fifo(fifo_location):
 
 def __write_proto_buf_message(fifo_writer=None,
                               source="test",
-                              time_nano=int(time.time() * 1000000000),
+                              time_nano=None,
                               message="",
                               partial=False,
                               id=""):
@@ -144,17 +144,16 @@ def __write_proto_buf_message(fifo_writer=None,
     '''
     log = LogEntry_pb2.LogEntry()
     log.source = source
+    if time_nano is None:
+        time_nano = int(time.time() * 1000000000)
     log.time_nano = time_nano
     log.line = bytes(message, "utf8")
     log.partial = partial
 
-    buf = log.SerializeToString(log)
+    buf = log.SerializeToString()
     size = len(buf)
 
-    size_buffer = bytearray(4)
-    struct.pack_into(">i", size_buffer, 0, size)
-    fifo_writer.write(size_buffer)
-    fifo_writer.write(buf)
+    fifo_writer.write(struct.pack(">i", size) + buf)
     fifo_writer.flush()
 
 
@@ -164,7 +163,8 @@ def __close_fifo(fifo_writer):
     fifo_writer.close()
 
 
-def request_start_logging(file_path, hec_url, hec_token, options={}):
+def request_start_logging(file_path, hec_url, hec_token, options={},
+                          container_id="test"):
     '''
     send a request to the plugin to start logging
     :param file_path: the file path
@@ -175,6 +175,9 @@ def request_start_logging(file_path, hec_url, hec_token, options={}):
 
     :param hec_token: the file path
     :type hec_token: string
+
+    :param container_id: the id of the container
+    :type container_id: string
     '''
     config = {}
     config["splunk-url"] = hec_url
@@ -188,7 +191,7 @@ def request_start_logging(file_path, hec_url, hec_token, options={}):
     req_obj = {
         "File": file_path,
         "Info": {
-            "ContainerID": "test",
+            "ContainerID": container_id,
             "Config": config,
             "LogPath": "/home/ec2-user/test.txt"
         }
@@ -230,6 +233,20 @@ def request_stop_logging(file_path):
     logger.info(res.json())
 
 
+def wait_for_events(id, count, timeout, index="main", hec=None):
+    '''
+    wait until count events matching id arrived, or for timeout seconds.
+    Only the local HEC can tell when the events arrived, with splunk this
+    always waits for timeout seconds
+    @param: hec (HECServer the plugin sends to, or None)
+    '''
+    if hec is None:
+        time.sleep(timeout)
+        return
+    events = hec.wait_for_events(id, count, timeout, index)
+    logger.info("%d of %d events with %s arrived", len(events), count, id)
+
+
 def check_events_from_splunk(index="main",
                              id=None,
                              start_time="-24h@h",
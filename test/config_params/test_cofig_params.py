@@ -6,7 +6,7 @@ import logging
 import json
 import socket
 from urllib.parse import urlparse
-from ..common import request_start_logging,  \
+from ..common import request_start_logging, wait_for_events, \
     check_events_from_splunk, request_stop_logging, \
     start_log_producer_from_input
 
@@ -37,8 +37,8 @@ def test_splunk_index_1(setup, test_input, expected):
                           setup["splunk_hec_token"],
                           options={"splunk-index": index})
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 5, index=index, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -79,8 +79,8 @@ def test_splunk_index_2(setup, test_input, expected):
                           setup["splunk_hec_token"],
                           options={"splunk-index": index})
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 5, index=index, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -124,8 +124,9 @@ def test_splunk_source_1(setup, test_input, expected):
                           options=options)
 
     source = test_input if test_input else "*"
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events("source={0} {1}".format(source, u_id), expected, 5,
+                    hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -166,8 +167,9 @@ def test_splunk_source_2(setup, test_input, expected):
                           options=options)
 
     source = test_input if test_input else "*"
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events("source={0} {1}".format(source, u_id), expected, 5,
+                    hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -210,8 +212,9 @@ def test_splunk_source_type_1(setup, test_input, expected):
 
     sourcetype = test_input if test_input else "splunk_connect_docker"
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events("sourcetype={0} {1}".format(sourcetype, u_id),
+                    expected, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -253,8 +256,9 @@ def test_splunk_source_type_2(setup, test_input, expected):
 
     sourcetype = test_input if test_input else "splunk_connect_docker"
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events("sourcetype={0} {1}".format(sourcetype, u_id),
+                    expected, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -278,6 +282,8 @@ def test_splunk_ca(setup):
     The server cert used here is the default CA shipping in splunk
     '''
     logging.getLogger().info("testing test_splunk_ca")
+    if setup["local_hec"] is not None:
+        pytest.skip("the local HEC does not have the certificate of splunk")
     u_id = str(uuid.uuid4())
 
     file_path = setup["fifo_path"]
@@ -314,8 +320,8 @@ def test_splunk_ca(setup):
                           setup["splunk_hec_token"],
                           options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -361,8 +367,8 @@ def test_splunk_format_json(setup, test_input, expected):
                           setup["splunk_hec_token"],
                           options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -421,8 +427,8 @@ def test_splunk_format_inline(setup, test_input, expected):
                           setup["splunk_hec_token"],
                           options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -481,8 +487,8 @@ def test_splunk_format_raw(setup, test_input, expected):
                           setup["splunk_hec_token"],
                           options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -567,8 +573,8 @@ def test_splunk_gzip_1(setup, test_input, has_exception):
         assert has_exception
 
     if not has_exception:
-        # wait for 10 seconds to allow messages to be sent
-        time.sleep(5)
+        # wait up to 5 seconds for the messages to be sent
+        wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
         request_stop_logging(file_path)
 
         # check that events get to splunk
@@ -609,8 +615,8 @@ def test_splunk_gzip_2(setup, test_input, has_exception):
         assert has_exception
 
     if not has_exception:
-        # wait for 10 seconds to allow messages to be sent
-        time.sleep(5)
+        # wait up to 5 seconds for the messages to be sent
+        wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
         request_stop_logging(file_path)
 
         # check that events get to splunk
@@ -651,8 +657,8 @@ def test_splunk_gzip_3(setup, test_input, has_exception):
         assert has_exception
 
     if not has_exception:
-        # wait for 10 seconds to allow messages to be sent
-        time.sleep(5)
+        # wait up to 5 seconds for the messages to be sent
+        wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
         request_stop_logging(file_path)
 
         # check that events get to splunk
@@ -693,8 +699,8 @@ def test_splunk_gzip_4(setup, test_input, has_exception):
         assert has_exception
 
     if not has_exception:
-        # wait for 10 seconds to allow messages to be sent
-        time.sleep(5)
+        # wait up to 5 seconds for the messages to be sent
+        wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
         request_stop_logging(file_path)
 
         # check that events get to splunk
@@ -735,8 +741,8 @@ def test_splunk_gzip_5(setup, test_input, has_exception):
         assert has_exception
 
     if not has_exception:
-        # wait for 10 seconds to allow messages to be sent
-        time.sleep(5)
+        # wait up to 5 seconds for the messages to be sent
+        wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
         request_stop_logging(file_path)
 
         # check that events get to splunk
@@ -768,8 +774,8 @@ def test_splunk_tag(setup):
                           setup["splunk_hec_token"],
                           options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events(u_id, 1, 5, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -803,13 +809,14 @@ def test_splunk_telemety(setup):
                               setup["splunk_hec_token"],
                               options=options)
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(5)
-    request_stop_logging(file_path)
-
     index = "_introspection"
     sourcetype = "telemetry"
 
+    # wait up to 5 seconds for the messages to be sent
+    wait_for_events("data.sourcetype={0}".format(sourcetype), 1, 5,
+                    index=index, hec=setup["local_hec"])
+    request_stop_logging(file_path)
+
 
     # check that events get to splunk
     events = check_events_from_splunk(index=index,
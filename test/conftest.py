@@ -18,6 +18,7 @@ import pytest
 import time
 from common import start_logging_plugin, \
     kill_logging_plugin
+from hec_server import HECServer
 
 
 def pytest_addoption(parser):
@@ -43,10 +44,24 @@ def pytest_addoption(parser):
     parser.addoption("--fifo-path",
                      help="full file path to the fifo",
                      required=True)
+    parser.addoption("--local-hec",
+                     help="send the events to a local HEC stand-in \
+                          instead of splunk",
+                     action="store_true",
+                     default=False)
+
+
+@pytest.fixture(scope="session")
+def local_hec(request):
+    if not request.config.getoption("--local-hec"):
+        return None
+    hec = HECServer(request.config.getoption("--splunk-hec-token")).start()
+    request.addfinalizer(hec.stop)
+    return hec
 
 
 @pytest.fixture(scope="function")
-def setup(request):
+def setup(request, local_hec):
     config = {}
     config["splunkd_url"] = request.config.getoption("--splunkd-url")
     config["splunk_hec_url"] = request.config.getoption("--splunk-hec-url")
@@ -55,6 +70,11 @@ def setup(request):
     config["splunk_password"] = request.config.getoption("--splunk-password")
     config["plugin_path"] = request.config.getoption("--docker-plugin-path")
     config["fifo_path"] = request.config.getoption("--fifo-path")
+    config["local_hec"] = local_hec
+    if local_hec is not None:
+        # the stand-in also answers the searches
+        config["splunk_hec_url"] = local_hec.url
+        config["splunkd_url"] = local_hec.url
 
     kill_logging_plugin(config["plugin_path"])
     start_logging_plugin(config["plugin_path"])
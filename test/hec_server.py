@@ -0,0 +1,359 @@
+"""
+Copyright 2018 Splunk, Inc..
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+A local stand-in for the Splunk HTTP Event Collector. It accepts events
+the way HEC does and keeps them in memory, indexed by the uuids they
+contain, so the tests can run without a Splunk instance and wait for
+their events instead of sleeping. It also answers the search jobs API
+of splunkd, so check_events_from_splunk works unchanged.
+
+Usage:
+    python hec_server.py --port 8088 --token <token>
+"""
+
+import argparse
+import fnmatch
+import gzip
+import json
+import re
+import shlex
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+
+EVENT_PATHS = ("/services/collector", "/services/collector/event",
+               "/services/collector/event/1.0")
+HEALTH_PATHS = ("/services/collector/health",
+                "/services/collector/health/1.0")
+SEARCH_JOBS_PATH = "/services/search/jobs"
+
+# the tests tag every event with a uuid4
+UID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _HECRequestHandler(BaseHTTPRequestHandler):
+    # the driver keeps its connections open
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, text, code):
+        self._respond_json(status, {"text": text, "code": code})
+
+    def _respond_json(self, status, obj):
+        body = json.dumps(obj).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in HEALTH_PATHS:
+            self._respond(200, "HEC is healthy", 17)
+        elif path.startswith(SEARCH_JOBS_PATH + "/"):
+            self._get_search_job(path[len(SEARCH_JOBS_PATH) + 1:])
+        else:
+            self._respond(404, "The requested URL was not found", 404)
+
+    def do_POST(self):
+        hec = self.server.hec
+        path = self.path.split("?")[0]
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if path == SEARCH_JOBS_PATH:
+            query = parse_qs(body.decode("utf8")).get("search", [""])[0]
+            self._respond_json(201, {"sid": hec.create_search_job(query)})
+            return
+        if path not in EVENT_PATHS:
+            self._respond(404, "The requested URL was not found", 404)
+            return
+        authorization = self.headers.get("Authorization", "")
+        if not authorization:
+            hec.record_request(rejected=True)
+            self._respond(401, "Token is required", 2)
+            return
+        if authorization != "Splunk " + hec.token:
+            hec.record_request(rejected=True)
+            self._respond(403, "Invalid token", 4)
+            return
+
+        compressed = self.headers.get("Content-Encoding", "") == "gzip"
+        try:
+            if compressed:
+                body = gzip.decompress(body)
+            events = parse_events(body.decode("utf8"))
+        except (ValueError, OSError):
+            hec.record_request(rejected=True)
+            self._respond(400, "Invalid data format", 6)
+            return
+
+        hec.add(events, len(body), compressed)
+        self._respond(200, "Success", 0)
+
+    def _get_search_job(self, path):
+        # jobs finish when they are created
+        sid, _, resource = path.partition("/")
+        results = self.server.hec.search_job_results(sid)
+        if results is None:
+            self._respond(404, "Unknown sid", 404)
+        elif resource == "events":
+            self._respond_json(200, {"results": results})
+        else:
+            self._respond_json(200, {"entry": [
+                {"content": {"dispatchState": "DONE"}}]})
+
+
+def parse_events(data):
+    '''
+    parse the body of a request, which is a sequence of json objects
+    returns list of dict
+    '''
+    decoder = json.JSONDecoder()
+    events = []
+    pos = 0
+    while True:
+        while pos < len(data) and data[pos].isspace():
+            pos += 1
+        if pos == len(data):
+            return events
+        event, pos = decoder.raw_decode(data, pos)
+        if not isinstance(event, dict) or "event" not in event:
+            raise ValueError("event field is required")
+        events.append(event)
+
+
+def field_value(result, name):
+    '''
+    value of a field of a search result, fields which are not in the
+    result are extracted from the event when it is json, like data.sourcetype
+    '''
+    if name in result:
+        return result[name]
+    try:
+        value = json.loads(result["_raw"])
+    except ValueError:
+        return None
+    for key in name.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def to_result(event):
+    '''turn a received event into a search result, like the ones of splunkd'''
+    raw = event["event"]
+    if not isinstance(raw, str):
+        raw = json.dumps(raw, separators=(",", ":"))
+    return {
+        "_raw": raw,
+        "_time": event.get("time", ""),
+        "host": event.get("host", ""),
+        # splunk names the source after the token when there is none
+        "source": event.get("source", "http:hec_server"),
+        "sourcetype": event.get("sourcetype", ""),
+        "index": event.get("index", "main"),
+    }
+
+
+def _field_matches(value, pattern):
+    return value is not None and fnmatch.fnmatchcase(value, pattern)
+
+
+class HECServer(object):
+    '''
+    in memory HEC, search() and wait_for_events() take a subset of the
+    splunk search language: field=value, where value can have wildcards,
+    and plain terms, all of which must match
+    '''
+
+    def __init__(self, token, host="127.0.0.1", port=0, certfile=None,
+                 keyfile=None):
+        self.token = token
+        self._server = _ThreadingHTTPServer((host, port), _HECRequestHandler)
+        self._server.hec = self
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket,
+                                                      server_side=True)
+            self.scheme = "https"
+        self._thread = None
+        self._cond = threading.Condition()
+        self._events = []
+        self._by_uid = {}
+        self._search_jobs = {}
+        self.requests = 0
+        self.gzip_requests = 0
+        self.rejected_requests = 0
+        self.bytes_received = 0
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "{0}://{1}:{2}".format(self.scheme, host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def record_request(self, rejected=False):
+        with self._cond:
+            self.requests += 1
+            if rejected:
+                self.rejected_requests += 1
+
+    def add(self, events, size, compressed):
+        results = [to_result(event) for event in events]
+        with self._cond:
+            self.requests += 1
+            self.bytes_received += size
+            if compressed:
+                self.gzip_requests += 1
+            for result in results:
+                self._events.append(result)
+                for uid in set(UID_PATTERN.findall(result["_raw"])):
+                    self._by_uid.setdefault(uid, []).append(result)
+            self._cond.notify_all()
+
+    def clear(self):
+        with self._cond:
+            del self._events[:]
+            self._by_uid.clear()
+            self._search_jobs.clear()
+
+    def _search_locked(self, query, index):
+        fields = {}
+        terms = []
+        for token in shlex.split(query):
+            name, sep, value = token.partition("=")
+            if sep and name:
+                fields[name] = value
+            else:
+                terms.append(token)
+        if index is not None:
+            fields.setdefault("index", index)
+
+        candidates = self._events
+        for term in terms:
+            if UID_PATTERN.fullmatch(term):
+                candidates = self._by_uid.get(term, [])
+                break
+        return [result for result in candidates
+                if all(_field_matches(field_value(result, name), value)
+                       for name, value in fields.items())
+                and all(term in result["_raw"] for term in terms)]
+
+    def search(self, query, index="main"):
+        '''
+        returns the events matching the query
+        @param: query (e.g. "source=stdout <uid>")
+        @param: index (None matches all indexes)
+        '''
+        with self._cond:
+            return list(self._search_locked(query, index))
+
+    def create_search_job(self, query):
+        '''
+        run a search of the splunkd search jobs API, e.g. "search index=main <uid>"
+        returns the sid of the job
+        '''
+        if query.startswith("search "):
+            query = query[len("search "):]
+        sid = str(uuid.uuid4())
+        results = self.search(query, index=None)
+        with self._cond:
+            self._search_jobs[sid] = results
+        return sid
+
+    def search_job_results(self, sid):
+        with self._cond:
+            return self._search_jobs.get(sid)
+
+    def wait_for_events(self, query, count, timeout, index="main"):
+        '''
+        wait until at least count events match the query
+        returns the events matching the query
+        '''
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                events = self._search_locked(query, index)
+                remaining = deadline - time.time()
+                if len(events) >= count or remaining <= 0:
+                    return list(events)
+                self._cond.wait(remaining)
+
+    def count(self):
+        with self._cond:
+            return len(self._events)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--certfile", help="serve https with this certificate")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--interval", type=float, default=5,
+                        help="seconds between reports of the received events")
+    args = parser.parse_args(argv)
+
+    hec = HECServer(args.token, args.host, args.port, args.certfile,
+                    args.keyfile).start()
+    sys.stderr.write("HEC listening on {0}\n".format(hec.url))
+    try:
+        while True:
+            time.sleep(args.interval)
+            count = hec.count()
+            # only the counters are kept on long runs
+            hec.clear()
+            sys.stderr.write("{0} events ({1:.0f} events/s), {2} requests, "
+                             "{3} rejected\n".format(
+                                 count, count / args.interval,
+                                 hec.requests, hec.rejected_requests))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hec.stop()
+
+
+if __name__ == "__main__":
+    main()
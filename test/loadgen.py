@@ -0,0 +1,343 @@
+"""
+Copyright 2018 Splunk, Inc..
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Load generator for the logging plugin. It writes LogEntry frames to
+several FIFOs at once, at a target rate of lines or bytes per second,
+the same way docker does: lines over 16KB are split into partial chunks
+and frames are written to the FIFO in large writes.
+
+Usage:
+    python loadgen.py --fifo-dir /tmp/loadgen --fifos 4 --lines-per-sec 20000 \
+        --line-size lognormal:200:1.0 --duration 60 \
+        --start-logging --splunk-hec-url https://localhost:8088 \
+        --splunk-hec-token <token>
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+import uuid
+
+
+# docker splits lines into chunks of this size and marks all but the
+# last one as partial
+DOCKER_CHUNK_SIZE = 16 * 1024
+DEFAULT_WRITE_SIZE = 64 * 1024
+# how often the writer checks its progress against the target rate
+PACING_INTERVAL = 0.01
+
+
+def _varint(value):
+    '''encode an unsigned integer as a protobuf varint'''
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_log_entry(source, time_nano, line, partial):
+    '''
+    encode a LogEntry (see LogEntry.proto) with its 4 bytes big endian
+    size prefix, as docker writes it to the FIFO
+    @param: source (bytes)
+    @param: time_nano (int)
+    @param: line (bytes)
+    @param: partial (bool)
+    returns bytes
+    '''
+    body = b"".join((
+        b"\x0a", _varint(len(source)), source,
+        b"\x10", _varint(time_nano),
+        b"\x1a", _varint(len(line)), line,
+        b"\x20\x01" if partial else b"",
+    ))
+    return struct.pack(">I", len(body)) + body
+
+
+def docker_chunks(line, chunk_size=DOCKER_CHUNK_SIZE):
+    '''
+    split a line the way docker does
+    returns list of tuples of (bytes, partial)
+    '''
+    if len(line) <= chunk_size:
+        return [(line, False)]
+    chunks = []
+    for start in range(0, len(line), chunk_size):
+        chunk = line[start:start + chunk_size]
+        chunks.append((chunk, start + chunk_size < len(line)))
+    return chunks
+
+
+def parse_size_distribution(spec):
+    '''
+    parse a line size distribution, one of
+        fixed:SIZE
+        uniform:MIN:MAX
+        lognormal:MEDIAN:SIGMA
+        choice:SIZE,SIZE,...
+    returns a function which takes a random.Random and returns a size
+    '''
+    kind, _, args = spec.partition(":")
+    if kind == "fixed":
+        size = int(args)
+        return lambda rnd: size
+    if kind == "uniform":
+        low, high = (int(value) for value in args.split(":"))
+        return lambda rnd: rnd.randint(low, high)
+    if kind == "lognormal":
+        median, sigma = args.split(":")
+        mu = math.log(float(median))
+        sigma = float(sigma)
+        return lambda rnd: max(1, int(rnd.lognormvariate(mu, sigma)))
+    if kind == "choice":
+        sizes = [int(value) for value in args.split(",")]
+        return lambda rnd: rnd.choice(sizes)
+    raise ValueError("unknown line size distribution {0}".format(spec))
+
+
+def make_line(prefix, size):
+    '''a line of the given size which starts with prefix, so it can be searched'''
+    if size <= len(prefix):
+        return prefix[:size]
+    return prefix + b"x" * (size - len(prefix))
+
+
+def open_fifo(fifo_path):
+    '''create the fifo, replacing whatever is at the path'''
+    if os.path.exists(fifo_path):
+        os.unlink(fifo_path)
+    os.mkfifo(fifo_path)
+
+
+def run_producer(fifo_path, run_id, index, lines_per_sec=0, bytes_per_sec=0,
+                 line_size="fixed:100", duration=10, total_lines=0,
+                 source="stdout", write_size=DEFAULT_WRITE_SIZE, seed=None):
+    '''
+    write frames to one fifo until the duration or the number of lines
+    is reached, a rate of 0 means as fast as possible
+    returns dict with the achieved counters
+    '''
+    rnd = random.Random(seed if seed is not None else index)
+    next_size = parse_size_distribution(line_size)
+    source = source.encode("utf8")
+    prefix = "{0} {1} ".format(run_id, index).encode("utf8")
+
+    fd = os.open(fifo_path, os.O_WRONLY)
+    lines = 0
+    line_bytes = 0
+    frames = 0
+    writes = 0
+    pending = bytearray()
+    start = time.time()
+    deadline = start + duration if duration > 0 else None
+    try:
+        while True:
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if total_lines and lines >= total_lines:
+                break
+            elapsed = now - start
+            # lines we are allowed to have written by now
+            if lines_per_sec:
+                budget_lines = int(elapsed * lines_per_sec) + 1 - lines
+            elif bytes_per_sec:
+                budget_lines = None
+                if line_bytes >= int(elapsed * bytes_per_sec) + 1:
+                    budget_lines = 0
+            else:
+                budget_lines = None
+            if budget_lines is not None and budget_lines <= 0:
+                if pending:
+                    writes += _write_all(fd, pending)
+                    pending = bytearray()
+                time.sleep(PACING_INTERVAL)
+                continue
+
+            # produce a slice of work before checking the clock again
+            slice_end = now + PACING_INTERVAL
+            produced = 0
+            while budget_lines is None or produced < budget_lines:
+                size = next_size(rnd)
+                line = make_line(prefix + str(lines).encode("utf8") + b" ", size)
+                time_nano = time.time_ns() if hasattr(time, "time_ns") \
+                    else int(time.time() * 1e9)
+                for chunk, partial in docker_chunks(line):
+                    pending += encode_log_entry(source, time_nano, chunk, partial)
+                    frames += 1
+                lines += 1
+                line_bytes += len(line)
+                produced += 1
+                if len(pending) >= write_size:
+                    writes += _write_all(fd, pending)
+                    pending = bytearray()
+                if total_lines and lines >= total_lines:
+                    break
+                if bytes_per_sec and line_bytes >= int((time.time() - start) * bytes_per_sec) + 1:
+                    break
+                if budget_lines is None and time.time() >= slice_end:
+                    break
+        if pending:
+            writes += _write_all(fd, pending)
+    finally:
+        os.close(fd)
+
+    elapsed = time.time() - start
+    return {
+        "fifo": fifo_path,
+        "lines": lines,
+        "bytes": line_bytes,
+        "frames": frames,
+        "writes": writes,
+        "elapsed": elapsed,
+    }
+
+
+def _write_all(fd, data):
+    '''write the whole buffer, returns the number of write calls'''
+    view = memoryview(data)
+    calls = 0
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+        calls += 1
+    return calls
+
+
+def _producer_main(args):
+    return run_producer(**args)
+
+
+def run_load(fifo_paths, lines_per_sec=0, bytes_per_sec=0, line_size="fixed:100",
+             duration=10, total_lines=0, write_size=DEFAULT_WRITE_SIZE,
+             run_id=None, on_ready=None):
+    '''
+    drive all the fifos at once, one process per fifo. The rates are per fifo.
+    on_ready is called after the fifos are created and before the producers
+    block on opening them, this is where the plugin should start logging.
+    returns dict with the counters of every fifo and the totals
+    '''
+    run_id = run_id or str(uuid.uuid4())
+    for fifo_path in fifo_paths:
+        open_fifo(fifo_path)
+
+    jobs = [dict(fifo_path=fifo_path, run_id=run_id, index=index,
+                 lines_per_sec=lines_per_sec, bytes_per_sec=bytes_per_sec,
+                 line_size=line_size, duration=duration,
+                 total_lines=total_lines, write_size=write_size)
+            for index, fifo_path in enumerate(fifo_paths)]
+    pool = multiprocessing.Pool(processes=len(jobs))
+    try:
+        result = pool.map_async(_producer_main, jobs)
+        if on_ready is not None:
+            on_ready(fifo_paths)
+        producers = result.get()
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = max(producer["elapsed"] for producer in producers) or 1e-9
+    totals = {
+        "lines": sum(producer["lines"] for producer in producers),
+        "bytes": sum(producer["bytes"] for producer in producers),
+        "frames": sum(producer["frames"] for producer in producers),
+        "writes": sum(producer["writes"] for producer in producers),
+        "elapsed": elapsed,
+    }
+    totals["lines_per_sec"] = totals["lines"] / elapsed
+    totals["bytes_per_sec"] = totals["bytes"] / elapsed
+    return {"run_id": run_id, "producers": producers, "totals": totals}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fifo-dir", default="/tmp/loadgen",
+                        help="directory where the fifos are created")
+    parser.add_argument("--fifos", type=int, default=1,
+                        help="number of fifos (containers) to drive")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument("--lines-per-sec", type=float, default=0,
+                      help="target lines per second per fifo, 0 means unlimited")
+    rate.add_argument("--bytes-per-sec", type=float, default=0,
+                      help="target bytes per second per fifo, 0 means unlimited")
+    parser.add_argument("--line-size", default="fixed:100",
+                        help="fixed:SIZE, uniform:MIN:MAX, lognormal:MEDIAN:SIGMA "
+                             "or choice:SIZE,SIZE,...")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds to run, 0 means until --lines is reached")
+    parser.add_argument("--lines", type=int, default=0,
+                        help="lines to write per fifo, 0 means no limit")
+    parser.add_argument("--write-size", type=int, default=DEFAULT_WRITE_SIZE,
+                        help="bytes of frames batched into one write")
+    parser.add_argument("--start-logging", action="store_true",
+                        help="ask the plugin to start and stop logging for every fifo")
+    parser.add_argument("--splunk-hec-url", default="https://localhost:8088")
+    parser.add_argument("--splunk-hec-token", default="")
+    parser.add_argument("--splunk-format", default="json")
+    args = parser.parse_args(argv)
+
+    if args.duration <= 0 and args.lines <= 0:
+        parser.error("either --duration or --lines is required")
+
+    os.makedirs(args.fifo_dir, exist_ok=True)
+    fifo_paths = [os.path.join(args.fifo_dir, "fifo-{0}".format(index))
+                  for index in range(args.fifos)]
+
+    on_ready = None
+    if args.start_logging:
+        from common import request_start_logging, request_stop_logging
+
+        def on_ready(paths):
+            for index, path in enumerate(paths):
+                request_start_logging(path, args.splunk_hec_url,
+                                      args.splunk_hec_token,
+                                      {"splunk-format": args.splunk_format},
+                                      container_id="loadgen-{0}".format(index))
+
+    result = run_load(fifo_paths,
+                      lines_per_sec=args.lines_per_sec,
+                      bytes_per_sec=args.bytes_per_sec,
+                      line_size=args.line_size,
+                      duration=args.duration,
+                      total_lines=args.lines,
+                      write_size=args.write_size,
+                      on_ready=on_ready)
+
+    if args.start_logging:
+        for path in fifo_paths:
+            request_stop_logging(path)
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    totals = result["totals"]
+    sys.stderr.write("run {0}: {1} lines, {2:.0f} lines/s, {3:.1f} MB/s, "
+                     "{4} frames in {5} writes\n".format(
+                         result["run_id"], totals["lines"],
+                         totals["lines_per_sec"],
+                         totals["bytes_per_sec"] / 1e6,
+                         totals["frames"], totals["writes"]))
+
+
+if __name__ == "__main__":
+    main()
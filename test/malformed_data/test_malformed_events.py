@@ -18,7 +18,7 @@ import pytest
 import time
 import uuid
 import logging
-from ..common import request_start_logging,  \
+from ..common import request_start_logging, wait_for_events, \
     check_events_from_splunk, request_stop_logging, \
     start_log_producer_from_input
 
@@ -45,8 +45,8 @@ def test_malformed_empty_string_1(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(10)
+    # wait up to 10 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 10, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -82,8 +82,8 @@ def test_malformed_empty_string_2(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(10)
+    # wait up to 10 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 10, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -122,8 +122,8 @@ def test_malformed_empty_string_3(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(10)
+    # wait up to 10 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 10, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -160,8 +160,8 @@ def test_malformed_empty_string_4(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(10)
+    # wait up to 10 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 10, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -198,8 +198,8 @@ def test_malformed_empty_string_5(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 10 seconds to allow messages to be sent
-    time.sleep(10)
+    # wait up to 10 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 10, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -19,7 +19,7 @@ import time
 import uuid
 import os
 import logging
-from ..common import request_start_logging,  \
+from ..common import request_start_logging, wait_for_events, \
     check_events_from_splunk, request_stop_logging, \
     start_log_producer_from_input, start_log_producer_from_file, kill_logging_plugin
 
@@ -43,8 +43,8 @@ def test_partial_log_1(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 15 seconds to allow messages to be sent
-    time.sleep(15)
+    # wait up to 15 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 15, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -79,8 +79,8 @@ def test_partial_log_2(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 15 seconds to allow messages to be sent
-    time.sleep(15)
+    # wait up to 15 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 15, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -98,15 +98,15 @@ def test_partial_log_2(setup, test_input, expected):
 
 
 @pytest.mark.parametrize("test_input, expected", [
-   ([("start", True), ("mid", True), ("end", False)], 2)
+   ([("start", True), ("mid", True), ("end", False)], 3)
 ])
 def test_partial_log_flush_timeout_1(setup, test_input, expected):
     '''
     Test that the logging plugin can flush the buffer for partial
     log. If the next partial message didn't arrive in expected
-    time (default 5 sec), it should flush the buffer anyway. There
-    is an architectural restriction that the buffer flush can only
-    occur on receipt of a new message beyond the timeout of the buffer.
+    time (default 5 sec), it should flush the buffer anyway, even
+    if no new message arrives. The entries are written 10 seconds
+    apart, so every partial entry is flushed on its own.
     '''
     logging.getLogger().info("testing test_partial_log_flush_timeout input={0} \
                 expected={1} event(s)".format(test_input, expected))
@@ -119,8 +119,8 @@ def test_partial_log_flush_timeout_1(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 70 seconds to allow messages to be sent
-    time.sleep(70)
+    # wait up to 70 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 70, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -137,15 +137,15 @@ def test_partial_log_flush_timeout_1(setup, test_input, expected):
     kill_logging_plugin
 
 @pytest.mark.parametrize("test_input, expected", [
-   ([("start2", True), ("new start", False), ("end2", True), ("start3", False), ("new start", True), ("end3", False)], 3)
+   ([("start2", True), ("new start", False), ("end2", True), ("start3", False), ("new start", True), ("end3", False)], 6)
 ])
 def test_partial_log_flush_timeout_2(setup, test_input, expected):
     '''
     Test that the logging plugin can flush the buffer for partial
     log. If the next partial message didn't arrive in expected
-    time (default 5 sec), it should flush the buffer anyway. There
-    is an architectural restriction that the buffer flush can only
-    occur on receipt of a new message beyond the timeout of the buffer.
+    time (default 5 sec), it should flush the buffer anyway, even
+    if no new message arrives. The entries are written 10 seconds
+    apart, so every partial entry is flushed on its own.
     '''
     logging.getLogger().info("testing test_partial_log_flush_timeout input={0} \
                 expected={1} event(s)".format(test_input, expected))
@@ -158,8 +158,8 @@ def test_partial_log_flush_timeout_2(setup, test_input, expected):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 70 seconds to allow messages to be sent
-    time.sleep(70)
+    # wait up to 70 seconds for the messages to be sent
+    wait_for_events(u_id, expected, 70, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
@@ -195,8 +195,8 @@ def test_partial_log_flush_size_limit(setup):
                           setup["splunk_hec_url"],
                           setup["splunk_hec_token"])
 
-    # wait for 15 seconds to allow messages to be sent
-    time.sleep(15)
+    # wait up to 15 seconds for the messages to be sent
+    wait_for_events(u_id, 2, 15, hec=setup["local_hec"])
     request_stop_logging(file_path)
 
     # check that events get to splunk
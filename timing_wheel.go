@@ -0,0 +1,102 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"sync"
+	"time"
+)
+
+const timingWheelSlots = 64
+
+type wheelTimer struct {
+	// full turns of the wheel left before the timer fires
+	rounds int
+	fn     func()
+}
+
+/*
+timingWheel runs callbacks after a delay with the precision of one tick. All the
+timers share one goroutine, which only runs while there are timers scheduled.
+Timers cannot be stopped, callers ignore callbacks they no longer need.
+*/
+type timingWheel struct {
+	tick time.Duration
+
+	mu      sync.Mutex
+	slots   [timingWheelSlots][]*wheelTimer
+	pos     int
+	count   int
+	running bool
+}
+
+func newTimingWheel(tick time.Duration) *timingWheel {
+	return &timingWheel{tick: tick}
+}
+
+// schedule runs fn in its own goroutine after delay
+func (w *timingWheel) schedule(delay time.Duration, fn func()) {
+	ticks := int((delay + w.tick - 1) / w.tick)
+	if ticks < 1 {
+		ticks = 1
+	}
+	w.mu.Lock()
+	defer w.mu.Unlock()
+	slot := (w.pos + ticks) % timingWheelSlots
+	w.slots[slot] = append(w.slots[slot], &wheelTimer{rounds: (ticks - 1) / timingWheelSlots, fn: fn})
+	w.count++
+	if !w.running {
+		w.running = true
+		go w.run()
+	}
+}
+
+func (w *timingWheel) run() {
+	ticker := time.NewTicker(w.tick)
+	defer ticker.Stop()
+	for range ticker.C {
+		w.mu.Lock()
+		w.pos = (w.pos + 1) % timingWheelSlots
+		var due []*wheelTimer
+		pending := w.slots[w.pos][:0]
+		for _, timer := range w.slots[w.pos] {
+			if timer.rounds > 0 {
+				timer.rounds--
+				pending = append(pending, timer)
+			} else {
+				due = append(due, timer)
+			}
+		}
+		for i := len(pending); i < len(w.slots[w.pos]); i++ {
+			w.slots[w.pos][i] = nil
+		}
+		w.slots[w.pos] = pending
+		w.count -= len(due)
+		idle := w.count == 0
+		if idle {
+			w.running = false
+		}
+		w.mu.Unlock()
+
+		for _, timer := range due {
+			go timer.fn()
+		}
+		if idle {
+			return
+		}
+	}
+}
@@ -0,0 +1,53 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"testing"
+	"time"
+)
+
+// Verify that timers fire in order of their delay, including delays
+// longer than one turn of the wheel
+func TestTimingWheel(t *testing.T) {
+	w := newTimingWheel(time.Millisecond)
+	fired := make(chan int, 3)
+	start := time.Now()
+	w.schedule(100*time.Millisecond, func() { fired <- 100 })
+	w.schedule(5*time.Millisecond, func() { fired <- 5 })
+	w.schedule(30*time.Millisecond, func() { fired <- 30 })
+
+	for _, expected := range []int{5, 30, 100} {
+		select {
+		case delay := <-fired:
+			if delay != expected {
+				t.Fatalf("Timer %dms fired, expected %dms", delay, expected)
+			}
+			if elapsed := time.Since(start); elapsed < time.Duration(delay)*time.Millisecond {
+				t.Fatalf("Timer %dms fired after %v", delay, elapsed)
+			}
+		case <-time.After(5 * time.Second):
+			t.Fatalf("Timer %dms did not fire", expected)
+		}
+	}
+
+	w.mu.Lock()
+	defer w.mu.Unlock()
+	if w.count != 0 {
+		t.Fatalf("Unexpected timers left %d", w.count)
+	}
+}
@@ -0,0 +1,365 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"context"
+	"crypto/tls"
+	"crypto/x509"
+	"fmt"
+	"io/ioutil"
+	"math/rand"
+	"net"
+	"net/http"
+	"net/http/httptrace"
+	"os"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/Sirupsen/logrus"
+)
+
+const (
+	// Maximum number of idle connections kept per HEC endpoint
+	defaultTransportMaxIdleConns = 100
+	// How long an idle connection is kept in the pool
+	defaultTransportIdleConnTimeout = 90 * time.Second
+	// How long resolved addresses of HEC endpoints are cached
+	defaultDNSCacheTTL = 30 * time.Second
+	// Number of TLS sessions kept for resumption per HEC endpoint
+	tlsSessionCacheSize = 64
+
+	transportDialTimeout           = 30 * time.Second
+	transportDialKeepAlive         = 30 * time.Second
+	transportTLSHandshakeTimeout   = 10 * time.Second
+	transportExpectContinueTimeout = 1 * time.Second
+)
+
+const (
+	envVarTransportMaxIdleConns    = "SPLUNK_LOGGING_DRIVER_MAX_IDLE_CONNS"
+	envVarTransportIdleConnTimeout = "SPLUNK_LOGGING_DRIVER_IDLE_CONN_TIMEOUT"
+	envVarDNSCacheTTL              = "SPLUNK_LOGGING_DRIVER_DNS_CACHE_TTL"
+)
+
+// transportKey identifies HEC endpoints which can share one connection pool.
+// Containers with identical endpoint and TLS settings get the same transport.
+type transportKey struct {
+	scheme             string
+	host               string
+	insecureSkipVerify bool
+	caPath             string
+	caModTime          int64
+	caName             string
+}
+
+// sharedTransport is a connection pool used by all loggers with the same transportKey
+type sharedTransport struct {
+	key       transportKey
+	transport *http.Transport
+	client    *http.Client
+	refs      int
+	// closed once the last logger released the transport
+	done chan struct{}
+
+	// circuit breaker of the endpoint, see endpoints.go
+	health struct {
+		sync.Mutex
+		threshold int
+		interval  time.Duration
+		failures  int
+		open      bool
+		probing   bool
+	}
+
+	// connection statistics, updated atomically
+	connsOpened  int64
+	connsOpen    int64
+	requests     int64
+	connsReused  int64
+	dialFailures int64
+	// requests in flight and breaker statistics, updated atomically
+	outstanding  int64
+	breakerTrips int64
+
+	// order of the requests of the loggers when the endpoint is busy
+	fair *fairQueue
+}
+
+type transportRegistry struct {
+	mu      sync.Mutex
+	entries map[transportKey]*sharedTransport
+	dns     *dnsCache
+}
+
+var transports = newTransportRegistry()
+
+func newTransportRegistry() *transportRegistry {
+	return &transportRegistry{
+		entries: make(map[transportKey]*sharedTransport),
+		dns: &dnsCache{
+			ttl:     getAdvancedOptionDuration(envVarDNSCacheTTL, defaultDNSCacheTTL),
+			entries: make(map[string]*dnsCacheEntry),
+		},
+	}
+}
+
+// newTransportKey builds the registry key from the log options of a container.
+// Only the modification time of the CA file is read here, the file itself is read
+// once per pool.
+func newTransportKey(scheme string, host string, config map[string]string, insecureSkipVerify bool) (transportKey, error) {
+	key := transportKey{
+		scheme:             scheme,
+		host:               host,
+		insecureSkipVerify: insecureSkipVerify,
+		caName:             config[splunkCANameKey],
+	}
+	if caPath, ok := config[splunkCAPathKey]; ok {
+		stat, err := os.Stat(caPath)
+		if err != nil {
+			return key, err
+		}
+		key.caPath = caPath
+		key.caModTime = stat.ModTime().UnixNano()
+	}
+	return key, nil
+}
+
+// acquire returns the shared transport for the key, creating it on first use.
+// Every call should be paired with release.
+func (r *transportRegistry) acquire(key transportKey) (*sharedTransport, error) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	if shared, ok := r.entries[key]; ok {
+		shared.refs++
+		logrus.WithField("host", key.host).WithField("refs", shared.refs).Debug("Reusing HEC transport")
+		return shared, nil
+	}
+
+	tlsConfig := &tls.Config{
+		InsecureSkipVerify: key.insecureSkipVerify,
+		ServerName:         key.caName,
+		ClientSessionCache: tls.NewLRUClientSessionCache(tlsSessionCacheSize),
+	}
+	if key.caPath != "" {
+		caCert, err := ioutil.ReadFile(key.caPath)
+		if err != nil {
+			return nil, err
+		}
+		caPool := x509.NewCertPool()
+		caPool.AppendCertsFromPEM(caCert)
+		tlsConfig.RootCAs = caPool
+	}
+
+	maxIdleConns := getAdvancedOptionInt(envVarTransportMaxIdleConns, defaultTransportMaxIdleConns)
+	shared := &sharedTransport{key: key, refs: 1, done: make(chan struct{})}
+	shared.health.threshold = getAdvancedOptionInt(envVarBreakerFailures, defaultBreakerFailures)
+	shared.health.interval = getAdvancedOptionDuration(envVarHealthCheckInterval, defaultHealthCheckInterval)
+	shared.fair = newFairQueue(getAdvancedOptionInt(envVarEndpointConcurrency, defaultEndpointConcurrency))
+	shared.transport = &http.Transport{
+		Proxy:                 http.ProxyFromEnvironment,
+		DialContext:           shared.dialContext(r.dns),
+		TLSClientConfig:       tlsConfig,
+		TLSHandshakeTimeout:   transportTLSHandshakeTimeout,
+		MaxIdleConns:          maxIdleConns,
+		MaxIdleConnsPerHost:   maxIdleConns,
+		IdleConnTimeout:       getAdvancedOptionDuration(envVarTransportIdleConnTimeout, defaultTransportIdleConnTimeout),
+		ExpectContinueTimeout: transportExpectContinueTimeout,
+	}
+	shared.client = &http.Client{
+		Transport: shared.transport,
+	}
+	r.entries[key] = shared
+	logrus.WithField("host", key.host).Debug("Created HEC transport")
+	return shared, nil
+}
+
+// release drops a reference to the shared transport. The last logger to release
+// it closes the idle connections and removes it from the registry.
+func (r *transportRegistry) release(shared *sharedTransport) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	shared.refs--
+	if shared.refs > 0 {
+		return
+	}
+	if r.entries[shared.key] == shared {
+		delete(r.entries, shared.key)
+	}
+	close(shared.done)
+	shared.transport.CloseIdleConnections()
+	logrus.WithField("host", shared.key.host).
+		WithField("connsOpened", atomic.LoadInt64(&shared.connsOpened)).
+		WithField("requests", atomic.LoadInt64(&shared.requests)).
+		WithField("reuseRate", shared.reuseRate()).
+		Info("Closed HEC transport")
+}
+
+// stats returns a snapshot of every shared transport, used for reporting
+func (r *transportRegistry) stats() []transportStats {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+	stats := make([]transportStats, 0, len(r.entries))
+	for _, shared := range r.entries {
+		stats = append(stats, transportStats{
+			Host:         shared.key.scheme + "://" + shared.key.host,
+			Loggers:      shared.refs,
+			ConnsOpened:  atomic.LoadInt64(&shared.connsOpened),
+			ConnsOpen:    atomic.LoadInt64(&shared.connsOpen),
+			Requests:     atomic.LoadInt64(&shared.requests),
+			ConnsReused:  atomic.LoadInt64(&shared.connsReused),
+			DialFailures: atomic.LoadInt64(&shared.dialFailures),
+			Outstanding:  atomic.LoadInt64(&shared.outstanding),
+			BreakerOpen:  !shared.available(),
+			BreakerTrips: atomic.LoadInt64(&shared.breakerTrips),
+			FairWaiting:  shared.fair.depth(),
+			FairWaits:    atomic.LoadInt64(&shared.fair.waits),
+		})
+	}
+	return stats
+}
+
+type transportStats struct {
+	Host         string
+	Loggers      int
+	ConnsOpened  int64
+	ConnsOpen    int64
+	Requests     int64
+	ConnsReused  int64
+	DialFailures int64
+	Outstanding  int64
+	BreakerOpen  bool
+	BreakerTrips int64
+	FairWaiting  int
+	FairWaits    int64
+}
+
+func (shared *sharedTransport) reuseRate() float64 {
+	requests := atomic.LoadInt64(&shared.requests)
+	if requests == 0 {
+		return 0
+	}
+	return float64(atomic.LoadInt64(&shared.connsReused)) / float64(requests)
+}
+
+// trace returns a request with a client trace which counts reused connections
+func (shared *sharedTransport) trace(req *http.Request) *http.Request {
+	trace := &httptrace.ClientTrace{
+		GotConn: func(info httptrace.GotConnInfo) {
+			atomic.AddInt64(&shared.requests, 1)
+			if info.Reused {
+				atomic.AddInt64(&shared.connsReused, 1)
+			}
+		},
+	}
+	return req.WithContext(httptrace.WithClientTrace(req.Context(), trace))
+}
+
+func (shared *sharedTransport) dialContext(dns *dnsCache) func(ctx context.Context, network, addr string) (net.Conn, error) {
+	dialer := &net.Dialer{
+		Timeout:   transportDialTimeout,
+		KeepAlive: transportDialKeepAlive,
+	}
+	return func(ctx context.Context, network, addr string) (net.Conn, error) {
+		conn, err := dns.dial(ctx, dialer, network, addr)
+		if err != nil {
+			atomic.AddInt64(&shared.dialFailures, 1)
+			return nil, err
+		}
+		atomic.AddInt64(&shared.connsOpened, 1)
+		atomic.AddInt64(&shared.connsOpen, 1)
+		return &countedConn{Conn: conn, shared: shared}, nil
+	}
+}
+
+// countedConn keeps track of the number of open connections of a shared transport
+type countedConn struct {
+	net.Conn
+	shared *sharedTransport
+	closed int32
+}
+
+func (c *countedConn) Close() error {
+	if atomic.CompareAndSwapInt32(&c.closed, 0, 1) {
+		atomic.AddInt64(&c.shared.connsOpen, -1)
+	}
+	return c.Conn.Close()
+}
+
+type dnsCacheEntry struct {
+	addrs   []string
+	expires time.Time
+}
+
+// dnsCache keeps resolved addresses of HEC endpoints for a short time,
+// so new connections to the same endpoint do not wait for a lookup
+type dnsCache struct {
+	mu      sync.Mutex
+	ttl     time.Duration
+	entries map[string]*dnsCacheEntry
+}
+
+func (c *dnsCache) lookup(ctx context.Context, host string) ([]string, error) {
+	if c.ttl <= 0 || net.ParseIP(host) != nil {
+		return []string{host}, nil
+	}
+	now := time.Now()
+	c.mu.Lock()
+	entry, ok := c.entries[host]
+	c.mu.Unlock()
+	if ok && now.Before(entry.expires) {
+		return entry.addrs, nil
+	}
+	addrs, err := net.DefaultResolver.LookupHost(ctx, host)
+	if err != nil {
+		// Keep using stale addresses if the resolver is not available
+		if ok {
+			logrus.WithField("host", host).WithError(err).Warn("Using expired DNS cache entry")
+			return entry.addrs, nil
+		}
+		return nil, err
+	}
+	c.mu.Lock()
+	c.entries[host] = &dnsCacheEntry{addrs: addrs, expires: now.Add(c.ttl)}
+	c.mu.Unlock()
+	return addrs, nil
+}
+
+// dial resolves the host through the cache and tries the addresses
+// starting from a random one to spread connections
+func (c *dnsCache) dial(ctx context.Context, dialer *net.Dialer, network, addr string) (net.Conn, error) {
+	host, port, err := net.SplitHostPort(addr)
+	if err != nil {
+		return nil, err
+	}
+	addrs, err := c.lookup(ctx, host)
+	if err != nil {
+		return nil, err
+	}
+	if len(addrs) == 0 {
+		return nil, fmt.Errorf("%s: no addresses found for %s", driverName, host)
+	}
+	start := rand.Intn(len(addrs))
+	for i := range addrs {
+		var conn net.Conn
+		conn, err = dialer.DialContext(ctx, network, net.JoinHostPort(addrs[(start+i)%len(addrs)], port))
+		if err == nil {
+			return conn, nil
+		}
+	}
+	return nil, err
+}
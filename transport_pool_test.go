@@ -0,0 +1,101 @@
+/*
+ * Copyright 2018 Splunk, Inc..
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+package main
+
+import (
+	"testing"
+
+	"github.com/docker/docker/daemon/logger"
+)
+
+// Loggers with the same endpoint and TLS settings should share one transport
+func TestSharedTransport(t *testing.T) {
+	hec := NewHTTPEventCollectorMock(t)
+	go hec.Serve()
+
+	newLogger := func(config map[string]string) *splunkLoggerInline {
+		config[splunkURLKey] = hec.URL()
+		config[splunkTokenKey] = hec.token
+		info := logger.Info{
+			Config:             config,
+			ContainerID:        "containeriid",
+			ContainerName:      "/container_name",
+			ContainerImageID:   "contaimageid",
+			ContainerImageName: "container_image_name",
+		}
+		loggerDriver, err := New(info)
+		if err != nil {
+			t.Fatal(err)
+		}
+		return loggerDriver.(*splunkLoggerInline)
+	}
+
+	logger1 := newLogger(map[string]string{})
+	logger2 := newLogger(map[string]string{})
+	logger3 := newLogger(map[string]string{splunkInsecureSkipVerifyKey: "true"})
+
+	if logger1.hec.endpoints[0].shared.transport != logger2.hec.endpoints[0].shared.transport {
+		t.Fatal("Loggers with identical settings should share the transport")
+	}
+
+	if logger1.hec.endpoints[0].shared.transport == logger3.hec.endpoints[0].shared.transport {
+		t.Fatal("Loggers with different TLS settings should not share the transport")
+	}
+
+	if logger1.hec.endpoints[0].shared.refs != 2 {
+		t.Fatalf("Unexpected number of references %d", logger1.hec.endpoints[0].shared.refs)
+	}
+
+	for _, l := range []*splunkLoggerInline{logger1, logger2, logger3} {
+		if err := l.Close(); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	for _, stats := range transports.stats() {
+		if stats.Host == hec.URL() {
+			t.Fatal("Transports should be released when all loggers are closed")
+		}
+	}
+
+	err := hec.Close()
+	if err != nil {
+		t.Fatal(err)
+	}
+}
+
+// Missing root certificate should fail the logger before the transport is created
+func TestSharedTransportMissingCA(t *testing.T) {
+	info := logger.Info{
+		Config: map[string]string{
+			splunkURLKey:    "https://127.0.0.1:8088",
+			splunkTokenKey:  "4642492F-D8BD-47F1-A005-0C08AE4657DF",
+			splunkCAPathKey: "/path/does/not/exist.pem",
+		},
+		ContainerID: "containeriid",
+	}
+
+	if _, err := New(info); err == nil {
+		t.Fatal("Expecting error when root certificate does not exist")
+	}
+
+	for _, stats := range transports.stats() {
+		if stats.Host == "https://127.0.0.1:8088" {
+			t.Fatal("No transport should be created")
+		}
+	}
+}